@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from marvel.api_schema import FINGERPRINT_KEY
+from marvel.urls import schema_view
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera el esquema OpenAPI de la API y lo guarda en '
+        'settings.API_SCHEMA_ARTIFACT, que es el que sirve la documentación '
+        '(api-docs/swagger y api-docs/redoc). Correrlo en cada deploy o '
+        'después de cambiar vistas, serializadores o sus docstrings.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default=settings.API_SCHEMA_ARTIFACT,
+            help='Archivo de salida (por defecto settings.API_SCHEMA_ARTIFACT).'
+        )
+
+    def handle(self, *args, **options):
+        spec = schema_view.write_artifact(options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Esquema con {len(spec.get("paths", {}))} rutas guardado en '
+            f'{options["output"]} ({FINGERPRINT_KEY}: {spec[FINGERPRINT_KEY]}).'
+        ))
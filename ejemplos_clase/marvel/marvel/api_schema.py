@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from drf_yasg.codecs import OpenAPICodecJson, yaml_sane_dump
+from drf_yasg.renderers import _SpecRenderer
+from drf_yasg.views import get_schema_view
+
+
+# NOTE: Clave propia ("x-...", permitida por OpenAPI) que guardamos en el
+# archivo del esquema para saber con qué URLconf se generó.
+FINGERPRINT_KEY = 'x-urlconf-fingerprint'
+
+
+def urlconf_fingerprint(urlconf=None):
+    '''
+    Hash de las URLs del proyecto: cada patrón junto con la vista que
+    atiende. Cambia si se agrega, quita o mueve una URL o una vista.
+    '''
+    digest = hashlib.sha256()
+
+    def walk(patterns, prefix):
+        for pattern in patterns:
+            route = prefix + str(pattern.pattern)
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns, route)
+            elif isinstance(pattern, URLPattern):
+                callback = pattern.callback
+                view = getattr(callback, 'cls', None) or getattr(
+                    callback, 'view_class', callback
+                )
+                digest.update(
+                    f'{route} {view.__module__}.{view.__qualname__}\n'.encode()
+                )
+
+    walk(get_resolver(urlconf).url_patterns, '')
+    return digest.hexdigest()[:16]
+
+
+def get_cached_schema_view(info, artifact=None, **kwargs):
+    '''
+    Igual que `get_schema_view()` de drf_yasg, pero el esquema (JSON y
+    YAML) se genera una sola vez por proceso en lugar de en cada request.
+
+    Al arrancar se lee de `artifact` (un archivo .json, ver el comando
+    "manage.py build_api_schema"); si no existe o se generó con otras URLs
+    se genera y se vuelve a guardar. Las respuestas llevan ETag, así el
+    navegador no vuelve a descargar el esquema si no cambió.
+
+    NOTE: Sólo para esquemas públicos (public=True), que no dependen del
+    usuario que los pide. Los cambios en docstrings o serializadores que no
+    cambian las URLs requieren regenerar el archivo con el comando.
+    '''
+    base_view = get_schema_view(info, **kwargs)
+
+    class CachedSchemaView(base_view):
+        _lock = threading.Lock()
+        _spec = None
+        # {'json' | 'yaml': (etag, contenido)}
+        _rendered = {}
+
+        @classmethod
+        def generate_schema(cls):
+            '''
+            Genera el esquema completo, sin request, como dict.
+            '''
+            generator = cls.generator_class(info, '', None, None, None)
+            schema = generator.get_schema(None, True)
+            # Pasamos por el codec de drf_yasg para obtener el mismo
+            # documento que devuelve la vista original.
+            spec = json.loads(OpenAPICodecJson(validators=[]).encode(schema))
+            spec[FINGERPRINT_KEY] = urlconf_fingerprint()
+            return spec
+
+        @classmethod
+        def write_artifact(cls, path=None):
+            '''
+            Genera el esquema y lo guarda en `path` (por defecto `artifact`).
+            Devuelve el esquema generado.
+            '''
+            path = path or artifact
+            spec = cls.generate_schema()
+            directory = os.path.dirname(os.path.abspath(path))
+            # Se escribe en un archivo temporal y se renombra, así otro
+            # proceso nunca lee un archivo a medio escribir.
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                    json.dump(spec, file, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            return spec
+
+        @classmethod
+        def load_schema(cls):
+            '''
+            Devuelve el esquema de `artifact` si corresponde a las URLs
+            actuales; si no, lo genera e intenta guardarlo.
+            '''
+            if artifact:
+                try:
+                    with open(artifact, encoding='utf-8') as file:
+                        spec = json.load(file)
+                    if spec.get(FINGERPRINT_KEY) == urlconf_fingerprint():
+                        return spec
+                except (OSError, ValueError):
+                    pass
+                try:
+                    return cls.write_artifact()
+                except OSError:
+                    pass
+            return cls.generate_schema()
+
+        @classmethod
+        def get_rendered(cls, kind):
+            '''
+            Devuelve `(etag, contenido)` del esquema en formato `kind`
+            ('json' o 'yaml'), generándolo la primera vez.
+            '''
+            rendered = cls._rendered.get(kind)
+            if rendered is None:
+                with cls._lock:
+                    if cls._spec is None:
+                        cls._spec = cls.load_schema()
+                    if kind == 'yaml':
+                        content = yaml_sane_dump(cls._spec, binary=True)
+                    else:
+                        content = json.dumps(
+                            cls._spec, ensure_ascii=False
+                        ).encode()
+                    etag = f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+                    rendered = cls._rendered[kind] = (etag, content)
+            return rendered
+
+        def get(self, request, version='', format=None):
+            renderer = request.accepted_renderer
+            # La página de Swagger/Redoc no incluye el esquema (lo pide
+            # después con "?format=openapi"), armarla es barato.
+            if not isinstance(renderer, _SpecRenderer):
+                return super().get(request, version, format)
+
+            kind = 'yaml' if 'yaml' in renderer.media_type else 'json'
+            etag, content = self.get_rendered(kind)
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                # NOTE: Ya está renderizado, devolvemos los bytes tal cual.
+                response = HttpResponse(
+                    content,
+                    content_type=f'{renderer.media_type}; charset=utf-8'
+                )
+            response['ETag'] = etag
+            patch_cache_control(response, no_cache=True)
+            return response
+
+    return CachedSchemaView
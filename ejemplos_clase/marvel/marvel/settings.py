@@ -232,6 +232,13 @@ SWAGGER_SETTINGS = {
     'LOGOUT_URL': LOGOUT_URL
 }
 
+# Archivo con el esquema OpenAPI ya generado que sirve la documentación.
+# Se regenera con "python manage.py build_api_schema", o solo si cambian
+# las URLs del proyecto.
+API_SCHEMA_ARTIFACT = os.environ.get(
+    'API_SCHEMA_ARTIFACT', os.path.join(BASE_DIR, 'api-schema.json')
+)
+
 # Acá van todas las configuraciones para la UI de Redoc.
 REDOC_SETTINGS = {
    'LAZY_RENDERING': False,
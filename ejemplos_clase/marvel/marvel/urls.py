@@ -13,12 +13,14 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
 from rest_framework import permissions
 from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
+
+from marvel.api_schema import get_cached_schema_view
 
 
 
@@ -35,7 +37,10 @@ Donde <b>92937874f377a1ea17f7637ee07208622e5cb5e6</b> es un ejemplo del <b>Token
 </p>
 '''
 
-schema_view = get_schema_view(
+# NOTE: El esquema se genera una vez y se guarda en API_SCHEMA_ARTIFACT
+# (ver marvel/api_schema.py y "manage.py build_api_schema"), en lugar de
+# recorrer todas las vistas en cada visita a la documentación.
+schema_view = get_cached_schema_view(
    openapi.Info(
       title="Inove Marvel e-commerce",
       default_version='1.0.0',
@@ -43,6 +48,7 @@ schema_view = get_schema_view(
       contact=openapi.Contact(email="info@inove.com.ar"),
       license=openapi.License(name="Inove Coding School."),
    ),
+   artifact=settings.API_SCHEMA_ARTIFACT,
    public=True,
    permission_classes=(permissions.IsAuthenticatedOrReadOnly,),
 )
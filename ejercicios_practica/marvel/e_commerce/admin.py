@@ -2,6 +2,7 @@ from django.contrib import admin
 
 # NOTE: Tenemos que importar los modelos con los que vamos a trabajar:
 from e_commerce.models import *
+from e_commerce.admin_tools import EstimatedCountPaginator, NumericRangeFilter
 
 # Register your models here.
 
@@ -12,12 +13,32 @@ class ComicsAdmin(admin.ModelAdmin):
     # NOTE: Para seleccionar los campos en la tabla de registros
     list_display = ('marvel_id', 'title', 'stock_qty', 'price')
 
-    # NOTE: Filtro lateral de elementos:
-    list_filter= ('marvel_id','title')
-    
+    # NOTE: Filtro lateral de elementos. Filtrar por valores exactos de
+    # 'marvel_id' o 'title' listaría un link por cada comic (y un SELECT
+    # DISTINCT de toda la tabla); con rangos no hace falta consultar nada.
+    list_filter = (
+        ('marvel_id', NumericRangeFilter),
+        ('price', NumericRangeFilter),
+        ('stock_qty', NumericRangeFilter),
+    )
+
+    # NOTE: En tablas grandes no contamos todas las filas (ver admin_tools.py).
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Orden por una columna con índice único (lo usa también el
+    # autocompletado de comics en el admin de WishList).
+    ordering = ('marvel_id',)
+
     # NOTE: Buscador de elementos en la columna:
     search_fields = ['title']
 
+    def get_search_results(self, request, queryset, search_term):
+        # NOTE: En vez de "title ILIKE '%...%'", que recorre toda la tabla,
+        # buscamos igual que la API comics/search, con sus índices.
+        if not search_term.strip():
+            return queryset, False
+        return queryset.search(search_term.strip()), False
+
     # NOTE: Para seleccionar los campos en el registro. 
     # fields = ('marvel_id', 'title', 'stock_qty')
 
@@ -38,3 +59,23 @@ class wish_listAdmin(admin.ModelAdmin):
     list_display = ('user', 'comic', 'favorite', 'cart')
     list_display_links = ('user', 'comic')
     list_filter= ('favorite','cart')
+    # NOTE: Trae el usuario y el comic de cada fila en la misma consulta,
+    # en vez de una consulta por fila para mostrarlos.
+    list_select_related = ('user', 'comic')
+    # Buscador por nombre de usuario o marvel id (ver get_search_results).
+    search_fields = ('user__username', 'comic__marvel_id')
+    # NOTE: En el formulario, buscador en vez de un <select> con todos los
+    # usuarios y comics (usa los search_fields de sus admins).
+    autocomplete_fields = ('user', 'comic')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # NOTE: Búsqueda exacta, que usa los índices únicos de
+        # "marvel_id" y "username" en vez de recorrer las tablas con ILIKE.
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(comic__marvel_id=int(search_term)), False
+        return queryset.filter(user__username=search_term), False
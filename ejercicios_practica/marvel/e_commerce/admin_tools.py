@@ -0,0 +1,94 @@
+from django.contrib import admin
+from django.contrib.admin.views.main import (
+    IS_POPUP_VAR, ORDER_VAR, SEARCH_VAR, TO_FIELD_VAR
+)
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class NumericRangeFilter(admin.FieldListFilter):
+    '''
+    Filtro lateral del admin para campos numéricos con dos campos de texto,
+    "desde" y "hasta" (`campo__gte` y `campo__lte`).
+
+    A diferencia del filtro por defecto no consulta los valores distintos
+    del campo (SELECT DISTINCT sobre toda la tabla) ni muestra un link por
+    cada uno. Uso:
+        list_filter = (('price', NumericRangeFilter),)
+    '''
+    template = 'admin/e_commerce/numeric_range_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_gte = f'{field_path}__gte'
+        self.lookup_lte = f'{field_path}__lte'
+        super().__init__(field, request, params, model, model_admin, field_path)
+        # Un campo que se deja vacío en el formulario no filtra.
+        self.used_parameters = {
+            name: value for name, value in self.used_parameters.items()
+            if value != ''
+        }
+
+    def expected_parameters(self):
+        return [self.lookup_gte, self.lookup_lte]
+
+    def choices(self, changelist):
+        # NOTE: El template arma un formulario GET, así que además de los
+        # valores de este filtro necesita el resto de los parámetros de la
+        # página (otros filtros, búsqueda, orden) como campos ocultos.
+        yield {
+            'selected': bool(self.used_parameters),
+            'gte': self.used_parameters.get(self.lookup_gte, ''),
+            'lte': self.used_parameters.get(self.lookup_lte, ''),
+            'lookup_gte': self.lookup_gte,
+            'lookup_lte': self.lookup_lte,
+            'hidden_params': [
+                (name, value)
+                for name, value in changelist.get_filters_params().items()
+                if name not in self.expected_parameters()
+            ] + [
+                (name, changelist.params[name])
+                for name in (SEARCH_VAR, ORDER_VAR, IS_POPUP_VAR, TO_FIELD_VAR)
+                if name in changelist.params
+            ],
+            'reset_query_string': changelist.get_query_string(
+                remove=self.expected_parameters()
+            ),
+        }
+
+
+class EstimatedCountPaginator(Paginator):
+    '''
+    Paginator que en Postgres, para tablas grandes sin filtrar, usa la
+    cantidad de filas estimada por el planificador (pg_class.reltuples,
+    actualizada por ANALYZE y autovacuum) en vez de un COUNT(*) que
+    recorre toda la tabla.
+
+    Las listas filtradas o de menos de `estimate_threshold` filas se
+    cuentan normalmente. Con la estimación el total de páginas es
+    aproximado.
+    '''
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        estimate = self.estimated_count()
+        if estimate is not None and estimate >= self.estimate_threshold:
+            return estimate
+        return super().count
+
+    def estimated_count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is None or query.where or query.distinct:
+            return None
+        connection = connections[self.object_list.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                [connection.ops.quote_name(query.model._meta.db_table)]
+            )
+            row = cursor.fetchone()
+        # reltuples es -1 (o 0) si la tabla todavía no se analizó.
+        return int(row[0]) if row and row[0] > 0 else None
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 
 # (GET - ListAPIView) Listar todos los elementos en la entidad:
@@ -21,18 +22,26 @@ from rest_framework.generics import (
 from rest_framework.views import APIView
 # Importamos librerías para gestionar los permisos de acceso a nuestras APIs
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.authentication import (
     BasicAuthentication, TokenAuthentication
 )
-from rest_framework.authtoken.models import Token
-from rest_framework.parsers import JSONParser
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from e_commerce.api.caching import CatalogCachedGetMixin
+from e_commerce.api.login_views import get_login_token
+from e_commerce.api.marvel_client import get_marvel_client
+from e_commerce.api.page_cache import comics_page_cache
+from e_commerce.api.pagination import (
+    ComicCursorPagination, ComicSearchPagination
+)
+from e_commerce.api.parsers import FastJSONParser, NDJSONParser
 from e_commerce.api.serializers import *
 from e_commerce.models import Comic, WishList
+from marvel.profiling import timed
 
 
 mensaje_headder = '''
@@ -52,14 +61,47 @@ headers = {
 '''
 # NOTE: APIs genéricas:
 
-class GetComicAPIView(ListAPIView):
+
+class TimedSerializationMixin:
+    '''
+    Igual que `list()` y `retrieve()` de DRF, pero mide el tiempo de
+    serialización en "serialize" (header Server-Timing, ver
+    marvel/profiling.py). Las filas se leen antes de medir, así el tiempo
+    de las consultas queda sólo en "db".
+    '''
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        rows = list(queryset) if page is None else page
+        with timed('serialize'):
+            data = self.get_serializer(rows, many=True).data
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        with timed('serialize'):
+            data = self.get_serializer(instance).data
+        return Response(data)
+
+
+class GetComicAPIView(CatalogCachedGetMixin, ListAPIView):
     __doc__ = f'''{mensaje_headder}
     `[METODO GET]`
     Esta vista de API nos devuelve una lista de todos los comics presentes 
     en la base de datos.
+    Responde con `ETag`; si el request trae `If-None-Match` con ese valor
+    y el catálogo no cambió, devuelve `304` sin volver a enviar la lista.
+    La respuesta JSON queda en el cache hasta que cambie algún comic.
     '''
     queryset = Comic.objects.all()
     serializer_class = ComicSerializer
+    # Paginado opcional por cursor: comics/get?page_size=50
+    pagination_class = ComicCursorPagination
+    # Versión de sólo lectura de "serializer_class" para armar el listado.
+    fast_serializer = ValuesListSerializer(ComicSerializer)
 
     # Equivale a --> permission_classes = (IsAdminUser & IsAuthenticated,)
     permission_classes = (IsAuthenticated | IsAdminUser,)
@@ -72,6 +114,56 @@ class GetComicAPIView(ListAPIView):
     # Token Authentication
     # authentication_classes = [TokenAuthentication]
 
+    def list(self, request, *args, **kwargs):
+        # NOTE: El listado no necesita instancias del modelo: leemos tuplas
+        # con ".values_list()" y las convertimos directamente, lo que es
+        # varias veces más rápido que pasar por ComicSerializer y devuelve
+        # el mismo JSON (ver "manage.py bench_comic_serializer").
+        rows = self.fast_serializer.values_list(
+            self.filter_queryset(self.get_queryset())
+        )
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(
+                self.fast_serializer.serialize(page)
+            )
+        return Response(self.fast_serializer.serialize(rows))
+
+
+class SearchComicAPIView(ListAPIView):
+    __doc__ = f'''{mensaje_headder}
+    `[METODO GET]`
+    Busca comics por título y descripción: `comics/search?q=spider man`.
+    Tolera errores de tipeo en el título ("spidrman"). Los resultados
+    vienen del más al menos relevante ("score"), paginados por cursor:
+    seguir el link "next" para la página siguiente.
+    '''
+    queryset = Comic.objects.all()
+    serializer_class = ComicSearchSerializer
+    pagination_class = ComicSearchPagination
+    fast_serializer = ValuesListSerializer(ComicSearchSerializer)
+    permission_classes = (IsAuthenticated | IsAdminUser,)
+    # Más largo que esto no es una búsqueda razonable y sólo cuesta CPU.
+    max_query_length = 100
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'This query parameter is required.'})
+        if len(query) > self.max_query_length:
+            raise ValidationError({
+                'q': f'Ensure this value has at most '
+                     f'{self.max_query_length} characters.'
+            })
+        return super().get_queryset().search(query)
+
+    def list(self, request, *args, **kwargs):
+        # NOTE: Igual que GetComicAPIView, leemos tuplas en vez de modelos.
+        page = self.paginate_queryset(
+            self.fast_serializer.values_list(self.get_queryset())
+        )
+        return self.get_paginated_response(self.fast_serializer.serialize(page))
+
 
 class PostComicAPIView(CreateAPIView):
     __doc__ = f'''{mensaje_headder}
@@ -83,7 +175,40 @@ class PostComicAPIView(CreateAPIView):
     permission_classes = (IsAuthenticated & IsAdminUser,)
 
 
-class ListCreateComicAPIView(ListCreateAPIView):
+class BulkComicAPIView(GenericAPIView):
+    __doc__ = f'''{mensaje_headder}
+    `[METODO POST]`
+    Inserta o actualiza muchos comics en un solo request (hasta 10000).
+    Recibe una lista JSON o NDJSON (`Content-Type: application/x-ndjson`,
+    un comic por línea):
+    [{{"marvel_id": 1, "title": "...", "price": 2.5, "stock_qty": 10}}, ...]
+    Los "marvel_id" que no existen se crean; los que ya existen sólo
+    actualizan "price" y "stock_qty" (los que vengan).
+    Si algún comic no es válido no se escribe ninguno y se devuelven los
+    errores de cada uno, en el mismo orden. Si no, devuelve el resultado
+    de cada comic ("created", "updated" o "unchanged").
+    '''
+    queryset = Comic.objects.all()
+    serializer_class = ComicBulkSerializer
+    permission_classes = (IsAuthenticated & IsAdminUser,)
+    parser_classes = (FastJSONParser, NDJSONParser)
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        # NOTE: Todos los lotes en una transacción: o se escriben todos los
+        # comics o ninguno.
+        with transaction.atomic():
+            results = serializer.save()
+        summary = {'created': 0, 'updated': 0, 'unchanged': 0}
+        for result in results:
+            summary[result['status']] += 1
+        return Response(
+            data={**summary, 'results': results}, status=status.HTTP_200_OK
+        )
+
+
+class ListCreateComicAPIView(TimedSerializationMixin, ListCreateAPIView):
     __doc__ = f'''{mensaje_headder}
     `[METODO GET-POST]`
     Esta vista de API nos devuelve una lista de todos los comics presentes 
@@ -92,10 +217,11 @@ class ListCreateComicAPIView(ListCreateAPIView):
     '''
     queryset = Comic.objects.all().order_by('marvel_id')
     serializer_class = ComicSerializer
+    pagination_class = ComicCursorPagination
     permission_classes = (IsAuthenticated & IsAdminUser,)
 
 
-class RetrieveUpdateComicAPIView(RetrieveUpdateAPIView):
+class RetrieveUpdateComicAPIView(TimedSerializationMixin, RetrieveUpdateAPIView):
     __doc__ = f'''{mensaje_headder}
     `[METODO GET-PUT-PATCH]`
     Esta vista de API nos permite actualizar un registro,
@@ -156,7 +282,9 @@ class DestroyComicAPIView(DestroyAPIView):
 #     queryset = Comic.objects.all()
 
 
-class GetOneComicAPIView(RetrieveAPIView):
+class GetOneComicAPIView(
+    CatalogCachedGetMixin, TimedSerializationMixin, RetrieveAPIView
+):
     __doc__ = f'''{mensaje_headder}
     `[METODO GET]`
     Esta vista de API nos devuelve un comic en particular de la base de datos.
@@ -177,7 +305,9 @@ class GetOneComicAPIView(RetrieveAPIView):
         return queryset
 
 
-class GetOneMarvelComicAPIView(RetrieveAPIView):
+class GetOneMarvelComicAPIView(
+    CatalogCachedGetMixin, TimedSerializationMixin, RetrieveAPIView
+):
     __doc__ = f'''{mensaje_headder}
     `[METODO GET]`
     Esta vista de API nos devuelve un comic en particular de la base de datos
@@ -253,7 +383,7 @@ class LoginUserAPIView(APIView):
     }
     ```
     '''
-    parser_classes = (JSONParser,)
+    parser_classes = (FastJSONParser,)
     # renderer_classes = [JSONRenderer]
     authentication_classes = ()
     permission_classes = ()
@@ -269,9 +399,12 @@ class LoginUserAPIView(APIView):
             # tratamos de obtener el TOKEN:
             _account = authenticate(username=_username, password=_password)
             if _account:
-                _token, _created = Token.objects.get_or_create(user=_account)
+                # NOTE: "get_login_token()" evita que dos logins simultáneos
+                # del mismo usuario fallen al crear el token, y la respuesta
+                # se arma sin volver a consultar el usuario ni sus relaciones.
+                _token = get_login_token(_account)
                 return Response(
-                    data=TokenSerializer(instance=_token, many=False).data,
+                    data=LoginTokenSerializer(instance=_token, many=False).data,
                     status=status.HTTP_200_OK
                 )
             return Response(
@@ -284,23 +417,77 @@ class LoginUserAPIView(APIView):
         )
 
 
+class MarvelCacheStatsAPIView(APIView):
+    __doc__ = f'''{mensaje_headder}
+    `[METODO GET]`
+    Esta vista de API nos devuelve los contadores del cache de páginas
+    de la API de Marvel (hits, misses, entradas, etc.) y el estado del
+    circuit breaker de este proceso.
+    '''
+    permission_classes = (IsAuthenticated & IsAdminUser,)
+
+    def get(self, request, *args, **kwargs):
+        data = comics_page_cache.stats()
+        data['circuit_breaker'] = get_marvel_client().breaker.stats()
+        return Response(data=data, status=status.HTTP_200_OK)
+
+
 # TODO: Agregar las vistas genericas(vistas de API basadas en clases) 
 # que permitan realizar un CRUD del modelo de wish-list.
 # TODO: Crear una vista generica modificada(vistas de API basadas en clases)
 # para traer todos los comics que tiene un usuario.
 
 
-class GetWishListAPIView(ListAPIView):
+class GetWishListAPIView(TimedSerializationMixin, ListAPIView):
     __doc__ = f'''{mensaje_headder}
     `[METODO GET]`
     Esta vista de API nos devuelve una lista de todos los WishList presentes 
     en la base de datos.
+    Con `?expand=comic` (o `?expand=comic,user`) cada fila trae anidados
+    los datos del comic (y del usuario) en lugar de sólo su id.
     '''
     queryset = WishList.objects.all()
     serializer_class = WishListSerializer
 
     # Equivale a --> permission_classes = (IsAdminUser & IsAuthenticated,)
     permission_classes = (IsAuthenticated | IsAdminUser,)
+
+    def get_expand(self):
+        '''
+        Devuelve la lista de relaciones pedidas en "?expand=".
+        '''
+        if self.request is None:
+            return []
+        expand = [
+            name for name in self.request.query_params.get('expand', '').split(',')
+            if name
+        ]
+        unknown = set(expand) - set(self.serializer_class.expandable_fields)
+        if unknown:
+            raise ValidationError(
+                {'expand': f'Unknown fields: {", ".join(sorted(unknown))}.'}
+            )
+        return expand
+
+    def get_queryset(self):
+        # NOTE: Las relaciones expandidas se traen en la misma consulta con
+        # un JOIN, así la lista completa cuesta un solo SELECT en lugar de
+        # uno por fila. Del usuario sólo leemos las columnas que se
+        # muestran (nada de password, etc.).
+        queryset = super().get_queryset()
+        expand = self.get_expand()
+        if expand:
+            queryset = queryset.select_related(*expand)
+        if 'user' in expand:
+            queryset = queryset.only(
+                *(field.name for field in WishList._meta.concrete_fields),
+                *(f'user__{name}' for name in WishListUserSerializer.Meta.fields),
+            )
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('expand', self.get_expand())
+        return super().get_serializer(*args, **kwargs)
     # Descomentar y mostrar en clases para ver las diferencias entre 
     # estos tipos de Authentication. Mostrar en Postman.
 
@@ -321,6 +508,28 @@ class PostWishListAPIView(CreateAPIView):
     permission_classes = (IsAuthenticated & IsAdminUser,)
 
 
+class BulkWishListAPIView(GenericAPIView):
+    __doc__ = f'''{mensaje_headder}
+    `[METODO POST]`
+    Aplica muchos cambios a la lista de deseos (y carrito) del usuario
+    autenticado en un solo request y una sola transacción (hasta 500):
+    [{{"comic": 1, "cart": true, "wished_qty": 2}}, {{"comic": 7, "favorite": true}}]
+    "comic" es el id del comic. Si el usuario todavía no tiene una fila
+    para ese comic se crea; si ya la tiene sólo se modifican los campos
+    que vienen. Si algún cambio no es válido no se aplica ninguno.
+    '''
+    queryset = WishList.objects.all()
+    serializer_class = WishListBulkSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            results = serializer.save(user=request.user)
+        return Response(data={'results': results}, status=status.HTTP_200_OK)
+
+
 
 # En este caso observamos como es el proceso de actualización "parcial"
 # utilizando el serializador para validar los datos que llegan del request.
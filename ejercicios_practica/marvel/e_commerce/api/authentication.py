@@ -0,0 +1,173 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from marvel.metrics import Counter
+
+
+# NOTE: Dónde se encontró cada token: "local" (LRU del proceso), "shared"
+# (cache de Django) o "database" (ver marvel/metrics.py).
+token_cache_lookups = Counter(
+    'auth_token_cache_lookups_total',
+    'Tokens validados por CachedTokenAuthentication.', ('result',)
+)
+
+
+class LocalTokenCache:
+    '''
+    Cache LRU en memoria, thread-safe, de los tokens ya validados por este
+    proceso (ver CachedTokenAuthentication). Cada entrada vence a los
+    `ttl` segundos.
+    '''
+
+    def __init__(self, max_entries=1024, ttl=5, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'TOKEN_AUTH_CACHE', {})
+        return cls(
+            max_entries=config.get('LOCAL_MAX_ENTRIES', 1024),
+            ttl=config.get('LOCAL_TIMEOUT', 5),
+        )
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if self.clock() - stored_at >= self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, self.clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''
+    Igual que TokenAuthentication, pero guarda los datos del token validado
+    (y de su usuario) en dos niveles de cache para no consultar la tabla
+    de tokens en cada request:
+
+    1. Un LRU en memoria del proceso, con un TTL de pocos segundos.
+    2. El cache de Django (settings.CACHES), compartido entre procesos si
+       se configura memcached, con un TTL un poco mayor.
+
+    En ningún nivel se guarda el token ni la contraseña del usuario: la
+    clave es un hash del token y el valor sólo trae los campos de
+    `cached_user_fields` y la fecha de creación del token.
+
+    Al borrar un token o modificar un usuario (por ejemplo al desactivarlo)
+    las señales de e_commerce/signals.py borran sus entradas del cache
+    compartido y del LRU del proceso que hizo el cambio. Los LRU de los
+    demás procesos pueden tardar hasta `LOCAL_TIMEOUT` segundos en
+    enterarse. Los cambios hechos con ".update()" no disparan señales: en
+    ese caso el cache compartido se actualiza recién al vencer.
+
+    Se configura con settings.TOKEN_AUTH_CACHE.
+    '''
+    cache_key_prefix = 'e_commerce:auth_token:'
+    # Campos del usuario que necesitan la autenticación y los permisos
+    # (IsAdminUser). El resto (incluida la contraseña) se carga de la base
+    # de datos recién si una vista lo usa.
+    cached_user_fields = (
+        'id', 'username', 'is_active', 'is_staff', 'is_superuser'
+    )
+
+    def __init__(self):
+        super().__init__()
+        config = getattr(settings, 'TOKEN_AUTH_CACHE', {})
+        self.cache_timeout = config.get('TIMEOUT', 60)
+
+    @classmethod
+    def cache_key(cls, key):
+        # NOTE: No usamos el token como clave: quien pueda leer el cache no
+        # debe poder obtener tokens válidos.
+        return cls.cache_key_prefix + hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def invalidate(cls, *keys):
+        '''
+        Borra los tokens `keys` de ambos niveles de cache.
+        '''
+        cache_keys = [cls.cache_key(key) for key in keys]
+        cache.delete_many(cache_keys)
+        for cache_key in cache_keys:
+            local_token_cache.delete(cache_key)
+
+    def authenticate_credentials(self, key):
+        cache_key = self.cache_key(key)
+        data = local_token_cache.get(cache_key)
+        if data is not None:
+            token_cache_lookups.inc(result='local')
+        else:
+            data = cache.get(cache_key)
+            if data is not None:
+                token_cache_lookups.inc(result='shared')
+            else:
+                token_cache_lookups.inc(result='database')
+                model = self.get_model()
+                try:
+                    token = model.objects.select_related('user').get(key=key)
+                except model.DoesNotExist:
+                    raise exceptions.AuthenticationFailed(_('Invalid token.'))
+                data = {
+                    'created': token.created,
+                    'user': tuple(
+                        getattr(token.user, name)
+                        for name in self.cached_user_fields
+                    ),
+                }
+                cache.set(cache_key, data, self.cache_timeout)
+            local_token_cache.set(cache_key, data)
+
+        user = dict(zip(self.cached_user_fields, data['user']))
+        if not user['is_active']:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        # NOTE: Cada request recibe su propio usuario y token, así lo que
+        # una vista les modifique no le llega a otro request. El usuario se
+        # arma como si viniera de un ".only()": los campos que no están en
+        # el cache quedan diferidos, y un ".save()" sólo escribe los
+        # cargados (no pisa la contraseña).
+        model = get_user_model()
+        names = [
+            field.attname for field in model._meta.concrete_fields
+            if field.attname in user
+        ]
+        user = model.from_db(None, names, [user[name] for name in names])
+        token = self.get_model()(key=key, user=user, created=data['created'])
+        return (user, token)
+
+
+# NOTE: Instancia compartida por todos los threads del proceso.
+local_token_cache = LocalTokenCache.from_settings()
@@ -0,0 +1,128 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers
+)
+from django.utils.http import http_date
+
+from e_commerce.catalog import get_catalog_version_with
+
+
+class CatalogConditionalGetMixin:
+    '''
+    Mixin para las vistas GET de comics que agrega los headers ETag y
+    Last-Modified a partir de la versión del catálogo
+    (ver e_commerce/catalog.py), sin hashear la respuesta.
+
+    Si el request trae "If-None-Match" (o "If-Modified-Since") y el
+    catálogo no cambió desde entonces, responde 304 Not Modified antes de
+    consultar la base de datos y de serializar. Va antes de la vista
+    genérica en la herencia:
+        class GetComicAPIView(CatalogConditionalGetMixin, ListAPIView):
+    '''
+
+    def get_etag(self, request, version):
+        # NOTE: La misma URL puede devolver JSON o la API navegable, por eso
+        # el formato es parte del ETag.
+        return f'"catalog-{version}-{request.accepted_renderer.format}"'
+
+    def get_cache_keys(self, request):
+        '''
+        Claves extra del cache que se leen junto con la versión del
+        catálogo, en una sola consulta.
+        '''
+        return ()
+
+    def get_catalog_response(self, request, version, cached, *args, **kwargs):
+        '''
+        Arma la respuesta cuando no corresponde un 304. `cached` son los
+        valores leídos de las claves de `get_cache_keys()`.
+        '''
+        return super().get(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        version, modified, cached = get_catalog_version_with(
+            self.get_cache_keys(request)
+        )
+        etag = self.get_etag(request, version)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=int(modified)
+        )
+        if response is None:
+            response = self.get_catalog_response(
+                request, version, cached, *args, **kwargs
+            )
+        if response.status_code not in (200, 304):
+            return response
+
+        response['ETag'] = etag
+        # NOTE: Last-Modified tiene resolución de segundos. Si el catálogo
+        # cambió en este mismo segundo podría volver a cambiar sin que el
+        # valor cambie, así que en ese caso no lo enviamos y el cliente
+        # sólo puede revalidar con el ETag.
+        if int(time.time()) > int(modified):
+            response['Last-Modified'] = http_date(int(modified))
+        # Los clientes pueden guardar la respuesta, pero deben revalidarla
+        # en cada uso (con If-None-Match), y nunca en caches compartidos.
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+
+class CatalogCachedGetMixin(CatalogConditionalGetMixin):
+    '''
+    Además de lo que hace CatalogConditionalGetMixin, guarda en el cache de
+    Django las respuestas JSON ya renderizadas, con clave URL completa
+    (incluye el query string), y junto a cada una la versión del catálogo
+    con la que se generó.
+
+    Cada request hace una sola consulta al cache, que trae la versión
+    actual y la respuesta guardada para su URL. Si la respuesta es de la
+    versión actual se devuelve tal cual, sin tocar la base de datos ni
+    serializar. Como la versión cambia con cada escritura en la tabla de
+    comics, después de una escritura nunca se sirve una respuesta vieja.
+    '''
+    # Segundos que se guarda cada respuesta (las de versiones viejas
+    # quedan sin uso hasta que vencen).
+    response_cache_timeout = 300
+    # Respuestas más grandes que esto (en bytes) no se guardan. 1 MiB es
+    # además el máximo por defecto de memcached.
+    response_cache_max_size = 1024 * 1024
+
+    def get_cache_keys(self, request):
+        # NOTE: La API navegable ("format" == "api") incluye datos del
+        # usuario y el token CSRF, así que sólo guardamos el JSON.
+        if request.accepted_renderer.format != 'json':
+            self.response_cache_key = None
+            return ()
+        url = request.build_absolute_uri().encode()
+        self.response_cache_key = (
+            f'e_commerce:response:{hashlib.md5(url).hexdigest()}'
+        )
+        return (self.response_cache_key,)
+
+    def get_catalog_response(self, request, version, cached, *args, **kwargs):
+        entry = cached.get(self.response_cache_key)
+        if entry is not None and entry[0] == version:
+            _, content_type, content = entry
+            return HttpResponse(content, content_type=content_type)
+
+        response = super().get_catalog_response(
+            request, version, cached, *args, **kwargs
+        )
+        if self.response_cache_key is not None and response.status_code == 200:
+            key = self.response_cache_key
+
+            def store(response):
+                if len(response.content) <= self.response_cache_max_size:
+                    cache.set(
+                        key,
+                        (version, response['Content-Type'], response.content),
+                        self.response_cache_timeout
+                    )
+            # DRF renderiza la respuesta después de que la vista termina.
+            response.add_post_render_callback(store)
+        return response
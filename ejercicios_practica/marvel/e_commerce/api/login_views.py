@@ -0,0 +1,123 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.db import IntegrityError, close_old_connections, transaction
+from django.http import HttpResponse, HttpResponseNotAllowed
+
+from rest_framework.authtoken.models import Token
+
+from e_commerce.api.renderers import FastJSONRenderer
+from e_commerce.api.serializers import LoginTokenSerializer, UserLoginSerializer
+
+
+_config = getattr(settings, 'LOGIN_EXECUTOR', {})
+
+# NOTE: Verificar la contraseña (PBKDF2) es lento a propósito y ocupa la
+# CPU. Lo hacemos en un pool de threads acotado, así una ráfaga de logins
+# usa como mucho MAX_WORKERS threads y el resto de los requests sigue
+# siendo atendido. Si ya hay MAX_PENDING logins esperando respondemos 503.
+login_executor = ThreadPoolExecutor(
+    max_workers=_config.get('MAX_WORKERS', 4),
+    thread_name_prefix='login'
+)
+_login_slots = threading.BoundedSemaphore(_config.get('MAX_PENDING', 64))
+
+
+def get_login_token(user):
+    '''
+    Devuelve el Token de `user` y lo crea si todavía no tiene uno.
+
+    Si dos logins del mismo usuario llegan a la vez, los dos pueden no
+    encontrar el token e intentar crearlo: uno falla por la restricción
+    única de "user" y en ese caso leemos el que creó el otro.
+    '''
+    try:
+        token = Token.objects.get(user=user)
+    except Token.DoesNotExist:
+        try:
+            with transaction.atomic():
+                token = Token.objects.create(user=user)
+        except IntegrityError:
+            token = Token.objects.get(user=user)
+    # Ya tenemos el usuario, no hace falta volver a pedirlo a la base.
+    token.user = user
+    return token
+
+
+def login(username, password):
+    '''
+    Autentica al usuario y devuelve los datos de la respuesta del login
+    (token y usuario), o None si las credenciales no son válidas.
+    '''
+    account = authenticate(username=username, password=password)
+    if account is None:
+        return None
+    return LoginTokenSerializer(instance=get_login_token(account)).data
+
+
+def _login_in_executor(username, password):
+    # NOTE: Los threads del pool no pasan por el ciclo de un request, así
+    # que cerramos nosotros las conexiones vencidas o con errores.
+    close_old_connections()
+    try:
+        return login(username, password)
+    finally:
+        close_old_connections()
+
+
+def _json_response(data, status):
+    return HttpResponse(
+        FastJSONRenderer().render(data),
+        content_type='application/json',
+        status=status
+    )
+
+
+async def login_user_async(request):
+    '''
+    ```
+    Variante asíncrona de `user/login/`, pensada para servirse por ASGI
+    (ver marvel/asgi.py). Recibe y devuelve lo mismo:
+    {"username": "root", "password": 12345}
+    La verificación de la contraseña corre en un pool de threads acotado,
+    por lo que el event loop sigue atendiendo otros requests mientras tanto.
+    ```
+    '''
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        data = json.loads(request.body)
+    except ValueError as exc:
+        return _json_response({'detail': f'JSON parse error - {exc}'}, 400)
+
+    user_login_serializer = UserLoginSerializer(data=data)
+    if not user_login_serializer.is_valid():
+        return _json_response(user_login_serializer.errors, 400)
+
+    if not _login_slots.acquire(blocking=False):
+        response = _json_response(
+            {'detail': 'Too many login requests, please try again later.'}, 503
+        )
+        response['Retry-After'] = '1'
+        return response
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(
+            login_executor, _login_in_executor,
+            data.get('username'), data.get('password')
+        )
+    finally:
+        _login_slots.release()
+
+    if result is None:
+        return _json_response({'error': 'Invalid Credentials.'}, 400)
+    return _json_response(result, 200)
+
+
+# NOTE: El decorador @csrf_exempt de Django 3.2 no soporta vistas async,
+# por eso marcamos la vista directamente. El login no usa cookies de
+# sesión, así que no necesita protección CSRF.
+login_user_async.csrf_exempt = True
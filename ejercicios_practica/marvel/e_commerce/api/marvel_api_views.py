@@ -1,53 +1,41 @@
+import os
+import threading
+
+import httpx
 import requests
-import json
-import hashlib
+from asgiref.sync import sync_to_async
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.views.decorators.csrf import csrf_exempt
 
 from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.renderers import TemplateHTMLRenderer
 from drf_yasg.utils import swagger_auto_schema
 
+from e_commerce.api.marvel_client import (
+    get_async_marvel_client, get_marvel_client
+)
+from e_commerce.api.page_cache import comics_page_cache
+from e_commerce.api.resilience import CircuitOpenError
 from e_commerce.models import *
 from marvel.settings import VERDE, CIAN, AMARILLO
 
 
-# NOTE: Declaramos las variables que tienen que ver con la API KEY de Marvel:
+# NOTE: Las credenciales y la URL de la API de Marvel se configuran en
+# settings.MARVEL_API, y todas las llamadas pasan por el cliente
+# compartido de "e_commerce/api/marvel_client.py".
 
-PUBLIC_KEY = '58ee40376f7c10e99f440f5e3abd2caa'
-PRIVATE_KEY = '2c0373e00d85edb4560f68ddc2094014e8694f90'
-TS = 1
-TO_HASH = str(TS)+PRIVATE_KEY+PUBLIC_KEY
-HASHED = hashlib.md5(TO_HASH.encode())
-URL_BASE = 'http://gateway.marvel.com/v1/public/'
-ENDPOINT = 'comics'
-PARAMS = dict(ts=TS, apikey=PUBLIC_KEY, hash=HASHED.hexdigest())
+# Cantidad de comics que avanzan/retroceden los botones NEXT y PREV:
+PAGE_STEP = 15
 
-# NOTE: Agregamos los siguientes 3 decoradores
-# para que Swagger considere a la función como una 
-# vista de API y pueda ser visualizada en su UI.
-# @swagger_auto_schema(methods=['get'])
-# @api_view(['GET'])
-# @renderer_classes([TemplateHTMLRenderer])
-@csrf_exempt
-def get_comics(request):
+
+def _get_offset_limit(request):
     '''
-    ```
-    Vista personalizada de API para comprar comics, 
-    primero consultamos los comics disponibles en la página de Marvel, 
-    luego generamos una lista de los que tienen precio y descripción, 
-    porque varios vienen `null`.
-    ```
+    Devuelve el par (offset, limit) del request como enteros.
     '''
-    # Declaramos nuestras variables:
-    id = []
-    title = []
-    description = []
-    prices = []
-    thumbnail = []
-    limit = 0
-    offset = 0
     # NOTE: Para obtener los valores de request, dependemos del tipo de petición, así:
     # GET METHOD: request.GET['algo']   O también: request.GET.get('algo')
     # POST METHOD: request.POST['algo'] O también: request.POST.get('algo')
@@ -61,62 +49,78 @@ def get_comics(request):
     else:
         offset = request.GET.get('offset')
     if request.GET.get('limit') == None or request.GET['limit'].isdigit() == False:
-        limit = 15
+        limit = PAGE_STEP
     else:
         limit = request.GET.get('limit')
 
-    offset = int(offset)
-    limit = int(limit)
-    next = offset + 15
-    previous = offset - 15
+    return int(offset), int(limit)
 
-    # Realizamos el request:
-    aditional_params = {'limit': limit, 'offset': offset}
-    params = PARAMS
-    params.update(aditional_params)
-    # NOTE: A los parametros de hash, api key y demás, sumamos limit y offset para paginación.
-    res = requests.get(URL_BASE+ENDPOINT, params=params)
-    comics = json.loads(res.text)
-
-    # Obtenemos la lista de comics:
-    comics_list = comics.get('data').get('results')
-
-    # Filtramos la lista de comics y nos quedamos con lo que nos interesa:
-    for comic in comics_list:
-        id.append(comic.get('id'))
-        description.append(comic.get('description'))
-        title.append(comic.get('title'))
-        prices.append(comic.get('prices')[0].get('price'))
-        thumbnail.append(
-            f"{comic.get('thumbnail').get('path')}/standard_xlarge.jpg")
-
-    # NOTE: Construimos la tabla, concatenando en un string el código HTML:
-
-    template = '''<div>
+
+def _comics_rows(comics_list):
+    '''
+    Devuelve, por cada comic de la respuesta de Marvel, la tupla
+    (id, title, description, price, thumbnail) que muestra la tabla.
+    Si algún comic no tiene la forma esperada lanza ValueError.
+
+    NOTE: Se llama antes de empezar el streaming: un error dentro del
+    generador ocurriría con el status 200 ya enviado y el navegador
+    recibiría una página cortada en lugar de un error.
+    '''
+    # Recorremos la lista de comics y nos quedamos con lo que nos interesa:
+    rows = []
+    try:
+        for comic in comics_list:
+            rows.append((
+                comic.get('id'),
+                comic.get('title'),
+                comic.get('description'),
+                comic.get('prices')[0].get('price'),
+                f"{comic.get('thumbnail').get('path')}/standard_xlarge.jpg",
+            ))
+    except (AttributeError, IndexError, KeyError, TypeError) as error:
+        raise ValueError(f'Unexpected comic from Marvel API: {error!r}') from error
+    return rows
+
+
+def _iter_comics_page(rows, offset, action):
+    '''
+    Generador que arma el HTML de la tabla de comics (las filas que
+    devuelve `_comics_rows()`) con los botones PREV y NEXT (que envían el
+    formulario a la URL `action`). Devuelve el HTML por partes, una fila
+    por comic, para poder enviarlo con un `StreamingHttpResponse` sin
+    armar todo el string en memoria.
+    '''
+    next = offset + PAGE_STEP
+    previous = offset - PAGE_STEP
+
+    # NOTE: Construimos la tabla, enviando el código HTML a medida que
+    # se genera cada fila:
+
+    yield '''<div>
     <div style="height:90%; width:90%; overflow:auto;background:gray;">
         <table>'''
 
-    for i in range(len(id)):
-        if description[i] == None:
+    for id, title, description, prices, thumbnail in rows:
+        if description == None:
             desc = "<h3>Description Not Available<h3>"
         else:
-            desc = description[i]
+            desc = description
 
-        if prices[i] == 0.00:
+        if prices == 0.00:
             # Con este condicional inhabilitamos la compra de los comics sin precio.
             price = "<h3>N/A<h3>"
             visibility = "hidden"
         else:
-            price = prices[i]
+            price = prices
             visibility = "visible"
 
-        template += f'''
+        yield f'''
         <tr>
         <td>
-            <img src="{thumbnail[i]}">
+            <img src="{thumbnail}">
         </td>
         <td>    
-            <h2>{title[i]}</h2><br><br>
+            <h2>{title}</h2><br><br>
             {desc}
         </td>
         <td><h2>U$S{price}</h2></td>
@@ -125,11 +129,11 @@ def get_comics(request):
                 <label for="qty"><h3>Enter Quantity:</h3></label>
                 <input type="number" id="qty" name="qty" min="0" max="15">
                 <input type="submit" value="Buy" >
-                <input type="text" name="id" value="{id[i]}" style="visibility: hidden">
-                <input type="text" name="title" value="{title[i]}" style="visibility: hidden">
-                <input type="text" name="thumbnail" value="{thumbnail[i]}" style="visibility: hidden">
-                <input type="text" name="description" value="{description[i]}" style="visibility: hidden">
-                <input type="text" name="prices" value="{prices[i]}" style="visibility: hidden">
+                <input type="text" name="id" value="{id}" style="visibility: hidden">
+                <input type="text" name="title" value="{title}" style="visibility: hidden">
+                <input type="text" name="thumbnail" value="{thumbnail}" style="visibility: hidden">
+                <input type="text" name="description" value="{description}" style="visibility: hidden">
+                <input type="text" name="prices" value="{prices}" style="visibility: hidden">
             </form>
         </td>
         </tr>
@@ -139,17 +143,17 @@ def get_comics(request):
         visibility = "hidden"
     else:
         visibility = "visible"
-    template += f'''</table></div>
+    yield f'''</table></div>
     <table style="width:100%">
         <tr>
             <td>
-                <form action="/e-commerce/get-comics/" method="get" style ="visibility: {visibility};">
+                <form action="{action}" method="get" style ="visibility: {visibility};">
                     <input type="number" id="button" name="offset" value="{previous}" style="visibility: hidden;">
                     <input type="submit" value="PREV" >
                 </form>
             </td>
             <td>
-                <form action="/e-commerce/get-comics/" method="get" style ="visibility: visible;">
+                <form action="{action}" method="get" style ="visibility: visible;">
                     <input type="number" id="button" name="offset" value="{next}" style="visibility: hidden;">
                     <input type="submit" value="NEXT" >
                 </form>
@@ -157,15 +161,151 @@ def get_comics(request):
         </tr>
     </table>
     </div>'''
+
+
+def _comics_page_response(rows, offset, action):
+    '''
+    Devuelve la respuesta HTML de la página de comics.
+
+    Por defecto el HTML se envía en streaming a medida que se genera. Sólo
+    si settings.MARVEL_HTML_DEBUG está activo se arma completo para
+    imprimirlo por consola y guardarlo en "get_comics.html".
+    '''
+    chunks = _iter_comics_page(rows, offset, action)
+    if not getattr(settings, 'MARVEL_HTML_DEBUG', False):
+        return StreamingHttpResponse(chunks)
+
+    template = ''.join(chunks)
     # Imprimimos por consola el HTML construido (se puede probar en https://codepen.io/):
     print(VERDE+template)
-    # O lo podemos guardar en un HTML, como el nombre no cambia, el archivo se pisa en cada petición:
-    f = open('get_comics.html','w')
-    f.write(template)
-    f.close
+    # O lo podemos guardar en un HTML, como el nombre no cambia, el archivo se pisa en cada petición.
+    # NOTE: Escribimos a un archivo temporal y lo renombramos, así nunca
+    # queda a medio escribir si dos requests lo pisan a la vez.
+    tmp_path = f'get_comics.html.{os.getpid()}.{threading.get_ident()}'
+    with open(tmp_path, 'w') as f:
+        f.write(template)
+    os.replace(tmp_path, 'get_comics.html')
     return HttpResponse(template)
 
 
+def _conditional_comics_page(request, entry, offset, limit, build_response):
+    '''
+    Agrega ETag y Cache-Control a la página de comics armada con la entrada
+    `entry` del cache. Si el navegador ya tiene esa misma versión
+    (If-None-Match) responde 304 sin llamar a `build_response()`.
+    '''
+    # NOTE: El ETag identifica la copia de la página que tenemos en el
+    # cache; cambia cada vez que se vuelve a consultar a Marvel.
+    etag = f'"comics-{offset}-{limit}-{int(entry.fetched_at * 1000)}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = build_response()
+    response['ETag'] = etag
+    # La página es igual para todos los usuarios, así que la pueden guardar
+    # también los caches compartidos mientras siga fresca en el nuestro.
+    patch_cache_control(
+        response, public=True, max_age=comics_page_cache.fresh_for(entry)
+    )
+    return response
+
+
+# NOTE: Agregamos los siguientes 3 decoradores
+# para que Swagger considere a la función como una 
+# vista de API y pueda ser visualizada en su UI.
+# @swagger_auto_schema(methods=['get'])
+# @api_view(['GET'])
+# @renderer_classes([TemplateHTMLRenderer])
+@csrf_exempt
+def get_comics(request):
+    '''
+    ```
+    Vista personalizada de API para comprar comics, 
+    primero consultamos los comics disponibles en la página de Marvel, 
+    luego generamos una lista de los que tienen precio y descripción, 
+    porque varios vienen `null`.
+    ```
+    '''
+    offset, limit = _get_offset_limit(request)
+
+    # Realizamos el request:
+    # NOTE: El cliente suma limit y offset a los parametros de hash, api key
+    # y demás, en un diccionario nuevo para cada llamada. La página parseada
+    # queda en el cache compartido, así que los siguientes requests con el
+    # mismo (offset, limit) no vuelven a consultar la API de Marvel.
+    try:
+        entry = comics_page_cache.get_entry(
+            (offset, limit),
+            lambda: get_marvel_client().get_comics(offset=offset, limit=limit)
+        )
+        # Obtenemos la lista de comics:
+        rows = _comics_rows(entry.value.get('results'))
+    except (requests.RequestException, CircuitOpenError, ValueError):
+        return HttpResponse(
+            '<h3>Marvel API not available, please try again later.</h3>',
+            status=502
+        )
+
+    # Armamos el HTML:
+    return _conditional_comics_page(
+        request, entry, offset, limit,
+        lambda: _comics_page_response(rows, offset, request.path)
+    )
+
+
+async def get_comics_async(request):
+    '''
+    ```
+    Variante asíncrona de `get_comics`, pensada para servirse por ASGI
+    (ver marvel/asgi.py). La consulta a Marvel no bloquea un thread, y
+    mientras se resuelve la página pedida se precargan en el cache, de
+    forma concurrente, las páginas a las que llevan los botones PREV y
+    NEXT, para que esos clicks encuentren los datos listos.
+
+    Servida por WSGI responde igual que `get_comics`.
+    ```
+    '''
+    # NOTE: Con WSGI cada request corre en un event loop nuevo: un
+    # httpx.AsyncClient por request no reutilizaría conexiones y las
+    # precargas se cancelarían al terminar. Usamos el cliente sincrónico,
+    # con su pool de conexiones, y el cache refresca en threads.
+    if not isinstance(request, ASGIRequest):
+        return await sync_to_async(get_comics)(request)
+
+    offset, limit = _get_offset_limit(request)
+    client = get_async_marvel_client()
+
+    def loader(offset, limit):
+        return lambda: client.get_comics(offset=offset, limit=limit)
+
+    # NOTE: Los botones PREV/NEXT sólo envían el offset, por lo que esas
+    # páginas se piden con el limit por defecto.
+    for page_offset in (offset - PAGE_STEP, offset + PAGE_STEP):
+        if page_offset >= 0:
+            comics_page_cache.aprefetch(
+                (page_offset, PAGE_STEP), loader(page_offset, PAGE_STEP)
+            )
+
+    try:
+        entry = await comics_page_cache.aget_entry(
+            (offset, limit), loader(offset, limit)
+        )
+        rows = _comics_rows(entry.value.get('results'))
+    except (httpx.HTTPError, CircuitOpenError, ValueError):
+        return HttpResponse(
+            '<h3>Marvel API not available, please try again later.</h3>',
+            status=502
+        )
+
+    # NOTE: El generador sólo arma strings, por lo que iterarlo desde el
+    # event loop no bloquea.
+    return _conditional_comics_page(
+        request, entry, offset, limit,
+        lambda: StreamingHttpResponse(
+            _iter_comics_page(rows, offset, request.path)
+        )
+    )
+
+
 @csrf_exempt
 def purchased_item(request):
     '''Incluye la lógica de guardar lo pedido en la base de datos 
@@ -179,23 +319,26 @@ def purchased_item(request):
     qty = request.POST.get('qty')
     id = request.POST.get('id')
 
-    # Verificamos si el comic no se encuentra en nuestro stock.
-    # Para eso hacemos uso del método ".get_or_create()".
-    # En caso de existir, actualizamos su cantidad.
-    _comic, _created = Comic.objects.get_or_create(
-        marvel_id=id,
+    if id is None or not id.isdigit() or qty is None or not qty.isdigit():
+        return HttpResponse(
+            '<h3>Invalid comic or quantity.</h3>', status=400
+        )
+
+    # Si el comic no se encuentra en nuestro stock lo creamos, y en caso de
+    # existir, actualizamos su cantidad.
+    # NOTE: ".add_stock()" lo resuelve en una sola sentencia atómica, en vez
+    # de leer el comic, sumar y guardarlo (".get_or_create()" + ".save()"),
+    # que con compras simultáneas pierde incrementos.
+    Comic.objects.add_stock(
+        marvel_id=int(id),
+        qty=int(qty),
         defaults={
             'title': title,
             'description': description,
             'price': price,
-            'stock_qty': qty,
             'picture': thumbnail,
-            'marvel_id': id
         }
     )
-    if not _created:
-        _comic.stock_qty += int(qty)
-        _comic.save()
 
     # NOTE: Construimos la respuesta
     # Calculamos el precio total:
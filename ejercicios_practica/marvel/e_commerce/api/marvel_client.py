@@ -0,0 +1,346 @@
+import asyncio
+import hashlib
+import threading
+import time
+import weakref
+from types import MappingProxyType
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.conf import settings
+
+from e_commerce.api.resilience import CircuitBreaker, CircuitOpenError
+from marvel.metrics import REGISTRY, Counter, Gauge, Histogram
+
+
+# NOTE: Métricas de las llamadas a la API de Marvel (ver marvel/metrics.py).
+# "status" es el código HTTP de la respuesta, "error" si no respondió y
+# "circuit_open" si la llamada no se hizo por el circuit breaker.
+upstream_requests = Counter(
+    'marvel_upstream_requests_total', 'Llamadas a la API de Marvel.',
+    ('endpoint', 'status')
+)
+upstream_duration = Histogram(
+    'marvel_upstream_request_duration_seconds',
+    'Duración de las llamadas a la API de Marvel (con reintentos).',
+    ('endpoint',)
+)
+upstream_circuit_open = Gauge(
+    'marvel_upstream_circuit_open',
+    'Procesos con el circuit breaker de la API de Marvel abierto.'
+)
+
+
+def record_call(endpoint, status, start=None):
+    upstream_requests.inc(endpoint=endpoint, status=status)
+    if start is not None:
+        upstream_duration.observe(
+            time.perf_counter() - start, endpoint=endpoint
+        )
+
+
+def before_call(breaker, endpoint):
+    try:
+        breaker.before_call()
+    except CircuitOpenError:
+        record_call(endpoint, 'circuit_open')
+        raise
+    return time.perf_counter()
+
+
+def sign(ts, private_key, public_key):
+    '''
+    Devuelve el hash que exige la API de Marvel: md5(ts + private + public).
+    '''
+    to_hash = str(ts) + private_key + public_key
+    return hashlib.md5(to_hash.encode()).hexdigest()
+
+
+def normalize_comic(comic):
+    '''
+    Convierte un comic tal como lo devuelve la API de Marvel en un
+    diccionario con los campos de nuestro modelo `Comic`, igual que lo
+    hace la vista "get_comics": primer precio de la lista y la ruta del
+    thumbnail en tamaño "standard_xlarge".
+    '''
+    prices = comic.get('prices') or [{}]
+    thumbnail = comic.get('thumbnail') or {}
+    return {
+        'marvel_id': comic.get('id'),
+        'title': (comic.get('title') or '')[:120],
+        'description': comic.get('description') or '',
+        'price': prices[0].get('price') or 0.00,
+        'picture': f"{thumbnail.get('path')}/standard_xlarge.jpg",
+    }
+
+
+class MarvelClient:
+    '''
+    Cliente reutilizable para la API pública de Marvel.
+
+    Mantiene una `requests.Session` con un pool de conexiones keep-alive,
+    de modo que un worker con varios threads no paga un handshake TCP+TLS
+    en cada request. Los parámetros de autenticación (ts, apikey, hash) se
+    calculan una sola vez y son inmutables; cada llamada arma su propio
+    diccionario de parámetros, por lo que no hay estado compartido entre
+    threads.
+    '''
+
+    def __init__(
+        self,
+        url_base,
+        public_key,
+        private_key,
+        ts=1,
+        connect_timeout=3.05,
+        read_timeout=10,
+        max_retries=3,
+        backoff_factor=0.3,
+        pool_maxsize=20,
+        failure_threshold=5,
+        reset_timeout=30,
+    ):
+        self.url_base = url_base
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.pool_maxsize = pool_maxsize
+        self.auth_params = MappingProxyType({
+            'ts': ts,
+            'apikey': public_key,
+            'hash': sign(ts, private_key, public_key),
+        })
+
+        # NOTE: Reintentamos sólo errores de red y respuestas 429/5xx,
+        # con backoff exponencial y respetando el header "Retry-After".
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # NOTE: Si la API falla varias veces seguidas dejamos de llamarla
+        # durante "reset_timeout" segundos, así una API lenta o caída no
+        # deja a todos los threads del worker esperando timeouts.
+        self.breaker = CircuitBreaker(
+            failure_threshold=failure_threshold, reset_timeout=reset_timeout
+        )
+
+    @classmethod
+    def from_settings(cls, **overrides):
+        '''
+        Crea un cliente con la configuración de settings.MARVEL_API; los
+        argumentos en `overrides` la reemplazan (por ejemplo `url_base`).
+        '''
+        config = settings.MARVEL_API
+        kwargs = dict(
+            url_base=config['URL_BASE'],
+            public_key=config['PUBLIC_KEY'],
+            private_key=config['PRIVATE_KEY'],
+            ts=config.get('TS', 1),
+            connect_timeout=config.get('CONNECT_TIMEOUT', 3.05),
+            read_timeout=config.get('READ_TIMEOUT', 10),
+            max_retries=config.get('MAX_RETRIES', 3),
+            backoff_factor=config.get('BACKOFF_FACTOR', 0.3),
+            pool_maxsize=config.get('POOL_MAXSIZE', 20),
+            failure_threshold=config.get('BREAKER_FAILURE_THRESHOLD', 5),
+            reset_timeout=config.get('BREAKER_RESET_TIMEOUT', 30),
+        )
+        kwargs.update(overrides)
+        return cls(**kwargs)
+
+    def get_params(self, **extra):
+        '''
+        Devuelve un diccionario nuevo con los parámetros de autenticación
+        más los parámetros propios de la llamada (limit, offset, etc.).
+        '''
+        params = dict(self.auth_params)
+        params.update(extra)
+        return params
+
+    def get(self, endpoint, **params):
+        '''
+        Realiza un GET al endpoint indicado y devuelve el JSON ya parseado.
+        Lanza `requests.RequestException` si la API no responde o
+        responde con un error, y `CircuitOpenError` si el circuito está
+        abierto.
+        '''
+        start = before_call(self.breaker, endpoint)
+        try:
+            res = self.session.get(
+                self.url_base + endpoint,
+                params=self.get_params(**params),
+                timeout=self.timeout,
+            )
+        except requests.RequestException:
+            self.breaker.record_failure()
+            record_call(endpoint, 'error', start)
+            raise
+        except BaseException:
+            # NOTE: Si no liberamos la llamada de prueba del estado
+            # half_open, el circuito quedaría abierto para siempre.
+            self.breaker.release_trial()
+            record_call(endpoint, 'error', start)
+            raise
+        record_call(endpoint, res.status_code, start)
+        # Los errores 4xx son problemas del request, no del servicio, por
+        # lo que sólo cuentan como falla los 5xx y el rate limit (429).
+        if res.status_code >= 500 or res.status_code == 429:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        res.raise_for_status()
+        return res.json()
+
+    def get_comics(self, offset=0, limit=15):
+        '''
+        Devuelve el bloque "data" del endpoint "comics" (results, total,
+        offset, limit, count).
+        '''
+        return self.get('comics', offset=offset, limit=limit)['data']
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncMarvelClient:
+    '''
+    Variante asíncrona del cliente, basada en `httpx.AsyncClient`, para
+    las vistas `async` servidas por ASGI. Un solo proceso puede tener así
+    cientos de requests a Marvel en vuelo sin bloquear un thread por cada
+    uno.
+
+    Comparte la configuración, la firma y el circuit breaker con el
+    cliente sincrónico. Como un `httpx.AsyncClient` queda atado al event
+    loop en el que se creó, se mantiene uno por cada loop.
+
+    NOTE: Sólo para ASGI, donde el event loop dura lo que el proceso. Con
+    WSGI cada request async tiene su propio loop, y el cliente de cada uno
+    quedaría con sus sockets abiertos hasta que lo libere el GC; ahí se
+    usa `MarvelClient` (ver `get_comics_async`).
+    '''
+
+    def __init__(self, url_base, auth_params, timeout, breaker,
+                 max_retries=3, pool_maxsize=20):
+        self.url_base = url_base
+        self.auth_params = auth_params
+        self.timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.pool_maxsize = pool_maxsize
+        self._http_clients = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def from_client(cls, client):
+        return cls(
+            url_base=client.url_base,
+            auth_params=client.auth_params,
+            timeout=client.timeout,
+            breaker=client.breaker,
+            max_retries=client.max_retries,
+            pool_maxsize=client.pool_maxsize,
+        )
+
+    def get_http_client(self):
+        loop = asyncio.get_running_loop()
+        http_client = self._http_clients.get(loop)
+        if http_client is None:
+            # NOTE: httpx sólo reintenta errores de conexión.
+            transport = httpx.AsyncHTTPTransport(
+                retries=self.max_retries,
+                limits=httpx.Limits(
+                    max_connections=None,
+                    max_keepalive_connections=self.pool_maxsize,
+                ),
+            )
+            http_client = httpx.AsyncClient(
+                transport=transport, timeout=self.timeout
+            )
+            self._http_clients[loop] = http_client
+        return http_client
+
+    def get_params(self, **extra):
+        params = dict(self.auth_params)
+        params.update(extra)
+        return params
+
+    async def get(self, endpoint, **params):
+        '''
+        Igual que `MarvelClient.get()`. Lanza `httpx.HTTPError` si la API
+        no responde o responde con un error, y `CircuitOpenError` si el
+        circuito está abierto.
+        '''
+        start = before_call(self.breaker, endpoint)
+        try:
+            res = await self.get_http_client().get(
+                self.url_base + endpoint, params=self.get_params(**params)
+            )
+        except httpx.HTTPError:
+            self.breaker.record_failure()
+            record_call(endpoint, 'error', start)
+            raise
+        except BaseException:
+            # NOTE: Incluye asyncio.CancelledError: con WSGI las precargas
+            # se cancelan cuando se cierra el event loop de cada request.
+            self.breaker.release_trial()
+            record_call(endpoint, 'error', start)
+            raise
+        record_call(endpoint, res.status_code, start)
+        if res.status_code >= 500 or res.status_code == 429:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        res.raise_for_status()
+        return res.json()
+
+    async def get_comics(self, offset=0, limit=15):
+        return (await self.get('comics', offset=offset, limit=limit))['data']
+
+
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+
+
+def get_marvel_client():
+    '''
+    Devuelve la instancia compartida del cliente para este proceso,
+    creándola la primera vez que se la necesita.
+    '''
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MarvelClient.from_settings()
+    return _client
+
+
+def get_async_marvel_client():
+    '''
+    Devuelve la instancia compartida del cliente asíncrono, que usa el
+    mismo circuit breaker que el cliente sincrónico.
+    '''
+    global _async_client
+    if _async_client is None:
+        client = get_marvel_client()
+        with _client_lock:
+            if _async_client is None:
+                _async_client = AsyncMarvelClient.from_client(client)
+    return _async_client
+
+
+@REGISTRY.register_callback
+def collect_breaker_state():
+    if _client is not None:
+        upstream_circuit_open.set(
+            int(_client.breaker.state != CircuitBreaker.CLOSED)
+        )
@@ -0,0 +1,299 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from e_commerce.api.resilience import AsyncSingleFlight, SingleFlight
+from marvel.metrics import REGISTRY, Counter, Gauge
+
+
+logger = logging.getLogger(__name__)
+
+CacheEntry = namedtuple('CacheEntry', ('value', 'fetched_at'))
+
+
+class PageCache:
+    '''
+    Cache en memoria, acotado y thread-safe, de las páginas ya parseadas
+    de la API de Marvel, con clave `(offset, limit)`.
+
+    - Cada entrada es "fresca" durante `ttl` segundos: se sirve directo.
+    - Pasado el `ttl` y hasta `ttl + stale_ttl` la entrada está "vencida":
+      se sirve igual de forma inmediata y se lanza UN solo refresco en
+      segundo plano (stale-while-revalidate).
+    - Más allá de eso se considera un "miss" y se consulta la API.
+    - Al superar `max_entries` se descarta la entrada usada hace más
+      tiempo (LRU).
+
+    Las consultas a la API se agrupan por clave (single-flight): si varios
+    threads piden la misma página a la vez, sólo uno hace el request y el
+    resto espera su resultado. Si la consulta falla y tenemos una copia de
+    la página, aunque sea muy vieja, se sirve esa última versión buena.
+    '''
+
+    def __init__(self, max_entries=256, ttl=300, stale_ttl=3600,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._async_flight = AsyncSingleFlight()
+        self._tasks = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.fallbacks = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'MARVEL_PAGE_CACHE', {})
+        return cls(
+            max_entries=config.get('MAX_ENTRIES', 256),
+            ttl=config.get('TTL', 300),
+            stale_ttl=config.get('STALE_TTL', 3600),
+        )
+
+    def get(self, key, loader):
+        '''
+        Devuelve el valor cacheado para `key`. Si no existe (o está
+        demasiado viejo) se obtiene llamando a `loader()` y se guarda.
+        '''
+        return self.get_entry(key, loader).value
+
+    def get_entry(self, key, loader):
+        '''
+        Igual que `get()` pero devuelve el `CacheEntry` completo, útil para
+        conocer la antigüedad del valor servido.
+        '''
+        entry, state = self._lookup(key)
+        if state == 'fresh':
+            return entry
+        if state == 'stale':
+            self._start_refresh(key, loader)
+            return entry
+        try:
+            return self._load(key, loader)
+        except Exception:
+            if entry is None:
+                raise
+            # Servimos la última página buena que tengamos.
+            with self._lock:
+                self.fallbacks += 1
+            return entry
+
+    def _load(self, key, loader):
+        return self._flight.do(key, lambda: self.set(key, loader()))
+
+    def _lookup(self, key):
+        '''
+        Busca `key` y actualiza los contadores. Devuelve `(entry, state)`
+        donde `state` es "fresh", "stale" o "miss".
+        '''
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = now - entry.fetched_at
+                if age < self.ttl:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return entry, 'fresh'
+                if age < self.ttl + self.stale_ttl:
+                    self.stale_hits += 1
+                    self._entries.move_to_end(key)
+                    return entry, 'stale'
+            self.misses += 1
+            return entry, 'miss'
+
+    async def aget(self, key, aloader):
+        return (await self.aget_entry(key, aloader)).value
+
+    async def aget_entry(self, key, aloader):
+        '''
+        Versión asíncrona de `get_entry()`: `aloader` es una función que
+        devuelve una corrutina. Los refrescos en segundo plano se hacen
+        como tareas del event loop en vez de threads.
+        '''
+        entry, state = self._lookup(key)
+        if state == 'fresh':
+            return entry
+        if state == 'stale':
+            self._start_arefresh(key, aloader)
+            return entry
+        try:
+            return await self._aload(key, aloader)
+        except Exception:
+            if entry is None:
+                raise
+            with self._lock:
+                self.fallbacks += 1
+            return entry
+
+    async def _aload(self, key, aloader):
+        async def load():
+            return self.set(key, await aloader())
+        return await self._async_flight.do(key, load)
+
+    def aprefetch(self, key, aloader):
+        '''
+        Programa, sin esperarla, la carga de `key` en el event loop actual
+        si no está en el cache o ya no está fresca. Los errores sólo se
+        registran en el log.
+        '''
+        task = asyncio.get_running_loop().create_task(
+            self._aprefetch(key, aloader)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _aprefetch(self, key, aloader):
+        entry = self.peek(key)
+        if entry is not None and self.clock() - entry.fetched_at < self.ttl:
+            return
+        try:
+            await self._aload(key, aloader)
+        except Exception:
+            logger.warning('Could not prefetch page %s', key, exc_info=True)
+
+    def _start_arefresh(self, key, aloader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        # Guardamos una referencia a la tarea para que no la libere el GC.
+        task = asyncio.get_running_loop().create_task(
+            self._arefresh(key, aloader)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _arefresh(self, key, aloader):
+        try:
+            await self._aload(key, aloader)
+            with self._lock:
+                self.refreshes += 1
+        except Exception:
+            logger.warning('Could not refresh page %s', key, exc_info=True)
+            with self._lock:
+                self.refresh_errors += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def set(self, key, value):
+        entry = CacheEntry(value, self.clock())
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def fresh_for(self, entry):
+        '''
+        Devuelve cuántos segundos más (entero, nunca negativo) seguirá
+        fresca la entrada `entry`.
+        '''
+        return max(0, int(self.ttl - (self.clock() - entry.fetched_at)))
+
+    def peek(self, key):
+        '''
+        Devuelve el `CacheEntry` de `key` sin importar su antigüedad, o
+        `None` si no está en el cache. No modifica contadores ni el orden LRU.
+        '''
+        with self._lock:
+            return self._entries.get(key)
+
+    def _start_refresh(self, key, loader):
+        # NOTE: Sólo permitimos un refresco en curso por clave.
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        thread = threading.Thread(
+            target=self._refresh, args=(key, loader), daemon=True
+        )
+        thread.start()
+
+    def _refresh(self, key, loader):
+        try:
+            self._load(key, loader)
+            with self._lock:
+                self.refreshes += 1
+        except Exception:
+            # Si el refresco falla seguimos sirviendo el valor vencido.
+            logger.warning('Could not refresh page %s', key, exc_info=True)
+            with self._lock:
+                self.refresh_errors += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_ratio': (
+                    (self.hits + self.stale_hits) / lookups if lookups else 0.0
+                ),
+                'refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors,
+                'fallbacks': self.fallbacks,
+                'coalesced': (
+                    self._flight.coalesced + self._async_flight.coalesced
+                ),
+                'evictions': self.evictions,
+            }
+
+
+# NOTE: Instancia compartida por todos los threads del proceso.
+comics_page_cache = PageCache.from_settings()
+
+
+# NOTE: Métricas del cache (ver marvel/metrics.py). La proporción de hits
+# se calcula en Prometheus a partir de "result".
+page_cache_lookups = Counter(
+    'marvel_page_cache_lookups_total',
+    'Consultas al cache de páginas de Marvel.', ('result',)
+)
+page_cache_events = Counter(
+    'marvel_page_cache_events_total',
+    'Refrescos, errores al refrescar, copias viejas servidas por error '
+    'de la API y entradas descartadas del cache de páginas.', ('event',)
+)
+page_cache_entries = Gauge(
+    'marvel_page_cache_entries', 'Páginas guardadas en el cache.'
+)
+
+
+@REGISTRY.register_callback
+def collect_page_cache_stats():
+    stats = comics_page_cache.stats()
+    for result, key in (('hit', 'hits'), ('stale', 'stale_hits'),
+                        ('miss', 'misses')):
+        page_cache_lookups.set_total(stats[key], result=result)
+    for event, key in (('refresh', 'refreshes'),
+                       ('refresh_error', 'refresh_errors'),
+                       ('fallback', 'fallbacks'), ('eviction', 'evictions')):
+        page_cache_events.set_total(stats[key], event=event)
+    page_cache_entries.set(stats['entries'])
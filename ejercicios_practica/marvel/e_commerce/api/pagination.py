@@ -0,0 +1,52 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ComicCursorPagination(CursorPagination):
+    '''
+    Paginado por "keyset" (cursor) para los listados de comics.
+
+    En vez de usar OFFSET, cada página se obtiene buscando a partir de la
+    última posición vista: `WHERE marvel_id > <último>` ordenado por
+    "marvel_id", que es único e indexado. Por eso el costo de cada página
+    es constante sin importar qué tan "profundo" navegue el cliente, y
+    nunca se ejecuta un `COUNT(*)`.
+
+    El cursor que devolvemos en "next" y "previous" es opaco (base64), el
+    cliente sólo debe seguir esos links.
+
+    NOTE: El paginado es opcional. Si el request no trae los parámetros
+    `cursor` ni `page_size`, la vista devuelve el listado completo como
+    antes, para no romper a los clientes existentes. Ejemplo:
+        comics/get?page_size=50
+    '''
+    # "marvel_id" es único, por lo que nunca hace falta un offset dentro
+    # del cursor; "id" sólo asegura un orden estable y determinístico.
+    ordering = ('marvel_id', 'id')
+    page_size = 15
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (
+            self.cursor_query_param not in request.query_params and
+            self.page_size_query_param not in request.query_params
+        ):
+            return None
+        return super().paginate_queryset(queryset, request, view=view)
+
+
+class ComicSearchPagination(CursorPagination):
+    '''
+    Paginado por cursor de los resultados de `comics/search`, del mejor
+    "score" al peor (ver ComicQuerySet.search()).
+
+    Cada página sigue desde el "score" del último resultado visto
+    (`WHERE score < <último>`), sin OFFSET. Si varios resultados tienen el
+    mismo "score", el cursor guarda además cuántos ya se vieron, y "id"
+    mantiene ese orden estable. A diferencia de ComicCursorPagination, acá
+    el paginado es obligatorio.
+    '''
+    ordering = ('-score', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
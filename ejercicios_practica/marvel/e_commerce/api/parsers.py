@@ -0,0 +1,69 @@
+import codecs
+import io
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+# NOTE: orjson convierte a float los enteros que no entran en 64 bits,
+# json los mantiene como int. Si el body tiene 19 dígitos seguidos o más
+# usamos json. Para buscarlos rápido, "translate()" reemplaza cada dígito
+# por "0" y todo lo demás por un espacio.
+_DIGITS = bytes(
+    ord('0') if chr(byte) in '0123456789' else ord(' ') for byte in range(256)
+)
+_LONG_NUMBER = b'0' * 19
+
+
+class FastJSONParser(JSONParser):
+    '''
+    Reemplazo directo de JSONParser que decodifica el body con orjson.
+
+    Sólo se usa orjson para bodies UTF-8 con STRICT_JSON activo (el
+    default). Si orjson no está instalado, el body viene en otra
+    codificación o orjson no lo acepta (por ejemplo enteros de más de 64
+    bits), se usa el JSONParser original, por lo que el resultado y los
+    mensajes de error son los mismos que los de DRF.
+    '''
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or not self.strict or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        if _LONG_NUMBER in body.translate(_DIGITS):
+            return super().parse(io.BytesIO(body), media_type, parser_context)
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            return super().parse(io.BytesIO(body), media_type, parser_context)
+
+
+class NDJSONParser(FastJSONParser):
+    '''
+    Parser de NDJSON (un documento JSON por línea): devuelve la lista de
+    documentos. Las líneas vacías se ignoran. Cada línea se decodifica
+    igual que con FastJSONParser, y los errores indican el número de línea.
+    '''
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        items = []
+        for number, line in enumerate(stream.read().splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                items.append(super().parse(
+                    io.BytesIO(line), media_type, parser_context
+                ))
+            except ParseError as exc:
+                raise ParseError(f'Line {number}: {exc.detail}')
+        return items
@@ -0,0 +1,82 @@
+import decimal
+import math
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    '''
+    Reemplazo directo de JSONRenderer que genera el JSON con orjson, varias
+    veces más rápido que el módulo "json" de la librería estándar.
+
+    Devuelve los mismos bytes que JSONRenderer: los tipos que orjson no
+    maneja igual que DRF (datetime, date, time, Decimal, lazy strings,
+    QuerySets, bytes...) se resuelven con el mismo `encoder_class` de DRF,
+    y se escapan U+2028 y U+2029. Si orjson no está instalado, si se pide
+    JSON indentado (p. ej. "Accept: application/json; indent=4") o si
+    orjson no puede serializar los datos (enteros de más de 64 bits,
+    claves que no son strings, NaN e Infinity...), se usa el JSONRenderer
+    original, que para NaN/Infinity lanza el mismo error de siempre.
+
+    Diferencia conocida: los floats muy grandes o muy chicos se escriben
+    sin ceros en el exponente ("1e16" en vez de "1e+16").
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # NOTE: Usamos el "default()" del encoder de DRF para los tipos que
+        # orjson deja pasar, así las fechas quedan con el mismo formato
+        # (milisegundos y "Z").
+        self._default = self.encoder_class().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None or data is None or
+            not self.compact or self.ensure_ascii or
+            self.get_indent(accepted_media_type, renderer_context or {})
+            is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data, default=self._default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # NOTE: orjson escribe NaN e Infinity como null. Sólo si aparece
+        # algún null revisamos los datos, así el caso común no paga nada.
+        if b'null' in ret and has_non_finite(data):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Igual que DRF, escapamos los separadores de línea de JavaScript.
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+                b'\xe2\x80\xa9', b'\\u2029'
+            )
+        return ret
+
+
+def has_non_finite(data):
+    '''
+    True si `data` (dicts, listas y tuplas anidados) tiene algún float o
+    Decimal NaN o infinito.
+    '''
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, decimal.Decimal):
+            if not value.is_finite():
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return False
@@ -0,0 +1,176 @@
+import asyncio
+import threading
+import time
+import weakref
+
+
+class CircuitOpenError(Exception):
+    '''
+    Se lanza cuando el circuito está abierto y la llamada se rechaza sin
+    llegar a consultar al servicio externo.
+    '''
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    '''
+    Agrupa llamadas concurrentes con la misma clave: sólo la primera
+    ejecuta la función y el resto espera y recibe su mismo resultado (o
+    su misma excepción). Así, ante un "cold start" o el vencimiento de
+    una página popular, sale un único request hacia la API externa.
+    '''
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class AsyncSingleFlight:
+    '''
+    Versión para corrutinas de `SingleFlight`: las llamadas con la misma
+    clave dentro de un mismo event loop esperan a una única tarea.
+    '''
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()
+        self.coalesced = 0
+
+    async def do(self, key, func):
+        loop = asyncio.get_running_loop()
+        calls = self._calls.setdefault(loop, {})
+        task = calls.get(key)
+        if task is None:
+            task = calls[key] = loop.create_task(func())
+            task.add_done_callback(lambda _: calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        # NOTE: "shield" evita que si se cancela un request que espera el
+        # resultado, se cancele la tarea que comparten los demás.
+        return await asyncio.shield(task)
+
+
+class CircuitBreaker:
+    '''
+    Circuit breaker clásico de tres estados:
+
+    - "closed": las llamadas pasan normalmente. Tras `failure_threshold`
+      fallas consecutivas el circuito se abre.
+    - "open": las llamadas fallan de inmediato con `CircuitOpenError`,
+      sin ocupar un thread esperando al servicio caído.
+    - "half_open": pasados `reset_timeout` segundos se deja pasar una
+      única llamada de prueba; si sale bien se cierra, si falla se
+      vuelve a abrir.
+    '''
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if (
+                self._state == self.OPEN and
+                self.clock() - self._opened_at >= self.reset_timeout
+            ):
+                return self.HALF_OPEN
+            return self._state
+
+    def before_call(self):
+        '''
+        Verifica si la llamada puede realizarse; si no, lanza
+        `CircuitOpenError`. Luego de la llamada hay que informar el
+        resultado con `record_success()` o `record_failure()`.
+        '''
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            if (
+                self._state == self.OPEN and
+                self.clock() - self._opened_at >= self.reset_timeout
+            ):
+                self._state = self.HALF_OPEN
+            if self._state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+            self.rejected += 1
+        raise CircuitOpenError('Upstream circuit is open.')
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def release_trial(self):
+        '''
+        Para las llamadas que terminan sin resultado (por ejemplo porque se
+        cancelaron): si era la llamada de prueba del estado half_open, otra
+        llamada puede hacer la prueba. No cuenta como éxito ni como falla.
+        '''
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if (
+                self._state == self.HALF_OPEN or
+                self._failures >= self.failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = self.clock()
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'rejected': self.rejected,
+            }
@@ -1,11 +1,18 @@
 
+from functools import cached_property
+
+from django.db import IntegrityError, transaction
+
 # Primero importamos los modelos que queremos serializar:
 from e_commerce.models import Comic, WishList
 from django.contrib.auth.models import User
+from marvel.profiling import timed
 
 # Luego importamos todos los serializadores de django rest framework.
 from rest_framework import serializers
 from rest_framework.authtoken.models import Token
+from rest_framework.settings import api_settings
+from rest_framework.validators import UniqueTogetherValidator
 
 class ComicSerializer(serializers.ModelSerializer):
     # new_field = serializers.SerializerMethodField()
@@ -20,6 +27,160 @@ class ComicSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class ComicSearchSerializer(ComicSerializer):
+    # Relevancia del resultado en `comics/search` (mayor es mejor).
+    score = serializers.FloatField(read_only=True)
+
+
+class ComicBulkListSerializer(serializers.ListSerializer):
+    '''
+    Valida y escribe una lista de comics (ver `comics/bulk`). Todos los
+    comics se escriben con `Comic.objects.bulk_upsert()`: los "marvel_id"
+    nuevos se insertan y los que ya existen actualizan sólo los campos de
+    `UPSERT_FIELDS` que vienen en cada comic.
+
+    `save()` devuelve un resultado por comic, en el mismo orden:
+        {'marvel_id': 1, 'status': 'created' | 'updated' | 'unchanged'}
+    '''
+    UPSERT_FIELDS = ('price', 'stock_qty')
+    max_items = 10000
+
+    def to_internal_value(self, data):
+        if isinstance(data, list) and len(data) > self.max_items:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    f'Ensure this list has at most {self.max_items} items.'
+                ]
+            }, code='max_length')
+        return super().to_internal_value(data)
+
+    def validate(self, attrs):
+        seen, duplicated = set(), set()
+        for item in attrs:
+            marvel_id = item['marvel_id']
+            (duplicated if marvel_id in seen else seen).add(marvel_id)
+        if duplicated:
+            raise serializers.ValidationError(
+                f'Duplicated marvel_id: {sorted(duplicated)}.'
+            )
+        return attrs
+
+    def create(self, validated_data):
+        # NOTE: Los comics que traen los mismos campos a actualizar van en
+        # el mismo INSERT ... ON CONFLICT (normalmente todos).
+        groups = {}
+        for item in validated_data:
+            fields = tuple(name for name in self.UPSERT_FIELDS if name in item)
+            groups.setdefault(fields, []).append(item)
+        written = {}
+        for fields, items in groups.items():
+            written.update(Comic.objects.bulk_upsert(items, fields))
+
+        statuses = {True: 'created', False: 'updated', None: 'unchanged'}
+        return [
+            {
+                'marvel_id': item['marvel_id'],
+                'status': statuses[written.get(item['marvel_id'])],
+            }
+            for item in validated_data
+        ]
+
+
+class ComicBulkSerializer(ComicSerializer):
+    class Meta(ComicSerializer.Meta):
+        list_serializer_class = ComicBulkListSerializer
+        # NOTE: Sin el UniqueValidator de "marvel_id": un comic que ya
+        # existe se actualiza, y así tampoco se hace una consulta por comic.
+        # Los rangos se validan acá porque un solo valor fuera de rango
+        # haría fallar el INSERT de todo el lote.
+        extra_kwargs = {
+            'marvel_id': {
+                'validators': [], 'min_value': 0, 'max_value': 2147483647
+            },
+            'stock_qty': {'min_value': 0, 'max_value': 2147483647},
+        }
+
+
+class ValuesListSerializer:
+    '''
+    Versión de sólo lectura de un ModelSerializer para listados grandes.
+
+    En vez de crear una instancia del modelo por fila y recorrer los
+    campos del serializador, lee las filas con ".values_list()" y a cada
+    valor le aplica un conversor ya resuelto (int, str, float...). El
+    resultado es el mismo que el de `serializer_class(many=True).data`.
+
+    Uso:
+        fast = ValuesListSerializer(ComicSerializer)
+        data = fast.serialize(fast.values_list(Comic.objects.all()))
+
+    Sólo admite campos que leen una columna del modelo (sin relaciones,
+    SerializerMethodField ni "source" con puntos).
+    '''
+    # Conversores equivalentes al "to_representation()" de cada campo.
+    CONVERTERS = {
+        serializers.IntegerField: int,
+        serializers.FloatField: float,
+        serializers.CharField: str,
+        serializers.URLField: str,
+        serializers.EmailField: str,
+        serializers.SlugField: str,
+    }
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+
+    @cached_property
+    def fields(self):
+        '''
+        Tupla de (nombre, source, conversor) de los campos que se leen,
+        en el mismo orden que los devuelve el serializador.
+        '''
+        fields = []
+        for name, field in self.serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if (
+                isinstance(field, (serializers.RelatedField,
+                                   serializers.ManyRelatedField,
+                                   serializers.SerializerMethodField,
+                                   serializers.BaseSerializer)) or
+                len(field.source_attrs) != 1
+            ):
+                raise ValueError(
+                    f'Field "{name}" of {self.serializer_class.__name__} '
+                    'cannot be read from .values_list().'
+                )
+            fields.append((
+                name,
+                field.source,
+                self.CONVERTERS.get(type(field), field.to_representation),
+            ))
+        return tuple(fields)
+
+    def values_list(self, queryset):
+        # NOTE: Usamos filas "named" para que el paginado por cursor pueda
+        # leer los campos de orden con getattr(), igual que en un modelo.
+        return queryset.values_list(
+            *(source for _, source, _ in self.fields), named=True
+        )
+
+    def serialize(self, rows):
+        names = tuple(name for name, _, _ in self.fields)
+        converters = tuple(convert for _, _, convert in self.fields)
+        # NOTE: Leemos las filas antes de medir, así el tiempo de la
+        # consulta queda sólo en "db" (Server-Timing) y no también acá.
+        rows = list(rows)
+        with timed('serialize'):
+            return [
+                dict(zip(names, [
+                    None if value is None else convert(value)
+                    for convert, value in zip(converters, row)
+                ]))
+                for row in rows
+            ]
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -42,10 +203,51 @@ class TokenSerializer(serializers.ModelSerializer):
         fields = ('user', 'token')
         
 
+class WishListUserSerializer(serializers.ModelSerializer):
+    '''
+    Datos públicos del usuario que se anidan en el WishList expandido.
+    '''
+    class Meta:
+        model = User
+        fields = ('id', 'username', 'first_name', 'last_name')
+
+
+class LoginUserSerializer(serializers.ModelSerializer):
+    '''
+    Datos del usuario que devuelve el login. A diferencia de UserSerializer
+    no incluye "groups" ni "user_permissions", que obligan a hacer una
+    consulta más por cada relación.
+    '''
+    class Meta:
+        model = User
+        exclude = ('password', 'groups', 'user_permissions')
+
+
+class LoginTokenSerializer(serializers.ModelSerializer):
+    user = LoginUserSerializer(many=False, read_only=True)
+    token = serializers.CharField(source='key', read_only=True)
+
+    class Meta:
+        model = Token
+        fields = ('user', 'token')
+
+
 # TODO: Realizar el serializador para el modelo de WishList
 
 class WishListSerializer(serializers.ModelSerializer):
     # new_field = serializers.SerializerMethodField()
+
+    # NOTE: Relaciones que se pueden pedir anidadas con "?expand=comic,user"
+    # en lugar de su id. La vista debe traerlas con ".select_related()".
+    expandable_fields = {
+        'comic': ComicSerializer,
+        'user': WishListUserSerializer,
+    }
+
+    def __init__(self, *args, expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in expand:
+            self.fields[name] = self.expandable_fields[name](read_only=True)
     
     def get_user(self, obj):
         user = serializers.PrimaryKeyRelatedField(write_only=True,
@@ -62,3 +264,112 @@ class WishListSerializer(serializers.ModelSerializer):
         fields = '__all__'
         fields = ('id', 'user', 'comic', 'favorite', 'cart', 'wished_qty', 'bought_qty')
         read_only_fields = ('id',)
+        # NOTE: Un usuario no puede tener dos filas para el mismo comic
+        # (ver WishList.Meta.constraints). Lo validamos acá para responder
+        # un 400 en vez de un error de integridad de la base de datos.
+        validators = [
+            UniqueTogetherValidator(
+                queryset=WishList.objects.all(), fields=('user', 'comic')
+            ),
+        ]
+
+
+class WishListBulkListSerializer(serializers.ListSerializer):
+    '''
+    Valida y aplica una lista de cambios a la lista de deseos de un usuario
+    (ver `wish/bulk`). Los comics se validan todos juntos con una sola
+    consulta, y las filas se escriben con un `bulk_create()` de las nuevas
+    y un `bulk_update()` de las que ya existían: el costo en consultas no
+    depende de la cantidad de cambios.
+
+    Se guarda con `save(user=...)`, que devuelve un resultado por cambio,
+    en el mismo orden:
+        {'comic': 1, 'status': 'created' | 'updated'}
+    '''
+    max_items = 500
+
+    def to_internal_value(self, data):
+        if isinstance(data, list) and len(data) > self.max_items:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    f'Ensure this list has at most {self.max_items} items.'
+                ]
+            }, code='max_length')
+        return super().to_internal_value(data)
+
+    def validate(self, attrs):
+        seen, duplicated = set(), set()
+        for item in attrs:
+            (duplicated if item['comic'] in seen else seen).add(item['comic'])
+        if duplicated:
+            raise serializers.ValidationError(
+                f'Duplicated comic: {sorted(duplicated)}.'
+            )
+        unknown = seen - set(
+            Comic.objects.filter(id__in=seen).values_list('id', flat=True)
+        )
+        if unknown:
+            raise serializers.ValidationError(
+                f'Invalid comic pk: {sorted(unknown)}.', code='does_not_exist'
+            )
+        return attrs
+
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                return self._apply(validated_data)
+        except IntegrityError:
+            # NOTE: Otro request del mismo usuario creó alguna de las filas
+            # mientras tanto. Al repetir la encontramos y la actualizamos.
+            with transaction.atomic():
+                return self._apply(validated_data)
+
+    def _apply(self, validated_data):
+        if not validated_data:
+            return []
+        user = validated_data[0]['user']
+        # NOTE: Bloqueamos las filas que vamos a actualizar: los campos que
+        # un cambio no trae se escriben con el valor que leímos acá.
+        existing = {
+            wish.comic_id: wish for wish in WishList.objects.select_for_update()
+            .filter(user=user, comic_id__in=[item['comic'] for item in validated_data])
+        }
+        to_create, to_update, update_fields, results = [], [], set(), []
+        for item in validated_data:
+            values = {
+                name: value for name, value in item.items()
+                if name not in ('user', 'comic')
+            }
+            wish = existing.get(item['comic'])
+            if wish is None:
+                to_create.append(
+                    WishList(user=user, comic_id=item['comic'], **values)
+                )
+                results.append({'comic': item['comic'], 'status': 'created'})
+                continue
+            for name, value in values.items():
+                setattr(wish, name, value)
+            update_fields.update(values)
+            to_update.append(wish)
+            results.append({'comic': item['comic'], 'status': 'updated'})
+
+        WishList.objects.bulk_create(to_create)
+        if to_update and update_fields:
+            WishList.objects.bulk_update(to_update, sorted(update_fields))
+        return results
+
+
+class WishListBulkSerializer(serializers.Serializer):
+    '''
+    Un cambio de `wish/bulk`. Sólo se modifican los campos que vienen; las
+    filas nuevas usan los valores por defecto para el resto.
+    '''
+    comic = serializers.IntegerField(min_value=1)
+    favorite = serializers.BooleanField(required=False)
+    cart = serializers.BooleanField(required=False)
+    wished_qty = serializers.IntegerField(
+        min_value=0, max_value=2147483647, required=False
+    )
+
+    class Meta:
+        list_serializer_class = WishListBulkListSerializer
@@ -1,4 +1,5 @@
 from django.urls import path
+from e_commerce.api.login_views import login_user_async
 from e_commerce.api.marvel_api_views import *
 
 # Importamos las API_VIEWS:
@@ -7,19 +8,24 @@ from e_commerce.api.api_views import *
 urlpatterns = [
     # User APIs:
     path('user/login/', LoginUserAPIView.as_view()),
+    path('user/login/async/', login_user_async),
 
     # APIs de Marvel
     path('get-comics/',get_comics),
+    path('get-comics/async/', get_comics_async),
     path('purchased-item/',purchased_item),
+    path('get-comics/cache-stats/', MarvelCacheStatsAPIView.as_view()),
     
     # Comic API View:
     path('comics/get', GetComicAPIView.as_view()),
+    path('comics/search', SearchComicAPIView.as_view()),
     path('comics/<int:pk>/get', GetOneComicAPIView.as_view()),
     path(
         'comics/marvel/<int:marvel_id>/get',
         GetOneMarvelComicAPIView.as_view()
     ),
     path('comics/post', PostComicAPIView.as_view()),
+    path('comics/bulk', BulkComicAPIView.as_view()),
     path('comics/get-post', ListCreateComicAPIView.as_view()),
     path('comics/<int:pk>/get-update', RetrieveUpdateComicAPIView.as_view()),
     path('comics/<int:marvel_id>/update', UpdateComicAPIView.as_view()),
@@ -28,6 +34,7 @@ urlpatterns = [
     # TODO: Wish-list API View
     path('wish/get', GetWishListAPIView.as_view()),
     path('wish/post', PostWishListAPIView.as_view()),
+    path('wish/bulk', BulkWishListAPIView.as_view()),
     path('wish/<comic_id>/update', UpdateWishListAPIView.as_view()),
     path('wish/<comic_id>/delete', DeleteWishListAPIView.as_view()),
 
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ECommerceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'e_commerce'
+
+    def ready(self):
+        # Registramos las señales del modelo (ver e_commerce/signals.py).
+        from e_commerce import signals  # noqa: F401
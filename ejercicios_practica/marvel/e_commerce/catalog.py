@@ -0,0 +1,71 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+# NOTE: La "versión del catálogo" es un número que cambia cada vez que se
+# modifica la tabla de comics. Se guarda en el cache de Django (compartido
+# por todos los threads del proceso, o por todos los procesos si se
+# configura memcached en settings.CACHES), así que consultarla no toca la
+# base de datos. Con ella las vistas de lectura arman sus ETag.
+VERSION_KEY = 'e_commerce:catalog:version'
+MODIFIED_KEY = 'e_commerce:catalog:modified'
+
+
+def _initial_version():
+    # Si el cache se vació arrancamos desde la hora actual en milisegundos,
+    # así nunca repetimos una versión que un cliente ya haya recibido.
+    return int(time.time() * 1000)
+
+
+def get_catalog_version():
+    '''
+    Devuelve `(version, modified)`: la versión actual del catálogo y el
+    timestamp (en segundos) de su última modificación.
+    '''
+    version, modified, _ = get_catalog_version_with()
+    return version, modified
+
+
+def get_catalog_version_with(keys=()):
+    '''
+    Igual que `get_catalog_version()`, pero además lee del cache las claves
+    `keys` en la misma consulta. Devuelve `(version, modified, values)`,
+    donde `values` es un diccionario con las claves de `keys` encontradas.
+    '''
+    all_keys = (VERSION_KEY, MODIFIED_KEY, *keys)
+    values = cache.get_many(all_keys)
+    if VERSION_KEY not in values or MODIFIED_KEY not in values:
+        # "add" no pisa el valor si otro thread lo creó recién.
+        version, modified = _initial_version(), time.time()
+        cache.add(VERSION_KEY, version, timeout=None)
+        cache.add(MODIFIED_KEY, modified, timeout=None)
+        values = cache.get_many(all_keys)
+        values.setdefault(VERSION_KEY, version)
+        values.setdefault(MODIFIED_KEY, modified)
+    return values.pop(VERSION_KEY), values.pop(MODIFIED_KEY), values
+
+
+def bump_catalog_version():
+    '''
+    Cambia la versión del catálogo. Usar `catalog_changed()` desde el
+    código que escribe en la base de datos.
+    '''
+    try:
+        # NOTE: "incr" es atómico, dos escrituras simultáneas siempre
+        # terminan en dos versiones distintas.
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, _initial_version(), timeout=None)
+    cache.set(MODIFIED_KEY, time.time(), timeout=None)
+
+
+def catalog_changed(using=None):
+    '''
+    Avisa que la tabla de comics cambió. La versión se cambia recién cuando
+    la transacción actual hace commit (o en el momento, si no hay una
+    abierta): si cambiara antes, un request concurrente podría leer los
+    datos viejos y guardarlos con la versión nueva.
+    '''
+    transaction.on_commit(bump_catalog_version, using=using)
@@ -0,0 +1,92 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from e_commerce.api.serializers import ComicSerializer, ValuesListSerializer
+from e_commerce.models import Comic
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara la velocidad de ComicSerializer(many=True) contra '
+        'ValuesListSerializer sobre la tabla de comics, y verifica que ambos '
+        'devuelvan el mismo JSON. Los comics de prueba se crean dentro de '
+        'una transacción que se descarta al terminar.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, default=100000,
+            help='Cantidad de comics a serializar.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Repeticiones de cada medición (se toma la mejor).'
+        )
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        if rows < 1 or options['repeat'] < 1:
+            raise CommandError('--rows and --repeat must be positive.')
+        try:
+            with transaction.atomic():
+                self.bench(rows, options['repeat'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def bench(self, rows, repeat):
+        missing = rows - Comic.objects.count()
+        if missing > 0:
+            self.stdout.write(f'Creating {missing} temporary comics...')
+            # Algunos comics sin descripción ni precio, como en Marvel.
+            Comic.objects.bulk_create(
+                (
+                    Comic(
+                        marvel_id=900000000 + index,
+                        title=f'Bench Comic #{index}',
+                        description='' if index % 4 == 0 else f'Description {index}',
+                        price=0.0 if index % 5 == 0 else 1.99 + index % 7,
+                        stock_qty=index % 13,
+                        picture=f'http://i.annihil.us/u/prod/marvel/i/mg/{index}.jpg',
+                    )
+                    for index in range(missing)
+                ),
+                batch_size=5000,
+            )
+        queryset = Comic.objects.all().order_by('marvel_id')[:rows]
+        fast = ValuesListSerializer(ComicSerializer)
+
+        def model_path():
+            return ComicSerializer(queryset.all(), many=True).data
+
+        def fast_path():
+            return fast.serialize(fast.values_list(queryset.all()))
+
+        if json.dumps(model_path()) != json.dumps(fast_path()):
+            raise CommandError('Both serializers must produce the same JSON.')
+
+        results = {}
+        for name, func in (('ComicSerializer', model_path),
+                           ('ValuesListSerializer', fast_path)):
+            best = min(self.timed(func) for _ in range(repeat))
+            results[name] = best
+            self.stdout.write(
+                f'{name:<22} {best:8.3f} s  {rows / best:12,.0f} rows/s'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Same JSON, {results["ComicSerializer"] / results["ValuesListSerializer"]:.1f}x '
+            'faster (SQL included in both).'
+        ))
+
+    @staticmethod
+    def timed(func):
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
@@ -0,0 +1,491 @@
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import subprocess
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+import requests
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+
+from e_commerce.api import marvel_client
+from e_commerce.marvel_stub import MarvelStubServer
+from e_commerce.models import Comic, WishList
+
+
+# Los datos de prueba usan un rango propio de "marvel_id" y usuarios con
+# este prefijo, así se pueden borrar sin tocar los datos reales.
+MARVEL_ID_BASE = 800000000
+USER_PREFIX = 'bench-user-'
+PASSWORD = 'bench-password'
+# Header con el que el servidor sabe a qué escenario contar las consultas.
+SCENARIO_HEADER = 'X-Bench-Scenario'
+
+# NOTE: "wish/<id>/update" no se mide: UpdateWishListAPIView.put responde
+# siempre 500, y medir un endpoint que sólo devuelve errores no sirve.
+SCENARIOS = (
+    'comics_list', 'comic_detail', 'comics_search', 'comics_bulk',
+    'wish_list', 'wish_post', 'wish_delete', 'wish_bulk',
+    'login', 'get_comics', 'purchased_item',
+)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class QueryCountingApp:
+    '''
+    Envuelve la aplicación WSGI y cuenta las consultas a la base de datos
+    de cada request, agrupadas por el escenario del header SCENARIO_HEADER.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        self.counts = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with contextlib.ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(count))
+            response = self.app(environ, start_response)
+        scenario = environ.get(
+            'HTTP_' + SCENARIO_HEADER.upper().replace('-', '_')
+        )
+        if scenario:
+            with self._lock:
+                self.counts[scenario].append(queries)
+        return response
+
+
+def percentile(values, percent):
+    '''
+    Percentil por el método "nearest rank" de `values` (ordenados).
+    '''
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, math.ceil(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark HTTP de los endpoints de e_commerce. Carga comics, '
+        'usuarios y listas de deseos de prueba en la base de datos '
+        'configurada, levanta el proyecto en un servidor WSGI local con '
+        'varios threads y un stub de la API de Marvel, y mide cada '
+        'endpoint con la concurrencia pedida. Escribe un reporte JSON '
+        '(requests/s, latencias p50/p95/p99 y consultas por request) para '
+        'comparar entre commits. Al terminar borra los datos de prueba.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--comics', type=int, default=2000,
+            help='Cantidad de comics de prueba.'
+        )
+        parser.add_argument(
+            '--wishlists', type=int, default=2000,
+            help='Cantidad de filas de listas de deseos de prueba.'
+        )
+        parser.add_argument(
+            '--users', type=int, default=10,
+            help='Cantidad de usuarios de prueba (todos staff, con token).'
+        )
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Requests medidos por escenario.'
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=10,
+            help='Requests por escenario antes de medir (no se reportan).'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=8,
+            help='Requests simultáneos.'
+        )
+        parser.add_argument(
+            '--max-error-rate', type=float, default=0.01,
+            help=(
+                'Fracción de respuestas con error (4xx/5xx) a partir de la '
+                'cual un escenario se marca como inválido y el comando falla.'
+            )
+        )
+        parser.add_argument(
+            '--scenarios', default=','.join(SCENARIOS),
+            help=f'Escenarios separados por coma: {", ".join(SCENARIOS)}.'
+        )
+        parser.add_argument(
+            '--stub-latency', type=float, default=0.0,
+            help='Segundos que tarda el stub de Marvel en responder.'
+        )
+        parser.add_argument(
+            '--output', default='bench_endpoints.json',
+            help='Archivo del reporte JSON ("-" para la salida estándar).'
+        )
+        parser.add_argument(
+            '--keep-data', action='store_true',
+            help='No borra los datos de prueba al terminar.'
+        )
+
+    def handle(self, *args, **options):
+        scenarios = [name for name in options['scenarios'].split(',') if name]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}.')
+        if min(options['comics'], options['users'], options['requests'],
+               options['concurrency']) < 1:
+            raise CommandError(
+                '--comics, --users, --requests and --concurrency must be positive.'
+            )
+        if options['wishlists'] > options['comics'] * options['users']:
+            raise CommandError('--wishlists must be at most --comics * --users.')
+        if connection.vendor == 'sqlite' and options['concurrency'] > 1:
+            # NOTE: SQLite admite un solo escritor a la vez: con escrituras
+            # simultáneas algunos requests fallan con "database is locked".
+            self.stdout.write(self.style.WARNING(
+                'SQLite allows a single writer: write scenarios may fail '
+                'with "database is locked" unless --concurrency is 1.'
+            ))
+
+        self.options = options
+        self.cleanup()
+        try:
+            self.seed()
+            report = self.run(scenarios)
+        finally:
+            if not options['keep_data']:
+                self.cleanup()
+
+        content = json.dumps(report, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(content)
+        else:
+            with open(options['output'], 'w') as file:
+                file.write(content + '\n')
+            self.stdout.write(self.style.SUCCESS(
+                f'Report written to {options["output"]}.'
+            ))
+
+        invalid = [
+            scenario for scenario, result in report['scenarios'].items()
+            if not result['valid']
+        ]
+        if invalid:
+            raise CommandError(
+                f'Error rate above {options["max_error_rate"]:.1%} in: '
+                f'{", ".join(invalid)}. Their results are not valid.'
+            )
+
+    # Datos de prueba:
+
+    def cleanup(self):
+        Comic.objects.filter(marvel_id__gte=MARVEL_ID_BASE).delete()
+        User.objects.filter(username__startswith=USER_PREFIX).delete()
+
+    def seed(self):
+        options = self.options
+        self.stdout.write(
+            f'Seeding {options["comics"]} comics, {options["users"]} users '
+            f'and {options["wishlists"]} wishlists...'
+        )
+        Comic.objects.bulk_create(
+            (
+                Comic(
+                    marvel_id=MARVEL_ID_BASE + index,
+                    title=f'Bench Comic #{index}',
+                    description=f'Bench description {index}',
+                    price=1.99 + index % 7,
+                    stock_qty=index % 13,
+                    picture=f'http://i.annihil.us/u/prod/marvel/i/mg/{index}.jpg',
+                )
+                for index in range(options['comics'])
+            ),
+            batch_size=1000,
+        )
+        # NOTE: Calcular el hash de la contraseña es lento a propósito:
+        # lo hacemos una vez para todos los usuarios.
+        password = make_password(PASSWORD)
+        User.objects.bulk_create(
+            User(
+                username=f'{USER_PREFIX}{index}', password=password,
+                is_staff=True
+            )
+            for index in range(options['users'])
+        )
+        self.users = list(
+            User.objects.filter(username__startswith=USER_PREFIX).order_by('id')
+        )
+        self.tokens = [Token.objects.create(user=user).key for user in self.users]
+        self.comics = list(
+            Comic.objects.filter(marvel_id__gte=MARVEL_ID_BASE)
+            .order_by('marvel_id').values_list('id', 'marvel_id')
+        )
+        users = len(self.users)
+        WishList.objects.bulk_create(
+            (
+                WishList(
+                    user=self.users[index % users],
+                    comic_id=self.comics[index // users][0],
+                    wished_qty=1,
+                )
+                for index in range(options['wishlists'])
+            ),
+            batch_size=1000,
+        )
+
+    # Escenarios:
+
+    def new_wish(self, index):
+        '''
+        (usuario, comic) que no está en las listas de prueba: los crea
+        "wish_post" y los borra "wish_delete".
+        '''
+        users = len(self.users)
+        comic = len(self.comics) - 1 - index // users
+        if comic * users < self.options['wishlists']:
+            raise CommandError(
+                'Not enough comics for wish_post/wish_delete: raise --comics.'
+            )
+        return index % users, self.comics[comic][0]
+
+    def build_request(self, scenario, index):
+        '''
+        Devuelve (método, url, kwargs de requests, índice de usuario) del
+        request número `index` de `scenario`.
+        '''
+        comic_id, marvel_id = self.comics[index % len(self.comics)]
+        user = index % len(self.users)
+        if scenario == 'comics_list':
+            return 'GET', 'e-commerce/comics/get?page_size=50', {}, user
+        if scenario == 'comic_detail':
+            return 'GET', f'e-commerce/comics/{comic_id}/get', {}, user
+        if scenario == 'comics_search':
+            return 'GET', f'e-commerce/comics/search?q=Comic {index % 100}', {}, user
+        if scenario == 'comics_bulk':
+            items = [
+                {'marvel_id': self.comics[(index * 50 + offset) % len(self.comics)][1],
+                 'stock_qty': index % 13}
+                for offset in range(50)
+            ]
+            return 'POST', 'e-commerce/comics/bulk', {'json': items}, user
+        if scenario == 'wish_list':
+            return 'GET', 'e-commerce/wish/get?expand=comic', {}, user
+        if scenario == 'wish_post':
+            user, comic_id = self.new_wish(index)
+            body = {'user': self.users[user].id, 'comic': comic_id, 'cart': True}
+            return 'POST', 'e-commerce/wish/post', {'json': body}, user
+        if scenario == 'wish_delete':
+            user, comic_id = self.new_wish(index)
+            return 'DELETE', f'e-commerce/wish/{comic_id}/delete', {}, user
+        if scenario == 'wish_bulk':
+            items = [
+                {'comic': self.comics[(index + offset) % len(self.comics)][0],
+                 'cart': True, 'wished_qty': index % 5}
+                for offset in range(30)
+            ]
+            return 'POST', 'e-commerce/wish/bulk', {'json': items}, user
+        if scenario == 'login':
+            body = {'username': self.users[user].username, 'password': PASSWORD}
+            return 'POST', 'e-commerce/user/login/', {'json': body}, None
+        if scenario == 'get_comics':
+            return 'GET', f'e-commerce/get-comics/?offset={index % 50 * 20}&limit=20', {}, None
+        if scenario == 'purchased_item':
+            body = {
+                'id': str(marvel_id), 'qty': '1', 'title': 'Bench Comic',
+                'prices': '1.99', 'description': '', 'thumbnail': '',
+            }
+            return 'POST', 'e-commerce/purchased-item/', {'data': body}, None
+        raise CommandError(f'Unknown scenario: {scenario}')
+
+    # Ejecución:
+
+    def run(self, scenarios):
+        options = self.options
+        started_at = timezone.now()
+        stub = MarvelStubServer(
+            total=options['comics'], latency=options['stub_latency']
+        ).start()
+        marvel_url_base = settings.MARVEL_API['URL_BASE']
+        settings.MARVEL_API['URL_BASE'] = stub.url_base
+        marvel_client._client = None
+        marvel_client._async_client = None
+
+        app = QueryCountingApp(get_wsgi_application())
+        httpd = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+        httpd.set_app(app)
+        server = threading.Thread(target=httpd.serve_forever, daemon=True)
+        server.start()
+        base_url = f'http://127.0.0.1:{httpd.server_address[1]}/'
+        # NOTE: Los threads del servidor usan sus propias conexiones; la
+        # de este thread no debe quedar con una transacción abierta.
+        connection.close()
+
+        results = {}
+        try:
+            # NOTE: Algunas vistas imprimen por consola cada request; eso
+            # no debe mezclarse con la salida del comando.
+            with contextlib.redirect_stdout(io.StringIO()):
+                for scenario in scenarios:
+                    results[scenario] = self.run_scenario(
+                        scenario, base_url, app
+                    )
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            stub.stop()
+            settings.MARVEL_API['URL_BASE'] = marvel_url_base
+            marvel_client._client = None
+            marvel_client._async_client = None
+
+        for scenario, result in results.items():
+            latency = result['latency_ms']
+            self.stdout.write(
+                f'{scenario:<15} {result["throughput_rps"]:8.1f} req/s  '
+                f'p50 {latency["p50"]:7.1f} ms  p95 {latency["p95"]:7.1f} ms  '
+                f'p99 {latency["p99"]:7.1f} ms  '
+                f'{result["queries_per_request"]["mean"]:5.1f} queries  '
+                f'{result["errors"]} errors'
+                + ('' if result['valid'] else '  INVALID')
+            )
+        return {
+            'meta': {
+                'started_at': started_at.isoformat(),
+                'git_commit': self.git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'comics': options['comics'],
+                'users': options['users'],
+                'wishlists': options['wishlists'],
+                'requests': options['requests'],
+                'warmup': options['warmup'],
+                'concurrency': options['concurrency'],
+                'stub_latency': options['stub_latency'],
+                'max_error_rate': options['max_error_rate'],
+            },
+            'scenarios': results,
+        }
+
+    def run_scenario(self, scenario, base_url, app):
+        options = self.options
+        local = threading.local()
+
+        def send(index, measured):
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+            method, path, kwargs, user = self.build_request(scenario, index)
+            headers = {
+                'Accept': 'application/json',
+                SCENARIO_HEADER: scenario if measured else f'warmup:{scenario}',
+            }
+            if user is not None:
+                headers['Authorization'] = f'Token {self.tokens[user]}'
+            start = time.perf_counter()
+            response = session.request(
+                method, base_url + path, headers=headers, **kwargs
+            )
+            return time.perf_counter() - start, response.status_code
+
+        def run(first, count, measured):
+            '''
+            Envía los requests `first` a `first + count - 1` (cada índice
+            una sola vez) repartidos entre los threads.
+            '''
+            indexes = iter(range(first, first + count))
+            lock = threading.Lock()
+            samples = []
+
+            def worker():
+                while True:
+                    with lock:
+                        index = next(indexes, None)
+                    if index is None:
+                        return
+                    samples.append(send(index, measured))
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                for future in [
+                    executor.submit(worker)
+                    for _ in range(options['concurrency'])
+                ]:
+                    future.result()
+            return samples, time.perf_counter() - start
+
+        # NOTE: Los requests medidos siguen la numeración del warmup, así
+        # "wish_post" y "wish_delete" no repiten pares (usuario, comic).
+        run(0, options['warmup'], False)
+        samples, elapsed = run(options['warmup'], options['requests'], True)
+        if len(samples) != options['requests']:
+            raise CommandError(
+                f'{scenario}: sent {len(samples)} requests instead of '
+                f'{options["requests"]}.'
+            )
+
+        latencies = sorted(latency * 1000 for latency, _ in samples)
+        statuses = Counter(status for _, status in samples)
+        queries = app.counts.pop(scenario, [])
+        app.counts.pop(f'warmup:{scenario}', None)
+        errors = sum(
+            count for status, count in statuses.items() if status >= 400
+        )
+        error_rate = errors / len(samples)
+        return {
+            # NOTE: Con muchos errores las latencias miden las respuestas de
+            # error, no el endpoint: esos resultados no se deben comparar.
+            'valid': error_rate <= options['max_error_rate'],
+            'requests': len(samples),
+            'errors': errors,
+            'error_rate': round(error_rate, 4),
+            'status_codes': {str(status): count for status, count in sorted(statuses.items())},
+            'elapsed_s': round(elapsed, 4),
+            'throughput_rps': round(len(samples) / elapsed, 2),
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies), 3),
+                'p50': round(percentile(latencies, 50), 3),
+                'p95': round(percentile(latencies, 95), 3),
+                'p99': round(percentile(latencies, 99), 3),
+                'max': round(latencies[-1], 3),
+            },
+            'queries_per_request': {
+                'mean': round(sum(queries) / len(queries), 2) if queries else 0,
+                'max': max(queries, default=0),
+            },
+        }
+
+    @staticmethod
+    def git_commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            return None
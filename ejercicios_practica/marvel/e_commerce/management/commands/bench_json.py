@@ -0,0 +1,81 @@
+import io
+import time
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rest_framework import serializers
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from e_commerce.api.parsers import FastJSONParser, orjson
+from e_commerce.api.renderers import FastJSONRenderer
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara la velocidad de FastJSONRenderer/FastJSONParser con la de '
+        'JSONRenderer/JSONParser de DRF con un listado de comics. Que den '
+        'el mismo resultado lo verifican los tests de e_commerce.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, default=10000,
+            help='Cantidad de comics del listado usado en el benchmark.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Repeticiones de cada medición (se toma la mejor).'
+        )
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stdout.write(self.style.WARNING(
+                'orjson is not installed: the fast classes use the stdlib.'
+            ))
+        self.bench(options['rows'], options['repeat'])
+
+    def bench(self, rows, repeat):
+        # Los serializadores de DRF ya entregan las fechas como string.
+        now = serializers.DateTimeField().to_representation(timezone.now())
+        data = [
+            OrderedDict((
+                ('id', index),
+                ('marvel_id', 100000 + index),
+                ('title', f'Comic #{index}'),
+                ('description', 'Spider-Man y Daredevil ' * 10),
+                ('price', 1.99 + index % 7),
+                ('stock_qty', index % 13),
+                ('picture', f'http://i.annihil.us/u/prod/marvel/i/mg/{index}.jpg'),
+                ('updated', now),
+            ))
+            for index in range(rows)
+        ]
+        body = JSONRenderer().render(data)
+        self.stdout.write(f'Payload: {rows} comics, {len(body) / 1024:.0f} KiB')
+
+        results = {}
+        for name, func in (
+            ('JSONRenderer', lambda: JSONRenderer().render(data)),
+            ('FastJSONRenderer', lambda: FastJSONRenderer().render(data)),
+            ('JSONParser', lambda: JSONParser().parse(io.BytesIO(body))),
+            ('FastJSONParser', lambda: FastJSONParser().parse(io.BytesIO(body))),
+        ):
+            best = min(self.timed(func) for _ in range(repeat))
+            results[name] = best
+            self.stdout.write(
+                f'{name:<17} {best * 1000:9.2f} ms  '
+                f'{len(body) / best / 2 ** 20:9.1f} MiB/s'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Render {results["JSONRenderer"] / results["FastJSONRenderer"]:.1f}x, '
+            f'parse {results["JSONParser"] / results["FastJSONParser"]:.1f}x faster.'
+        ))
+
+    @staticmethod
+    def timed(func):
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
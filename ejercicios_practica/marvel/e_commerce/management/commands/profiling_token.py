@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from marvel.profiling import get_config, make_token
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera un token para el header "X-Profile": el request que lo '
+        'trae se perfila con cProfile (ver marvel/profiling.py). Ejemplo: '
+        'curl -H "X-Profile: $(python manage.py profiling_token)" ...'
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_token())
+        self.stderr.write(
+            f'Valid for {get_config()["TOKEN_MAX_AGE"]} seconds.'
+        )
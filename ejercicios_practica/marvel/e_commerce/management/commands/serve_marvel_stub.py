@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from e_commerce.marvel_stub import MarvelStubServer
+
+
+class Command(BaseCommand):
+    help = (
+        'Levanta un servidor local que imita el endpoint "comics" de la '
+        'API de Marvel. Ejemplo: python manage.py serve_marvel_stub '
+        '--port 8900 --total 50000'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument(
+            '--total', type=int, default=1000,
+            help='Cantidad de comics del catálogo sintético.'
+        )
+        parser.add_argument(
+            '--latency', type=float, default=0.0,
+            help='Demora en segundos agregada a cada respuesta.'
+        )
+
+    def handle(self, *args, **options):
+        stub = MarvelStubServer(
+            host=options['host'],
+            port=options['port'],
+            total=options['total'],
+            latency=options['latency'],
+        ).start()
+        self.stdout.write(self.style.SUCCESS(
+            f'Marvel stub listening on {stub.url_base} '
+            f'({stub.total} comics). Use MARVEL_URL_BASE={stub.url_base}'
+        ))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stub.stop()
@@ -0,0 +1,183 @@
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from django.core.management.base import BaseCommand, CommandError
+
+from e_commerce.api.marvel_client import (
+    MarvelClient, get_marvel_client, normalize_comic
+)
+from e_commerce.api.resilience import CircuitOpenError
+from e_commerce.models import Comic
+
+
+# Campos que se actualizan cuando el comic ya existe. El stock es nuestro,
+# por eso no se pisa con lo que venga de Marvel.
+UPDATE_FIELDS = ('title', 'description', 'price', 'picture')
+
+# Máximo "limit" que acepta la API de Marvel.
+MAX_PAGE_SIZE = 100
+
+
+class Command(BaseCommand):
+    help = (
+        'Sincroniza el catálogo de comics de la API de Marvel con la tabla '
+        'de comics, pidiendo las páginas en paralelo y guardándolas en '
+        'lotes. Si se interrumpe, la próxima ejecución continúa desde el '
+        'último lote guardado.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size', type=int, default=MAX_PAGE_SIZE,
+            help=f'Comics por página pedida a Marvel (máximo {MAX_PAGE_SIZE}).'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Cantidad de páginas que se piden en paralelo.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Cantidad de comics que se escriben por sentencia.'
+        )
+        parser.add_argument(
+            '--max-comics', type=int, default=None,
+            help='Sincroniza como máximo esta cantidad de comics.'
+        )
+        parser.add_argument(
+            '--checkpoint', default='sync_marvel_catalog.checkpoint.json',
+            help='Archivo donde se guarda el progreso.'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignora el checkpoint y empieza desde el principio.'
+        )
+        parser.add_argument(
+            '--base-url', default=None,
+            help='URL base de la API (por ejemplo la de serve_marvel_stub).'
+        )
+
+    def handle(self, *args, **options):
+        page_size = options['page_size']
+        if not 0 < page_size <= MAX_PAGE_SIZE:
+            raise CommandError(
+                f'--page-size must be between 1 and {MAX_PAGE_SIZE}.'
+            )
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be positive.')
+        self.checkpoint_path = options['checkpoint']
+
+        if options['base_url']:
+            client = MarvelClient.from_settings(url_base=options['base_url'])
+        else:
+            client = get_marvel_client()
+
+        offset = 0
+        checkpoint = None if options['restart'] else self.load_checkpoint()
+        if checkpoint and checkpoint.get('page_size') == page_size:
+            offset = checkpoint['next_offset']
+            self.stdout.write(f'Resuming from offset {offset}.')
+
+        try:
+            first_page = client.get_comics(offset=offset, limit=page_size)
+        except (requests.RequestException, CircuitOpenError, ValueError) as exc:
+            raise CommandError(f'Could not reach the Marvel API: {exc}')
+
+        total = first_page['total']
+        if options['max_comics'] is not None:
+            total = min(total, options['max_comics'])
+
+        synced = self.sync(
+            client, first_page, offset, total, page_size,
+            options['workers'], options['batch_size'],
+        )
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        self.stdout.write(self.style.SUCCESS(
+            f'Synced {synced} comics ({total} in the catalog).'
+        ))
+
+    def sync(self, client, first_page, offset, total, page_size, workers,
+             batch_size):
+        '''
+        Recorre las páginas desde `offset` hasta `total`. Las páginas se
+        piden en paralelo pero se procesan en orden, de modo que el
+        checkpoint siempre indica un punto a partir del cual no falta nada.
+        '''
+        synced = 0
+        buffer = []
+        next_offset = offset + page_size
+        offsets = iter(range(next_offset, total, page_size))
+
+        def fetch(page_offset):
+            return client.get_comics(offset=page_offset, limit=page_size)
+
+        def flush(checkpoint_offset):
+            nonlocal synced
+            if buffer:
+                synced += len(Comic.objects.bulk_upsert(
+                    buffer, UPDATE_FIELDS, batch_size=batch_size
+                ))
+                buffer.clear()
+            self.save_checkpoint(checkpoint_offset, total, page_size)
+
+        # NOTE: Mantenemos a lo sumo 2 páginas por worker en vuelo, así la
+        # memoria no crece aunque la base de datos sea más lenta que la API.
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for page_offset in offsets:
+                pending.append(executor.submit(fetch, page_offset))
+                if len(pending) >= workers * 2:
+                    break
+
+            page = first_page
+            while page is not None:
+                results = page['results'][:max(total - page['offset'], 0)]
+                buffer.extend(
+                    normalize_comic(comic) for comic in results
+                    if comic.get('id') is not None
+                )
+                next_offset = page['offset'] + page_size
+                if len(buffer) >= batch_size:
+                    flush(next_offset)
+
+                if not pending:
+                    break
+                try:
+                    page = pending.popleft().result()
+                except (requests.RequestException, CircuitOpenError, ValueError) as exc:
+                    for future in pending:
+                        future.cancel()
+                    flush(next_offset)
+                    raise CommandError(
+                        f'Sync stopped at offset {next_offset}: {exc}. '
+                        'Run the command again to resume.'
+                    )
+                for page_offset in offsets:
+                    pending.append(executor.submit(fetch, page_offset))
+                    break
+
+        flush(next_offset)
+        return synced
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_checkpoint(self, next_offset, total, page_size):
+        # NOTE: Escribimos a un archivo temporal y lo renombramos para que
+        # el checkpoint nunca quede a medio escribir.
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(
+                {'next_offset': next_offset, 'total': total, 'page_size': page_size},
+                f
+            )
+        os.replace(tmp_path, self.checkpoint_path)
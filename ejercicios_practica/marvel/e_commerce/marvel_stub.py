@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class MarvelStubServer:
+    '''
+    Servidor HTTP local que imita el endpoint "comics" de la API de Marvel
+    (gateway.marvel.com/v1/public/comics), con un catálogo sintético y
+    determinístico de `total` comics. Sirve para probar el comando
+    "sync_marvel_catalog", la vista "get_comics" y los benchmarks sin
+    depender de la API real ni de su rate limit.
+
+    Uso:
+        stub = MarvelStubServer(total=5000).start()
+        # settings.MARVEL_API['URL_BASE'] = stub.url_base
+        ...
+        stub.stop()
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0, total=1000, latency=0.0):
+        self.total = total
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url_base(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1/public/'
+
+    def comic(self, index):
+        # NOTE: Igual que en la API real, algunos comics vienen sin
+        # descripción y sin precio.
+        return {
+            'id': 100000 + index,
+            'title': f'Stub Comic #{index}',
+            'description': None if index % 4 == 0 else f'Stub description {index}',
+            'prices': [{
+                'type': 'printPrice',
+                'price': 0.0 if index % 5 == 0 else round(1.99 + index % 7, 2),
+            }],
+            'thumbnail': {
+                'path': f'http://i.annihil.us/u/prod/marvel/i/mg/stub/{index}',
+                'extension': 'jpg',
+            },
+        }
+
+    def page(self, offset, limit):
+        results = [
+            self.comic(index)
+            for index in range(offset, min(offset + limit, self.total))
+        ]
+        return {
+            'code': 200,
+            'status': 'Ok',
+            'data': {
+                'offset': offset,
+                'limit': limit,
+                'total': self.total,
+                'count': len(results),
+                'results': results,
+            },
+        }
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if not url.path.rstrip('/').endswith('/comics'):
+                    return self._send(404, {'code': 404, 'status': 'Not found'})
+                query = parse_qs(url.query)
+                try:
+                    offset = int(query.get('offset', ['0'])[0])
+                    limit = int(query.get('limit', ['20'])[0])
+                except ValueError:
+                    return self._send(409, {'code': 409, 'status': 'Invalid'})
+                if offset < 0 or not 0 < limit <= 100:
+                    return self._send(409, {'code': 409, 'status': 'Invalid'})
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                self._send(200, stub.page(offset, limit))
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        '''
+        Levanta el servidor en un thread en segundo plano.
+        '''
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,128 @@
+from django.db.migrations.operations import AddConstraint, AddIndex, RunSQL
+
+
+# NOTE: Operaciones de migración que en Postgres construyen los índices con
+# CREATE INDEX CONCURRENTLY, que no bloquea las escrituras de la tabla
+# mientras se arma el índice. En otras bases de datos se comportan como
+# AddIndex/AddConstraint normales. No usamos las de
+# "django.contrib.postgres.operations" porque importan psycopg2 y las
+# migraciones tienen que poder correr también sobre SQLite.
+#
+# CONCURRENTLY no puede ejecutarse dentro de una transacción, por lo que
+# las migraciones que usen estas operaciones deben declarar "atomic = False".
+
+
+def _is_postgres(schema_editor):
+    return schema_editor.connection.vendor == 'postgresql'
+
+
+def drop_invalid_index(schema_editor, name):
+    '''
+    Si un CREATE INDEX CONCURRENTLY anterior falló (por ejemplo por filas
+    duplicadas), Postgres deja el índice creado pero marcado como inválido.
+    Lo borramos para que la migración se pueda volver a correr.
+    '''
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT NOT i.indisvalid FROM pg_index i '
+            'JOIN pg_class c ON c.oid = i.indexrelid '
+            'WHERE c.relname = %s AND pg_table_is_visible(c.oid)',
+            [name]
+        )
+        row = cursor.fetchone()
+    if row and row[0]:
+        schema_editor.execute(
+            f'DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(name)}'
+        )
+
+
+class AddIndexConcurrently(AddIndex):
+    '''
+    Igual que AddIndex, pero en Postgres crea el índice con
+    CREATE INDEX CONCURRENTLY.
+    '''
+    atomic = False
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not _is_postgres(schema_editor):
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            drop_invalid_index(schema_editor, self.index.name)
+            schema_editor.add_index(model, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if not _is_postgres(schema_editor):
+            return super().database_backwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+
+    def describe(self):
+        return f'{super().describe()} (concurrently on PostgreSQL)'
+
+
+class AddUniqueConstraintConcurrently(AddConstraint):
+    '''
+    Igual que AddConstraint para un UniqueConstraint sobre columnas (sin
+    condición), pero en Postgres primero crea el índice único con
+    CREATE UNIQUE INDEX CONCURRENTLY y después lo convierte en la
+    restricción con:
+        ALTER TABLE ... ADD CONSTRAINT ... UNIQUE USING INDEX ...
+    que sólo toma el lock de la tabla un instante.
+    '''
+    atomic = False
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not _is_postgres(schema_editor):
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        qn = schema_editor.quote_name
+        name = self.constraint.name
+        columns = ', '.join(
+            qn(model._meta.get_field(field).column)
+            for field in self.constraint.fields
+        )
+        drop_invalid_index(schema_editor, name)
+        schema_editor.execute(
+            f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {qn(name)} '
+            f'ON {qn(model._meta.db_table)} ({columns})'
+        )
+        schema_editor.execute(
+            f'ALTER TABLE {qn(model._meta.db_table)} '
+            f'ADD CONSTRAINT {qn(name)} UNIQUE USING INDEX {qn(name)}'
+        )
+
+    def describe(self):
+        return f'{super().describe()} (concurrently on PostgreSQL)'
+
+
+class RunSQLOnPostgreSQL(RunSQL):
+    '''
+    Igual que RunSQL, pero sólo se ejecuta en Postgres. En otras bases de
+    datos no hace nada, para SQL que usa funciones o tipos propios de
+    Postgres (triggers, tsvector, extensiones).
+    '''
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if _is_postgres(schema_editor):
+            super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if _is_postgres(schema_editor):
+            super().database_backwards(
+                app_label, schema_editor, from_state, to_state
+            )
+
+    def describe(self):
+        return f'{super().describe()} (PostgreSQL only)'
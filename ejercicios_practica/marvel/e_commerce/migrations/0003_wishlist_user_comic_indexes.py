@@ -0,0 +1,54 @@
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+from e_commerce.migration_operations import (
+    AddIndexConcurrently, AddUniqueConstraintConcurrently
+)
+
+
+def remove_duplicated_wishes(apps, schema_editor):
+    '''
+    Antes de crear el índice único dejamos una sola fila por (user, comic):
+    nos quedamos con la más antigua y borramos el resto.
+    '''
+    WishList = apps.get_model('e_commerce', 'WishList')
+    duplicated = (
+        WishList.objects.using(schema_editor.connection.alias)
+        .values('user', 'comic')
+        .annotate(rows=Count('id'), keep=Min('id'))
+        .filter(rows__gt=1)
+    )
+    for row in duplicated:
+        WishList.objects.using(schema_editor.connection.alias).filter(
+            user=row['user'], comic=row['comic']
+        ).exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    # NOTE: CREATE INDEX CONCURRENTLY no se puede ejecutar dentro de una
+    # transacción. El borrado de duplicados corre igual en su propia
+    # transacción (atomic=True en su RunPython).
+    atomic = False
+
+    dependencies = [
+        ('e_commerce', '0002_auto_20230204_1911'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicated_wishes, migrations.RunPython.noop, atomic=True
+        ),
+        AddUniqueConstraintConcurrently(
+            model_name='wishlist',
+            constraint=models.UniqueConstraint(fields=('user', 'comic'), name='wish_list_user_comic_uniq'),
+        ),
+        AddIndexConcurrently(
+            model_name='wishlist',
+            index=models.Index(condition=models.Q(('cart', True)), fields=['user', 'comic'], name='wish_list_user_cart_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='wishlist',
+            index=models.Index(condition=models.Q(('favorite', True)), fields=['user', 'comic'], name='wish_list_user_favorite_idx'),
+        ),
+    ]
@@ -0,0 +1,116 @@
+from django.db import migrations
+
+from e_commerce.migration_operations import RunSQLOnPostgreSQL, drop_invalid_index
+
+
+# NOTE: La columna "search_vector" (tsvector) de e_commerce_comics la
+# mantiene un trigger de Postgres a partir del título (peso A) y de la
+# descripción (peso B). No es un campo del modelo: sólo la usa
+# ComicQuerySet.search(), y así no viaja en cada SELECT de comics.
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce({row}title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce({row}description, '')), 'B')"
+)
+
+SEARCH_INDEXES = (
+    (
+        'comics_search_vector_idx',
+        'ON e_commerce_comics USING gin (search_vector)',
+    ),
+    # Búsqueda aproximada por título (errores de tipeo, palabras a medias).
+    (
+        'comics_title_trgm_idx',
+        'ON e_commerce_comics USING gin (title gin_trgm_ops)',
+    ),
+)
+
+
+def fill_search_vector(apps, schema_editor, batch_size=10000):
+    '''
+    Completa "search_vector" de los comics existentes de a lotes, cada uno
+    en su propia transacción, para no bloquear toda la tabla a la vez.
+    '''
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT coalesce(max("ID"), 0) FROM e_commerce_comics')
+        last_id = cursor.fetchone()[0]
+        for start in range(0, last_id, batch_size):
+            cursor.execute(
+                f'UPDATE e_commerce_comics '
+                f'SET search_vector = {SEARCH_VECTOR.format(row="")} '
+                f'WHERE "ID" > %s AND "ID" <= %s',
+                [start, start + batch_size]
+            )
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in SEARCH_INDEXES:
+        drop_invalid_index(schema_editor, name)
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}'
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    # NOTE: Igual que la 0003, los índices se crean con CONCURRENTLY, que no
+    # puede ejecutarse dentro de una transacción. En otras bases de datos
+    # que no sean Postgres esta migración no hace nada.
+    atomic = False
+
+    dependencies = [
+        ('e_commerce', '0003_wishlist_user_comic_indexes'),
+    ]
+
+    operations = [
+        RunSQLOnPostgreSQL(
+            # pg_trgm viene con Postgres; desde la versión 13 el dueño de la
+            # base puede instalarla sin ser superusuario.
+            sql='CREATE EXTENSION IF NOT EXISTS pg_trgm',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        RunSQLOnPostgreSQL(
+            sql=[
+                'ALTER TABLE e_commerce_comics '
+                'ADD COLUMN IF NOT EXISTS search_vector tsvector',
+                f'''
+                CREATE OR REPLACE FUNCTION e_commerce_comics_search_vector()
+                RETURNS trigger AS $$
+                BEGIN
+                    NEW.search_vector := {SEARCH_VECTOR.format(row="NEW.")};
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql
+                ''',
+                'DROP TRIGGER IF EXISTS e_commerce_comics_search_vector '
+                'ON e_commerce_comics',
+                'CREATE TRIGGER e_commerce_comics_search_vector '
+                'BEFORE INSERT OR UPDATE OF title, description '
+                'ON e_commerce_comics FOR EACH ROW '
+                'EXECUTE FUNCTION e_commerce_comics_search_vector()',
+            ],
+            reverse_sql=[
+                'DROP TRIGGER IF EXISTS e_commerce_comics_search_vector '
+                'ON e_commerce_comics',
+                'DROP FUNCTION IF EXISTS e_commerce_comics_search_vector()',
+                'ALTER TABLE e_commerce_comics '
+                'DROP COLUMN IF EXISTS search_vector',
+            ],
+        ),
+        migrations.RunPython(
+            fill_search_vector, migrations.RunPython.noop, atomic=False
+        ),
+        migrations.RunPython(
+            create_search_indexes, drop_search_indexes, atomic=False
+        ),
+    ]
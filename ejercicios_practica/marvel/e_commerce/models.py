@@ -1,11 +1,224 @@
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
 
 # NOTE: Para poder utilizar el modelo "user" que viene por defecto en Django,
 # Debemos importarlo previamente:
 from django.contrib.auth.models import User
 
+from e_commerce.catalog import catalog_changed
+
 
 # Create your models here.
+class ComicQuerySet(models.QuerySet):
+    # NOTE: Las escrituras masivas no disparan las señales post_save y
+    # post_delete, por eso cambian la versión del catálogo acá.
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        if rows:
+            catalog_changed(self.db)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if objs:
+            catalog_changed(self.db)
+        return objs
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        rows = super().bulk_update(objs, fields, batch_size=batch_size)
+        catalog_changed(self.db)
+        return rows
+
+    def search(self, query):
+        '''
+        Devuelve los comics que coinciden con `query`, anotados con "score"
+        (mayor es mejor).
+
+        En Postgres busca las palabras en el título y la descripción con la
+        columna "search_vector" (tsvector, ver migración 0004) y, por
+        separado, títulos parecidos por trigramas (pg_trgm), así "spidrman"
+        también encuentra "Spider-Man". Ambas condiciones usan sus índices
+        GIN. El "score" suma el ranking del texto y la similitud del título.
+
+        En otras bases de datos busca con "icontains" y todos los resultados
+        tienen "score" 0.
+        '''
+        connection = connections[self.db]
+        if connection.vendor != 'postgresql':
+            return self.filter(
+                Q(title__icontains=query) | Q(description__icontains=query)
+            ).annotate(score=Value(0.0, output_field=FloatField()))
+
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        vector = f'{table}.search_vector'
+        title = f'{table}.{qn(self.model._meta.get_field("title").column)}'
+        # NOTE: websearch_to_tsquery acepta lo que escribe un usuario
+        # (spider man, "x-men", -venom) sin errores de sintaxis.
+        tsquery = "websearch_to_tsquery('english', %s)"
+        # El "score" es double precision para que el valor que viaja en el
+        # cursor del paginado sea exactamente el mismo que se compara.
+        return self.annotate(score=RawSQL(
+            f'(ts_rank_cd({vector}, {tsquery})::double precision + '
+            f'similarity({title}, %s)::double precision)',
+            (query, query), output_field=FloatField()
+        )).filter(RawSQL(
+            f'({vector} @@ {tsquery} OR {title} %% %s)',
+            (query, query), output_field=models.BooleanField()
+        ))
+
+    def add_stock(self, marvel_id, qty, defaults=None):
+        '''
+        Suma `qty` al stock del comic con ese "marvel_id" o, si todavía no
+        existe, lo crea con los valores de `defaults` y ese stock.
+
+        En Postgres se resuelve en una sola sentencia y un solo viaje a la
+        base de datos:
+            INSERT ... ON CONFLICT (marvel_id)
+            DO UPDATE SET stock_qty = stock_qty + EXCLUDED.stock_qty
+        por lo que compras concurrentes nunca pierden incrementos. En otras
+        bases de datos se usa un UPDATE con una expresión F(), que también
+        es atómico, y sólo si no actualizó ninguna fila se inserta.
+        '''
+        # Los valores que no vienen se completan con los default del modelo.
+        defaults = {
+            name: value for name, value in (defaults or {}).items()
+            if value is not None and name not in ('marvel_id', 'stock_qty')
+        }
+        connection = connections[self.db]
+        if connection.vendor == 'postgresql':
+            stock_qty = connection.ops.quote_name(
+                self.model._meta.get_field('stock_qty').column
+            )
+            self._upsert(
+                connection,
+                [dict(defaults, marvel_id=marvel_id, stock_qty=qty)],
+                [
+                    f'{stock_qty} = '
+                    f'{connection.ops.quote_name(self.model._meta.db_table)}.'
+                    f'{stock_qty} + EXCLUDED.{stock_qty}'
+                ],
+            )
+            return
+
+        if self.filter(marvel_id=marvel_id).update(
+            stock_qty=F('stock_qty') + qty
+        ):
+            return
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(marvel_id=marvel_id, stock_qty=qty, **defaults)
+        except IntegrityError:
+            # Otro request lo creó entre el UPDATE y el INSERT.
+            self.filter(marvel_id=marvel_id).update(
+                stock_qty=F('stock_qty') + qty
+            )
+
+    def bulk_upsert(self, rows, update_fields, batch_size=1000):
+        '''
+        Inserta los comics de `rows` (diccionarios con los campos del
+        modelo) y, para los "marvel_id" que ya existen, actualiza sólo los
+        campos de `update_fields`.
+
+        Devuelve un diccionario {marvel_id: creado} de las filas escritas:
+        True si se insertó y False si se actualizó. Si `update_fields` está
+        vacío los comics que ya existían no se escriben ni se devuelven.
+
+        En Postgres cada lote es un único
+            INSERT ... VALUES (...), (...) ON CONFLICT (marvel_id)
+            DO UPDATE SET campo = EXCLUDED.campo
+            RETURNING marvel_id, (xmax = 0)
+        ("xmax" es 0 sólo en las filas recién insertadas). En otras bases de
+        datos se usa `bulk_create(ignore_conflicts=True)` seguido de un
+        `bulk_update()` de las filas que ya existían.
+        '''
+        # Si un "marvel_id" viene repetido nos quedamos con el último.
+        rows = list({row['marvel_id']: row for row in rows}.values())
+        connection = connections[self.db]
+        written = {}
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            if connection.vendor == 'postgresql':
+                written.update(self._upsert(connection, batch, [
+                    f'{column} = EXCLUDED.{column}' for column in (
+                        connection.ops.quote_name(
+                            self.model._meta.get_field(name).column
+                        )
+                        for name in update_fields
+                    )
+                ]))
+                continue
+
+            with transaction.atomic(using=self.db):
+                existing = dict(self.filter(
+                    marvel_id__in=[row['marvel_id'] for row in batch]
+                ).values_list('marvel_id', 'id'))
+                self.bulk_create(
+                    [
+                        self.model(**row) for row in batch
+                        if row['marvel_id'] not in existing
+                    ],
+                    ignore_conflicts=True,
+                )
+                to_update = [
+                    self.model(id=existing[row['marvel_id']], **row)
+                    for row in batch if row['marvel_id'] in existing
+                ]
+                if to_update and update_fields:
+                    self.bulk_update(to_update, update_fields)
+                    written.update(
+                        (comic.marvel_id, False) for comic in to_update
+                    )
+                written.update(
+                    (row['marvel_id'], True) for row in batch
+                    if row['marvel_id'] not in existing
+                )
+        return written
+
+    def _upsert(self, connection, rows, conflict_updates):
+        '''
+        Ejecuta un INSERT de varias filas con ON CONFLICT (marvel_id) DO
+        UPDATE SET <conflict_updates>, o DO NOTHING si no hay nada que
+        actualizar. Los campos que no vienen en cada fila se completan con
+        los default del modelo. Devuelve {marvel_id: creado} de las filas
+        insertadas o actualizadas.
+        '''
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        fields = [field for field in opts.concrete_fields if not field.primary_key]
+        params = []
+        for row in rows:
+            params.extend(
+                field.get_db_prep_save(
+                    field.to_python(row[field.name])
+                    if field.name in row else field.get_default(),
+                    connection
+                )
+                for field in fields
+            )
+        placeholders = f'({", ".join(["%s"] * len(fields))})'
+        sql = (
+            f'INSERT INTO {qn(opts.db_table)} '
+            f'({", ".join(qn(field.column) for field in fields)}) '
+            f'VALUES {", ".join([placeholders] * len(rows))} '
+            f'ON CONFLICT ({qn(opts.get_field("marvel_id").column)}) '
+        )
+        if conflict_updates:
+            sql += f'DO UPDATE SET {", ".join(conflict_updates)} '
+        else:
+            sql += 'DO NOTHING '
+        sql += (
+            f'RETURNING {qn(opts.get_field("marvel_id").column)}, (xmax = 0)'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            written = dict(cursor.fetchall())
+        catalog_changed(self.db)
+        return written
+
+
 class Comic(models.Model):
     '''
     Esta clase hereda de Django models.Model y crea una tabla llamada
@@ -27,6 +240,8 @@ class Comic(models.Model):
     )
     picture = models.URLField(verbose_name='picture', default='')
 
+    objects = ComicQuerySet.as_manager()
+
     class Meta:
         '''
         Con "class Meta" podemos definir atributos de nuestras entidades
@@ -72,6 +287,26 @@ class WishList(models.Model):
         db_table = 'e_commerce_wish_list'
         verbose_name = 'wish list'
         verbose_name_plural = 'wish lists'
+        # NOTE: Cada usuario tiene a lo sumo una fila por comic. El índice
+        # único (user, comic) también resuelve las búsquedas por usuario,
+        # y los índices parciales sólo guardan las filas del carrito o de
+        # favoritos, así que listar esas filas de un usuario no recorre la
+        # tabla. Se crean en la migración 0003 sin bloquear escrituras.
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'comic'), name='wish_list_user_comic_uniq'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', 'comic'), condition=models.Q(cart=True),
+                name='wish_list_user_cart_idx'
+            ),
+            models.Index(
+                fields=('user', 'comic'), condition=models.Q(favorite=True),
+                name='wish_list_user_favorite_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.id}'
\ No newline at end of file
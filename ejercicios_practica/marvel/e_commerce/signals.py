@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from e_commerce.api.authentication import CachedTokenAuthentication
+from e_commerce.catalog import catalog_changed
+from e_commerce.models import Comic
+
+
+# NOTE: Cada alta, modificación o baja de un comic hecha con el ORM (vistas
+# de API, Django Admin, shell) cambia la versión del catálogo. Las
+# escrituras masivas que no disparan señales (".update()", ".bulk_create()",
+# upserts) lo hacen desde ComicQuerySet.
+@receiver(post_save, sender=Comic)
+@receiver(post_delete, sender=Comic)
+def comic_changed(sender, using, **kwargs):
+    catalog_changed(using)
+
+
+# NOTE: CachedTokenAuthentication guarda el token y su usuario en cache.
+# Cuando alguno de los dos cambia o se borra, descartamos la copia. Lo
+# hacemos en el momento y otra vez después del commit, por si un request
+# concurrente volvió a guardar en el cache los datos anteriores.
+def _invalidate_tokens(using, *keys):
+    if keys:
+        CachedTokenAuthentication.invalidate(*keys)
+        transaction.on_commit(
+            lambda: CachedTokenAuthentication.invalidate(*keys), using=using
+        )
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def token_changed(sender, instance, using, **kwargs):
+    _invalidate_tokens(using, instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, using, created, update_fields, **kwargs):
+    # El login sólo actualiza "last_login", que no afecta la autenticación.
+    if created or update_fields == frozenset(('last_login',)):
+        return
+    _invalidate_tokens(
+        using,
+        *Token.objects.using(using).filter(user=instance)
+        .values_list('key', flat=True)
+    )
@@ -1,3 +1,1398 @@
-from django.test import TestCase
+import asyncio
+import cProfile
+import datetime
+import decimal
+import io
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from unittest import mock
 
-# Create your tests here.
+import httpx
+
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, override_settings
+)
+from django.utils.translation import gettext_lazy
+
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from e_commerce.api.authentication import (
+    CachedTokenAuthentication, local_token_cache
+)
+from e_commerce.api import login_views
+from e_commerce.api.marvel_client import AsyncMarvelClient, MarvelClient
+from e_commerce.api.pagination import ComicCursorPagination
+from e_commerce.api.page_cache import PageCache, comics_page_cache
+from e_commerce.api.parsers import FastJSONParser
+from e_commerce.api.renderers import FastJSONRenderer
+from e_commerce.api.resilience import (
+    AsyncSingleFlight, CircuitBreaker, CircuitOpenError, SingleFlight
+)
+from e_commerce.catalog import get_catalog_version
+from e_commerce.management.commands.bench_endpoints import percentile
+from e_commerce.models import Comic, WishList
+from marvel import metrics, profiling
+from marvel.db import pool as db_pool
+from marvel.db.pool import ConnectionPool, PoolTimeout
+from marvel.profiling import ProfilingMiddleware
+
+
+class FakeClock:
+    '''
+    Reloj para los tests: sólo avanza cuando se llama a `advance()`.
+    '''
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class StubFetcher:
+    '''
+    Reemplazo de la API de Marvel: devuelve "<nombre>-<n>" en la llamada
+    número n, o lanza `error` si está configurado. Si `release` es un
+    Event, cada llamada espera a que se active.
+    '''
+
+    def __init__(self, name='page', error=None, release=None):
+        self.name = name
+        self.error = error
+        self.release = release
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        if self.release is not None:
+            self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return f'{self.name}-{calls}'
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('Timed out waiting for condition.')
+        time.sleep(0.001)
+
+
+# NOTE: Cache de páginas de Marvel (e_commerce/api/page_cache.py).
+
+class PageCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = PageCache(
+            max_entries=2, ttl=10, stale_ttl=100, clock=self.clock
+        )
+
+    def test_fresh_entry_is_served_from_cache(self):
+        fetch = StubFetcher()
+        self.assertEqual(self.cache.get((0, 15), fetch), 'page-1')
+        self.clock.advance(9)
+        self.assertEqual(self.cache.get((0, 15), fetch), 'page-1')
+        self.assertEqual(fetch.calls, 1)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_stale_entry_is_served_while_refreshing_once(self):
+        self.cache.get((0, 15), StubFetcher())
+        self.clock.advance(11)
+        release = threading.Event()
+        fetch = StubFetcher(release=release)
+
+        # Mientras el refresco está en curso se sirve el valor vencido y no
+        # se lanza otro refresco para la misma clave.
+        self.assertEqual(self.cache.get((0, 15), fetch), 'page-1')
+        self.assertEqual(self.cache.get((0, 15), fetch), 'page-1')
+        release.set()
+        wait_until(lambda: self.cache.stats()['refreshes'] == 1)
+
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(self.cache.get((0, 15), fetch), 'page-1')
+        self.assertEqual(self.cache.peek((0, 15)).value, 'page-1')
+        self.assertEqual(self.cache.stats()['stale_hits'], 2)
+
+    def test_refreshed_value_replaces_stale_entry(self):
+        self.cache.get((0, 15), StubFetcher('old'))
+        self.clock.advance(11)
+        self.cache.get((0, 15), StubFetcher('new'))
+        wait_until(lambda: self.cache.stats()['refreshes'] == 1)
+        self.assertEqual(self.cache.get((0, 15), StubFetcher()), 'new-1')
+
+    def test_failed_refresh_keeps_stale_entry(self):
+        self.cache.get((0, 15), StubFetcher())
+        self.clock.advance(11)
+        with self.assertLogs('e_commerce.api.page_cache', 'WARNING'):
+            self.cache.get((0, 15), StubFetcher(error=ValueError('down')))
+            wait_until(lambda: self.cache.stats()['refresh_errors'] == 1)
+        self.assertEqual(self.cache.peek((0, 15)).value, 'page-1')
+
+    def test_expired_entry_is_loaded_again(self):
+        self.cache.get((0, 15), StubFetcher('old'))
+        self.clock.advance(111)
+        self.assertEqual(self.cache.get((0, 15), StubFetcher('new')), 'new-1')
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_last_good_page_is_served_when_upstream_fails(self):
+        self.cache.get((0, 15), StubFetcher())
+        self.clock.advance(111)
+        failing = StubFetcher(error=ValueError('down'))
+        self.assertEqual(self.cache.get((0, 15), failing), 'page-1')
+        self.assertEqual(self.cache.stats()['fallbacks'], 1)
+
+    def test_error_is_raised_without_a_previous_page(self):
+        with self.assertRaises(ValueError):
+            self.cache.get((0, 15), StubFetcher(error=ValueError('down')))
+        self.assertIsNone(self.cache.peek((0, 15)))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.get('a', StubFetcher('a'))
+        self.cache.get('b', StubFetcher('b'))
+        self.cache.get('a', StubFetcher('a'))
+        self.cache.get('c', StubFetcher('c'))
+        self.assertIsNotNone(self.cache.peek('a'))
+        self.assertIsNone(self.cache.peek('b'))
+        self.assertIsNotNone(self.cache.peek('c'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_concurrent_misses_are_coalesced(self):
+        release = threading.Event()
+        fetch = StubFetcher(release=release)
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(self.cache.get('k', fetch))
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        wait_until(lambda: self.cache.stats()['coalesced'] == 4)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(results, ['page-1'] * 5)
+
+    def test_async_concurrent_misses_are_coalesced(self):
+        calls = []
+
+        async def aloader():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'async-page'
+
+        async def main():
+            return await asyncio.gather(
+                *(self.cache.aget('k', aloader) for _ in range(5))
+            )
+
+        self.assertEqual(asyncio.run(main()), ['async-page'] * 5)
+        self.assertEqual(len(calls), 1)
+
+
+# NOTE: Single-flight y circuit breaker (e_commerce/api/resilience.py).
+
+class SingleFlightTests(SimpleTestCase):
+
+    def run_concurrently(self, flight, func, count=5):
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(flight.do('key', func))
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        wait_until(lambda: flight.coalesced == count - 1)
+        func.release.set()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_calls_share_one_result(self):
+        flight = SingleFlight()
+        fetch = StubFetcher(release=threading.Event())
+        results, errors = self.run_concurrently(flight, fetch)
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(results, ['page-1'] * 5)
+        self.assertEqual(errors, [])
+
+    def test_concurrent_calls_share_one_error(self):
+        flight = SingleFlight()
+        error = ValueError('down')
+        fetch = StubFetcher(error=error, release=threading.Event())
+        results, errors = self.run_concurrently(flight, fetch)
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(results, [])
+        self.assertEqual(errors, [error] * 5)
+
+    def test_next_call_runs_again(self):
+        flight = SingleFlight()
+        fetch = StubFetcher()
+        self.assertEqual(flight.do('key', fetch), 'page-1')
+        self.assertEqual(flight.do('key', fetch), 'page-2')
+
+    def test_async_calls_share_one_task(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        async def main():
+            return await asyncio.gather(
+                *(flight.do('key', fetch) for _ in range(5))
+            )
+
+        self.assertEqual(asyncio.run(main()), [1] * 5)
+        self.assertEqual(flight.coalesced, 4)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(
+            failure_threshold=3, reset_timeout=30, clock=self.clock
+        )
+
+    def fail(self, times):
+        for _ in range(times):
+            self.breaker.before_call()
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.fail(1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+        self.assertEqual(self.breaker.stats()['rejected'], 1)
+
+    def test_success_resets_failure_count(self):
+        self.fail(2)
+        self.breaker.record_success()
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_allows_a_single_trial(self):
+        self.fail(3)
+        self.clock.advance(30)
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_successful_trial_closes_the_circuit(self):
+        self.fail(3)
+        self.clock.advance(30)
+        self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.before_call()
+
+    def test_failed_trial_opens_the_circuit_again(self):
+        self.fail(3)
+        self.clock.advance(30)
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.clock.advance(29)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+        self.clock.advance(1)
+        self.breaker.before_call()
+
+    def test_released_trial_lets_another_call_try(self):
+        self.fail(3)
+        self.clock.advance(30)
+        self.breaker.before_call()
+        self.breaker.release_trial()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.breaker.before_call()
+
+
+class MarvelClientBreakerTests(SimpleTestCase):
+    '''
+    Una llamada de prueba (half_open) que no termina con un error HTTP no
+    puede dejar el circuito abierto para siempre.
+    '''
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.client = MarvelClient(
+            'http://marvel.test/', 'public', 'private', max_retries=0
+        )
+        self.client.breaker = CircuitBreaker(
+            failure_threshold=1, reset_timeout=30, clock=self.clock
+        )
+        self.client.breaker.record_failure()
+        self.clock.advance(30)
+
+    def test_cancelled_async_trial_releases_the_circuit(self):
+        client = AsyncMarvelClient.from_client(self.client)
+        started = asyncio.Event()
+
+        async def handler(request):
+            started.set()
+            await asyncio.sleep(10)
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            client._http_clients[loop] = http_client = httpx.AsyncClient(
+                transport=httpx.MockTransport(handler)
+            )
+            task = loop.create_task(client.get('comics'))
+            await started.wait()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            await http_client.aclose()
+
+        asyncio.run(main())
+        self.assertEqual(self.client.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.client.breaker.before_call()
+
+    def test_unexpected_sync_error_releases_the_circuit(self):
+        def get(*args, **kwargs):
+            raise RuntimeError('boom')
+
+        self.client.session.get = get
+        with self.assertRaises(RuntimeError):
+            self.client.get('comics')
+        self.client.breaker.before_call()
+
+
+# NOTE: Escrituras de stock y del catálogo (ComicQuerySet). Corren contra la
+# base de datos configurada, así que cubren la rama de Postgres o la de las
+# otras bases de datos según el entorno.
+
+class ComicQuerySetTests(TestCase):
+
+    def test_add_stock_creates_the_comic(self):
+        Comic.objects.add_stock(1, 3, {'title': 'Hulk', 'price': None})
+        comic = Comic.objects.get(marvel_id=1)
+        self.assertEqual((comic.title, comic.stock_qty), ('Hulk', 3))
+        self.assertEqual(comic.price, 0.0)
+
+    def test_add_stock_accumulates(self):
+        Comic.objects.add_stock(1, 3, {'title': 'Hulk'})
+        Comic.objects.add_stock(1, 2, {'title': 'Otro título'})
+        Comic.objects.add_stock(1, 5)
+        comic = Comic.objects.get(marvel_id=1)
+        self.assertEqual((comic.title, comic.stock_qty), ('Hulk', 10))
+
+    def test_bulk_upsert_reports_created_and_updated(self):
+        Comic.objects.create(marvel_id=1, title='Hulk')
+        written = Comic.objects.bulk_upsert(
+            [{'marvel_id': 1, 'title': 'Hulk #2'},
+             {'marvel_id': 2, 'title': 'Thor'}],
+            ['title'],
+        )
+        self.assertEqual(written, {1: False, 2: True})
+        self.assertEqual(
+            dict(Comic.objects.values_list('marvel_id', 'title')),
+            {1: 'Hulk #2', 2: 'Thor'},
+        )
+
+    def test_bulk_upsert_never_overwrites_stock(self):
+        Comic.objects.add_stock(1, 7, {'title': 'Hulk'})
+        Comic.objects.bulk_upsert(
+            [{'marvel_id': 1, 'title': 'Hulk #2', 'price': 4.5}],
+            ['title', 'price'],
+        )
+        comic = Comic.objects.get(marvel_id=1)
+        self.assertEqual(
+            (comic.title, comic.price, comic.stock_qty), ('Hulk #2', 4.5, 7)
+        )
+
+    def test_bulk_upsert_without_update_fields_skips_existing(self):
+        Comic.objects.create(marvel_id=1, title='Hulk')
+        written = Comic.objects.bulk_upsert(
+            [{'marvel_id': 1, 'title': 'Hulk #2'},
+             {'marvel_id': 2, 'title': 'Thor'}],
+            [],
+        )
+        self.assertEqual(written, {2: True})
+        self.assertEqual(Comic.objects.get(marvel_id=1).title, 'Hulk')
+
+    def assertCatalogChanged(self, write):
+        version, _ = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            write()
+        self.assertTrue(callbacks)
+        self.assertNotEqual(get_catalog_version()[0], version)
+
+    def test_add_stock_changes_catalog_version(self):
+        self.assertCatalogChanged(lambda: Comic.objects.add_stock(1, 3))
+        self.assertCatalogChanged(lambda: Comic.objects.add_stock(1, 3))
+
+    def test_bulk_upsert_changes_catalog_version(self):
+        self.assertCatalogChanged(lambda: Comic.objects.bulk_upsert(
+            [{'marvel_id': 1, 'title': 'Hulk'}], ['title']
+        ))
+        self.assertCatalogChanged(lambda: Comic.objects.bulk_upsert(
+            [{'marvel_id': 1, 'title': 'Hulk #2'}], ['title']
+        ))
+
+
+# NOTE: FastJSONRenderer y FastJSONParser (e_commerce/api/renderers.py y
+# parsers.py) tienen que ser intercambiables con los de DRF.
+
+# Casos que FastJSONRenderer tiene que escribir exactamente igual que
+# JSONRenderer (y que FastJSONParser tiene que leer igual que JSONParser).
+COMPAT_CASES = {
+    'empty dict': {},
+    'empty list': [],
+    'scalars': [0, -1, 2 ** 63 - 1, 1.5, 0.1, 19.99, True, False, None, ''],
+    'unicode': {'title': 'Tomé café ☕ 漫画 \U0001F600', 'quote': '"\\\n\t\r\x00'},
+    'line separators': {'text': 'a\u2028b\u2029c'},
+    'nested': {'a': [{'b': [1, {'c': None}]}], 'd': OrderedDict(z=1, a=2)},
+    'tuple': (1, 2, (3,)),
+    'big int': [2 ** 64, -(2 ** 70)],
+    'non str keys': {1: 'one', 2.5: 'two', None: 'none', False: 'no'},
+    'decimal': [decimal.Decimal('10.50'), decimal.Decimal('0.1')],
+    'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+    'datetime naive': datetime.datetime(2023, 2, 4, 19, 11, 5, 123456),
+    'datetime no micro': datetime.datetime(2023, 2, 4, 19, 11, 5),
+    'datetime utc': datetime.datetime(2023, 2, 4, 19, 11, 5, 1000, tzinfo=datetime.timezone.utc),
+    'datetime offset': datetime.datetime(
+        2023, 2, 4, 19, 11, tzinfo=datetime.timezone(datetime.timedelta(hours=-3))
+    ),
+    'date': datetime.date(2023, 2, 4),
+    'time': datetime.time(19, 11, 5, 999999),
+    'timedelta': datetime.timedelta(days=1, seconds=3.5),
+    'lazy string': gettext_lazy('This field is required.'),
+    'error detail': {'expand': [ErrorDetail('Unknown fields: x.', code='invalid')]},
+    'bytes': b'bytes value',
+    'set-like': {'ids': range(3)},
+    'nan': {'price': float('nan'), 'next': None},
+    'infinity': [None, [float('inf')], -float('inf')],
+    'decimal nan': [None, decimal.Decimal('NaN')],
+}
+
+# Bodies que ambos parsers tienen que aceptar o rechazar de la misma forma.
+PARSE_CASES = [
+    b'{"username": "root", "password": 12345}',
+    b'[1, 2.5, -3e-7, 1E+20, true, false, null]',
+    '{"t\\u00edtulo": "café \U0001F600"}'.encode(),
+    b'{"big": 123456789012345678901234567890}',
+    b'{"a": 1, "a": 2}',
+    b'  \n{"spaces": [ ]}\n ',
+    b'{"nan": NaN}',
+    b'{"broken": ',
+    b'\xef\xbb\xbf{"bom": 1}',
+    b'"\\ud800"',
+]
+
+
+class FastJSONTests(SimpleTestCase):
+
+    @staticmethod
+    def render(renderer, data, **context):
+        try:
+            return renderer.render(data, renderer_context=context)
+        except Exception as exc:
+            return f'{type(exc).__name__}: {exc}'
+
+    @staticmethod
+    def parse(parser, body):
+        try:
+            return repr(parser.parse(io.BytesIO(body), parser_context={}))
+        except ParseError as exc:
+            return f'ParseError: {exc}'
+
+    def test_render_matches_drf(self):
+        for name, data in COMPAT_CASES.items():
+            with self.subTest(name):
+                self.assertEqual(
+                    self.render(FastJSONRenderer(), data),
+                    self.render(JSONRenderer(), data),
+                )
+
+    def test_render_with_indent_matches_drf(self):
+        data = COMPAT_CASES['nested']
+        self.assertEqual(
+            self.render(FastJSONRenderer(), data, indent=4),
+            self.render(JSONRenderer(), data, indent=4),
+        )
+
+    def test_render_rejects_non_finite_floats(self):
+        for value in (float('nan'), float('inf'), -float('inf')):
+            with self.subTest(value), self.assertRaises(ValueError):
+                FastJSONRenderer().render({'price': value})
+
+    def test_parse_matches_drf(self):
+        for body in PARSE_CASES:
+            with self.subTest(body):
+                self.assertEqual(
+                    self.parse(FastJSONParser(), body),
+                    self.parse(JSONParser(), body),
+                )
+
+
+
+# NOTE: Pool de conexiones (marvel/db/pool.py), con conexiones falsas.
+
+class FakeConnection:
+    created = 0
+
+    def __init__(self):
+        FakeConnection.created += 1
+        self.number = FakeConnection.created
+        self.broken = False
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.checks = []
+        self.pool = ConnectionPool(
+            max_size=2, timeout=0, check_after=30, max_lifetime=1800,
+            check=self.check, clock=self.clock
+        )
+
+    def check(self, conn, full):
+        self.checks.append((conn, full))
+        return not conn.broken
+
+    def test_released_connection_is_reused(self):
+        conn = self.pool.acquire(FakeConnection)
+        self.pool.release(conn)
+        self.assertIs(self.pool.acquire(FakeConnection), conn)
+        stats = self.pool.stats()
+        self.assertEqual((stats['created'], stats['acquisitions']), (1, 2))
+
+    def test_exhausted_pool_times_out(self):
+        # NOTE: El pool identifica las conexiones por id(), así que hay que
+        # mantenerlas vivas mientras están en uso.
+        held = [self.pool.acquire(FakeConnection) for _ in range(2)]
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire(FakeConnection)
+        stats = self.pool.stats()
+        self.assertEqual((stats['size'], stats['timeouts']), (2, 1))
+        self.assertEqual(len(held), 2)
+
+    def test_waiter_gets_the_released_connection(self):
+        pool = ConnectionPool(max_size=1, timeout=5)
+        conn = pool.acquire(FakeConnection)
+        timer = threading.Timer(0.05, pool.release, (conn,))
+        timer.start()
+        self.assertIs(pool.acquire(FakeConnection), conn)
+        timer.join()
+        self.assertEqual(pool.stats()['waits'], 1)
+
+    def test_failed_connect_frees_its_slot(self):
+        def connect():
+            raise OSError('connection refused')
+
+        with self.assertRaises(OSError):
+            self.pool.acquire(connect)
+        self.assertEqual(self.pool.stats()['size'], 0)
+        held = [self.pool.acquire(FakeConnection) for _ in range(2)]
+        self.assertEqual(self.pool.stats()['in_use'], len(held))
+
+    def test_broken_connection_is_discarded(self):
+        conn = self.pool.acquire(FakeConnection)
+        self.pool.release(conn)
+        conn.broken = True
+        new = self.pool.acquire(FakeConnection)
+        self.assertIsNot(new, conn)
+        self.assertTrue(conn.closed)
+        stats = self.pool.stats()
+        self.assertEqual((stats['check_failures'], stats['size']), (1, 1))
+
+    def test_connection_not_reusable_is_closed(self):
+        conn = self.pool.acquire(FakeConnection)
+        self.pool.release(conn, reusable=False)
+        self.assertTrue(conn.closed)
+        self.assertEqual(self.pool.stats()['size'], 0)
+
+    def test_full_check_only_after_idle_time(self):
+        conn = self.pool.acquire(FakeConnection)
+        self.pool.release(conn)
+        self.clock.advance(29)
+        self.pool.release(self.pool.acquire(FakeConnection))
+        self.clock.advance(30)
+        self.assertIs(self.pool.acquire(FakeConnection), conn)
+        self.assertEqual(self.checks, [(conn, False), (conn, True)])
+
+    def test_old_connection_is_recycled_on_release(self):
+        conn = self.pool.acquire(FakeConnection)
+        self.clock.advance(1800)
+        self.pool.release(conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+    def test_old_idle_connection_is_recycled_on_acquire(self):
+        conn = self.pool.acquire(FakeConnection)
+        self.pool.release(conn)
+        self.clock.advance(1800)
+        self.assertIsNot(self.pool.acquire(FakeConnection), conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(self.checks, [])
+
+    def test_close_idle_connections_of_a_database(self):
+        keys = [('default', name, '', '', 'marvel') for name in ('test_a', 'b')]
+        self.addCleanup(lambda: [db_pool._pools.pop(key) for key in keys])
+        pools = [db_pool.get_pool(key) for key in keys]
+        conns = [pool.acquire(FakeConnection) for pool in pools]
+        for pool, conn in zip(pools, conns):
+            pool.release(conn)
+        db_pool.close_idle_connections('test_a')
+        self.assertEqual([conn.closed for conn in conns], [True, False])
+
+    def test_close_idle(self):
+        idle = self.pool.acquire(FakeConnection)
+        busy = self.pool.acquire(FakeConnection)
+        self.pool.release(idle)
+        self.pool.close_idle()
+        self.assertTrue(idle.closed)
+        self.assertFalse(busy.closed)
+        self.assertEqual(self.pool.stats()['size'], 1)
+
+
+
+# NOTE: Endpoints de escritura masiva (comics/bulk y wish/bulk).
+
+class BulkComicAPITests(APITestCase):
+    url = '/e-commerce/comics/bulk'
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user(
+            'admin', password='x', is_staff=True
+        ))
+
+    def test_creates_and_updates_comics(self):
+        Comic.objects.create(marvel_id=1, title='Hulk', price=1.0, stock_qty=5)
+        response = self.client.post(self.url, [
+            {'marvel_id': 1, 'title': 'Otro título', 'price': 2.5},
+            {'marvel_id': 2, 'title': 'Thor', 'stock_qty': 3},
+        ], format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            (response.data['created'], response.data['updated']), (1, 1)
+        )
+        self.assertEqual(response.data['results'], [
+            {'marvel_id': 1, 'status': 'updated'},
+            {'marvel_id': 2, 'status': 'created'},
+        ])
+        hulk = Comic.objects.get(marvel_id=1)
+        # Los comics existentes sólo actualizan "price" y "stock_qty".
+        self.assertEqual((hulk.title, hulk.price, hulk.stock_qty), ('Hulk', 2.5, 5))
+        self.assertEqual(Comic.objects.get(marvel_id=2).stock_qty, 3)
+
+    def test_accepts_ndjson(self):
+        response = self.client.post(
+            self.url, b'{"marvel_id": 1, "title": "Hulk"}\n\n'
+            b'{"marvel_id": 2, "title": "Thor"}\n',
+            content_type='application/x-ndjson',
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(Comic.objects.count(), 2)
+
+    def test_invalid_comic_rejects_the_whole_batch(self):
+        response = self.client.post(self.url, [
+            {'marvel_id': 1, 'title': 'Hulk'},
+            {'marvel_id': 2, 'title': 'Thor', 'stock_qty': -1},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('stock_qty', response.data[1])
+        self.assertFalse(Comic.objects.exists())
+
+    def test_duplicated_marvel_id_rejects_the_whole_batch(self):
+        response = self.client.post(self.url, [
+            {'marvel_id': 1, 'title': 'Hulk'},
+            {'marvel_id': 1, 'title': 'Hulk #2'},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Comic.objects.exists())
+
+    def test_requires_an_admin(self):
+        self.client.force_authenticate(User.objects.create_user('user'))
+        response = self.client.post(
+            self.url, [{'marvel_id': 1, 'title': 'Hulk'}], format='json'
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class BulkWishListAPITests(APITestCase):
+    url = '/e-commerce/wish/bulk'
+
+    def setUp(self):
+        self.user = User.objects.create_user('user', password='x')
+        self.client.force_authenticate(self.user)
+        self.hulk = Comic.objects.create(marvel_id=1, title='Hulk')
+        self.thor = Comic.objects.create(marvel_id=2, title='Thor')
+
+    def test_creates_and_updates_rows(self):
+        WishList.objects.create(
+            user=self.user, comic=self.hulk, favorite=True, wished_qty=1
+        )
+        response = self.client.post(self.url, [
+            {'comic': self.hulk.id, 'cart': True, 'wished_qty': 3},
+            {'comic': self.thor.id, 'favorite': True},
+        ], format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['results'], [
+            {'comic': self.hulk.id, 'status': 'updated'},
+            {'comic': self.thor.id, 'status': 'created'},
+        ])
+        # Una sola fila por (usuario, comic), y sólo cambian los campos que
+        # vienen en el request.
+        self.assertEqual(WishList.objects.filter(user=self.user).count(), 2)
+        hulk = WishList.objects.get(user=self.user, comic=self.hulk)
+        self.assertEqual(
+            (hulk.favorite, hulk.cart, hulk.wished_qty), (True, True, 3)
+        )
+        thor = WishList.objects.get(user=self.user, comic=self.thor)
+        self.assertEqual((thor.favorite, thor.cart), (True, False))
+
+    def test_does_not_touch_other_users(self):
+        other = User.objects.create_user('other')
+        WishList.objects.create(user=other, comic=self.hulk, cart=True)
+        response = self.client.post(
+            self.url, [{'comic': self.hulk.id, 'favorite': True}], format='json'
+        )
+        self.assertEqual(response.data['results'][0]['status'], 'created')
+        self.assertFalse(WishList.objects.get(user=other).favorite)
+
+    def test_invalid_change_rejects_the_whole_batch(self):
+        response = self.client.post(self.url, [
+            {'comic': self.hulk.id, 'cart': True},
+            {'comic': self.thor.id, 'wished_qty': -1},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('wished_qty', response.data[1])
+        self.assertFalse(WishList.objects.exists())
+
+    def test_unknown_comic_rejects_the_whole_batch(self):
+        response = self.client.post(self.url, [
+            {'comic': self.hulk.id, 'cart': True},
+            {'comic': self.thor.id + 100, 'cart': True},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid comic pk', str(response.data))
+        self.assertFalse(WishList.objects.exists())
+
+    def test_duplicated_comic_rejects_the_whole_batch(self):
+        response = self.client.post(self.url, [
+            {'comic': self.hulk.id, 'cart': True},
+            {'comic': self.hulk.id, 'favorite': True},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Duplicated comic', str(response.data))
+        self.assertFalse(WishList.objects.exists())
+
+    def test_too_many_changes(self):
+        response = self.client.post(
+            self.url, [{'comic': self.hulk.id}] * 501, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+
+# NOTE: Vistas HTML con los comics de Marvel (e_commerce/api/marvel_api_views.py).
+
+def marvel_comic(marvel_id, price=2.5):
+    return {
+        'id': marvel_id, 'title': f'Comic {marvel_id}', 'description': None,
+        'prices': [{'type': 'printPrice', 'price': price}],
+        'thumbnail': {'path': f'http://i.annihil.us/{marvel_id}'},
+    }
+
+
+class MarvelComicsPageTests(SimpleTestCase):
+
+    def setUp(self):
+        comics_page_cache.clear()
+        self.addCleanup(comics_page_cache.clear)
+        self.client_mock = mock.Mock()
+        self.client_mock.get_comics.return_value = {
+            'results': [marvel_comic(1), marvel_comic(2)]
+        }
+        patcher = mock.patch(
+            'e_commerce.api.marvel_api_views.get_marvel_client',
+            return_value=self.client_mock,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_async_view_uses_the_sync_client_under_wsgi(self):
+        with mock.patch(
+            'e_commerce.api.marvel_api_views.get_async_marvel_client'
+        ) as get_async_client:
+            response = self.client.get('/e-commerce/get-comics/async/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Comic 2', b''.join(response.streaming_content))
+        self.client_mock.get_comics.assert_called_once_with(offset=0, limit=15)
+        get_async_client.assert_not_called()
+
+    def test_malformed_comic_is_an_error_not_a_truncated_page(self):
+        comic = marvel_comic(2)
+        comic['prices'] = []
+        self.client_mock.get_comics.return_value = {
+            'results': [marvel_comic(1), comic]
+        }
+        response = self.client.get('/e-commerce/get-comics/')
+        self.assertEqual(response.status_code, 502)
+        self.assertFalse(response.streaming)
+
+    async def test_malformed_comic_is_an_error_under_asgi(self):
+        async_client_mock = mock.Mock()
+        async_client_mock.get_comics = mock.AsyncMock(return_value={
+            'results': [marvel_comic(1), {'id': 2, 'prices': [{'price': 1}]}]
+        })
+        with mock.patch(
+            'e_commerce.api.marvel_api_views.get_async_marvel_client',
+            return_value=async_client_mock,
+        ):
+            response = await self.async_client.get(
+                '/e-commerce/get-comics/async/', {'offset': 150}
+            )
+        self.assertEqual(response.status_code, 502)
+        self.assertFalse(response.streaming)
+
+
+class BenchPercentileTests(SimpleTestCase):
+
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(
+            [percentile(values, p) for p in (50, 95, 99, 100)], [50, 95, 99, 100]
+        )
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 50), 3)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+
+
+
+# NOTE: GETs condicionales y cache de respuestas de los comics
+# (e_commerce/api/caching.py). La versión del catálogo cambia recién con el
+# commit, por eso estos tests usan transacciones reales.
+
+class CatalogConditionalGetTests(APITransactionTestCase):
+    url = '/e-commerce/comics/get'
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client.force_authenticate(User.objects.create_user('user'))
+        self.comic = Comic.objects.create(marvel_id=1, title='Hulk')
+
+    def test_matching_etag_returns_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_detail_returns_not_modified(self):
+        url = f'/e-commerce/comics/{self.comic.id}/get'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def assertETagChanges(self, write):
+        etag = self.client.get(self.url)['ETag']
+        write()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_comic_save_changes_etag(self):
+        def write():
+            self.comic.title = 'Hulk #2'
+            self.comic.save()
+        self.assertETagChanges(write)
+
+    def test_add_stock_changes_etag(self):
+        self.assertETagChanges(lambda: Comic.objects.add_stock(1, 3))
+
+    def test_bulk_upsert_changes_etag(self):
+        self.assertETagChanges(lambda: Comic.objects.bulk_upsert(
+            [{'marvel_id': 2, 'title': 'Thor'}], ['title']
+        ))
+
+
+class CatalogCachedGetTests(APITransactionTestCase):
+    url = '/e-commerce/comics/get'
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client.force_authenticate(User.objects.create_user('user'))
+        self.comic = Comic.objects.create(marvel_id=1, title='Hulk')
+        Comic.objects.create(marvel_id=2, title='Thor')
+
+    def titles(self, url=None):
+        response = self.client.get(url or self.url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        comics = data['results'] if isinstance(data, dict) else data
+        return [comic['title'] for comic in comics]
+
+    def test_response_is_served_from_cache(self):
+        self.assertEqual(self.titles(), ['Hulk', 'Thor'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles(), ['Hulk', 'Thor'])
+
+    def test_query_strings_are_cached_separately(self):
+        first = f'{self.url}?page_size=1'
+        self.assertEqual(self.titles(first), ['Hulk'])
+        self.assertEqual(self.titles(), ['Hulk', 'Thor'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles(first), ['Hulk'])
+            self.assertEqual(self.titles(), ['Hulk', 'Thor'])
+
+    def test_comic_save_refreshes_cached_body(self):
+        self.titles()
+        self.comic.title = 'Hulk #2'
+        self.comic.save()
+        self.assertEqual(self.titles(), ['Hulk #2', 'Thor'])
+
+    def test_add_stock_refreshes_cached_body(self):
+        detail = f'/e-commerce/comics/{self.comic.id}/get'
+        self.assertEqual(self.client.get(detail).json()['stock_qty'], 0)
+        Comic.objects.add_stock(1, 3)
+        self.assertEqual(self.client.get(detail).json()['stock_qty'], 3)
+
+    def test_bulk_upsert_refreshes_cached_body(self):
+        self.titles()
+        Comic.objects.bulk_upsert(
+            [{'marvel_id': 3, 'title': 'Loki'}], ['title']
+        )
+        self.assertEqual(self.titles(), ['Hulk', 'Thor', 'Loki'])
+
+    def test_no_stale_body_after_a_write_in_a_transaction(self):
+        self.titles()
+        with transaction.atomic():
+            self.comic.title = 'Hulk #2'
+            self.comic.save()
+            # Un request durante la transacción guarda la respuesta con la
+            # versión que todavía no cambió.
+            self.titles()
+        self.assertEqual(self.titles(), ['Hulk #2', 'Thor'])
+
+    def test_rolled_back_write_keeps_serving_committed_data(self):
+        self.titles()
+        with self.assertRaises(ValueError), transaction.atomic():
+            self.comic.title = 'Hulk #2'
+            self.comic.save()
+            self.titles()
+            raise ValueError('rollback')
+        self.assertEqual(self.titles(), ['Hulk', 'Thor'])
+
+
+
+# NOTE: Cache de tokens (e_commerce/api/authentication.py y signals.py).
+
+class CachedTokenAuthenticationTests(APITransactionTestCase):
+    url = '/e-commerce/comics/get'
+
+    def setUp(self):
+        cache.clear()
+        local_token_cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(local_token_cache.clear)
+        self.user = User.objects.create_user('user', password='secret')
+        self.token = Token.objects.create(user=self.user)
+
+    def get(self, key):
+        return self.client.get(self.url, HTTP_AUTHORIZATION=f'Token {key}')
+
+    def cached(self, key):
+        cache_key = CachedTokenAuthentication.cache_key(key)
+        return cache.get(cache_key), local_token_cache.get(cache_key)
+
+    def test_token_is_validated_from_cache(self):
+        self.assertEqual(self.get(self.token.key).status_code, 200)
+        shared, local = self.cached(self.token.key)
+        self.assertIsNotNone(shared)
+        self.assertIsNotNone(local)
+        # Ni el token ni el listado (que está en el cache de respuestas)
+        # consultan la base de datos.
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(self.token.key).status_code, 200)
+
+    def test_cache_holds_neither_the_token_nor_the_password(self):
+        self.get(self.token.key)
+        shared, _ = self.cached(self.token.key)
+        self.assertNotIn(self.token.key, repr(shared))
+        self.assertNotIn(self.user.password, repr(shared))
+
+    def test_deleted_token_stops_authenticating(self):
+        key = self.token.key
+        self.get(key)
+        self.token.delete()
+        self.assertEqual(self.cached(key), (None, None))
+        self.assertEqual(self.get(key).status_code, 401)
+
+    def test_deactivated_user_stops_authenticating(self):
+        self.get(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.cached(self.token.key), (None, None))
+        self.assertEqual(self.get(self.token.key).status_code, 401)
+
+    def test_rotated_token(self):
+        old = self.token.key
+        self.get(old)
+        self.token.delete()
+        new = Token.objects.create(user=self.user).key
+        self.assertEqual(self.get(old).status_code, 401)
+        self.assertEqual(self.get(new).status_code, 200)
+
+    def test_login_does_not_invalidate_tokens(self):
+        self.get(self.token.key)
+        self.client.login(username='user', password='secret')
+        self.client.logout()
+        self.assertNotEqual(self.cached(self.token.key), (None, None))
+
+
+
+# NOTE: Paginado por cursor de comics/get (e_commerce/api/pagination.py).
+
+class ComicCursorPaginationTests(APITestCase):
+    url = '/e-commerce/comics/get'
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client.force_authenticate(User.objects.create_user('user'))
+        for marvel_id in (50, 10, 40, 20, 30):
+            Comic.objects.create(marvel_id=marvel_id, title=f'Comic {marvel_id}')
+
+    def marvel_ids(self, results):
+        return [comic['marvel_id'] for comic in results]
+
+    def test_without_parameters_returns_the_whole_list(self):
+        data = self.client.get(self.url).json()
+        self.assertIsInstance(data, list)
+        self.assertEqual(sorted(self.marvel_ids(data)), [10, 20, 30, 40, 50])
+
+    def test_pages_follow_marvel_id_order(self):
+        page = self.client.get(f'{self.url}?page_size=2').json()
+        self.assertIsNone(page['previous'])
+        pages = [self.marvel_ids(page['results'])]
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            pages.append(self.marvel_ids(page['results']))
+        self.assertEqual(pages, [[10, 20], [30, 40], [50]])
+        self.assertIsNotNone(page['previous'])
+
+    def test_pages_are_stable_when_comics_are_added(self):
+        page = self.client.get(f'{self.url}?page_size=2').json()
+        with self.captureOnCommitCallbacks(execute=True):
+            Comic.objects.create(marvel_id=5, title='Comic 5')
+            Comic.objects.create(marvel_id=25, title='Comic 25')
+        page = self.client.get(page['next']).json()
+        # Lo agregado antes del cursor no corre las páginas siguientes.
+        self.assertEqual(self.marvel_ids(page['results']), [25, 30])
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(ComicCursorPagination, 'max_page_size', 3):
+            page = self.client.get(f'{self.url}?page_size=100').json()
+        self.assertEqual(len(page['results']), 3)
+
+
+
+# NOTE: Listado de WishList con relaciones anidadas (wish/get?expand=).
+
+class WishListExpandTests(APITestCase):
+    url = '/e-commerce/wish/get'
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('user'))
+        users = [
+            User.objects.create_user(f'user-{index}', first_name=f'Name {index}')
+            for index in range(3)
+        ]
+        for index in range(5):
+            comic = Comic.objects.create(marvel_id=index, title=f'Comic {index}')
+            for user in users:
+                WishList.objects.create(user=user, comic=comic)
+
+    def test_without_expand_returns_ids(self):
+        row = self.client.get(self.url).json()[0]
+        self.assertIsInstance(row['comic'], int)
+        self.assertIsInstance(row['user'], int)
+
+    def test_expand_uses_a_single_query(self):
+        with self.assertNumQueries(1):
+            rows = self.client.get(f'{self.url}?expand=comic,user').json()
+        self.assertEqual(len(rows), 15)
+        self.assertEqual(
+            set(rows[0]['user']), {'id', 'username', 'first_name', 'last_name'}
+        )
+        self.assertEqual(
+            {row['comic']['title'] for row in rows},
+            {f'Comic {index}' for index in range(5)},
+        )
+
+    def test_unknown_expand_is_rejected(self):
+        response = self.client.get(f'{self.url}?expand=comic,password')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json()['expand'])
+
+
+
+# NOTE: Login sincrónico y asíncrono (user/login/ y user/login/async/). El
+# login asíncrono verifica la contraseña en otro thread, que usa su propia
+# conexión: por eso los datos tienen que estar commiteados.
+
+class LoginTests(APITransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('user', password='secret')
+
+    def login(self, url, password='secret'):
+        return self.client.post(
+            url, {'username': 'user', 'password': password}, format='json'
+        )
+
+    def assertLeanTokenResponse(self, response):
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['token'], Token.objects.get(user=self.user).key)
+        self.assertEqual(data['user']['username'], 'user')
+        for name in ('password', 'groups', 'user_permissions'):
+            self.assertNotIn(name, data['user'])
+
+    def test_login_returns_a_lean_token_response(self):
+        self.assertLeanTokenResponse(self.login('/e-commerce/user/login/'))
+
+    def test_async_login_returns_a_lean_token_response(self):
+        self.assertLeanTokenResponse(self.login('/e-commerce/user/login/async/'))
+
+    def test_async_login_rejects_invalid_credentials(self):
+        response = self.login('/e-commerce/user/login/async/', 'wrong')
+        self.assertEqual(response.status_code, 400)
+
+    def test_async_login_returns_503_when_busy(self):
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        with mock.patch.object(login_views, '_login_slots', slots):
+            response = self.login('/e-commerce/user/login/async/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(Token.objects.exists())
+
+
+
+# NOTE: Búsqueda de comics (comics/search). Fuera de Postgres se usa la
+# búsqueda con "icontains".
+
+class ComicSearchTests(APITestCase):
+    url = '/e-commerce/comics/search'
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('user'))
+        Comic.objects.create(marvel_id=1, title='Amazing Spider-Man')
+        Comic.objects.create(
+            marvel_id=2, title='Daredevil', description='With Spider-Man.'
+        )
+        Comic.objects.create(marvel_id=3, title='Hulk')
+
+    def test_finds_title_and_description_matches(self):
+        response = self.client.get(self.url, {'q': 'spider-man'})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual({comic['marvel_id'] for comic in results}, {1, 2})
+        if connection.vendor != 'postgresql':
+            self.assertEqual({comic['score'] for comic in results}, {0.0})
+
+    def test_query_is_required(self):
+        response = self.client.get(self.url, {'q': '  '})
+        self.assertEqual(response.status_code, 400)
+
+    def test_long_query_is_rejected(self):
+        self.assertEqual(
+            self.client.get(self.url, {'q': 'a' * 100}).status_code, 200
+        )
+        response = self.client.get(self.url, {'q': 'a' * 101})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('q', response.json())
+
+
+class ProfilingMiddlewareTests(TestCase):
+    '''
+    Header Server-Timing, tokens de "X-Profile" y límite de archivos de
+    ProfilingMiddleware (marvel/profiling.py).
+    '''
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_server_timing_counts_the_queries_of_the_request(self):
+        def view(request):
+            Comic.objects.count()
+            Comic.objects.exists()
+            with profiling.timed('serialize'):
+                pass
+            return HttpResponse()
+
+        with override_settings(PROFILING={'SAMPLE_RATE': 0}):
+            response = ProfilingMiddleware(view)(self.factory.get('/'))
+        metrics = [metric.split(';') for metric in response['Server-Timing'].split(', ')]
+        self.assertEqual([metric[0] for metric in metrics], ['total', 'db', 'serialize'])
+        self.assertTrue(all(metric[1].startswith('dur=') for metric in metrics))
+        self.assertEqual(metrics[1][2], 'desc="2 queries"')
+
+    def test_server_timing_can_be_disabled(self):
+        with override_settings(PROFILING={'SERVER_TIMING': False}):
+            response = ProfilingMiddleware(lambda request: HttpResponse())(
+                self.factory.get('/')
+            )
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_check_token(self):
+        self.assertTrue(profiling.check_token(profiling.make_token(), 3600))
+        self.assertFalse(profiling.check_token('profile', 3600))
+        self.assertFalse(profiling.check_token(profiling.make_token() + 'x', 3600))
+        # Firmado con otro "salt" (otro uso de la misma SECRET_KEY).
+        self.assertFalse(profiling.check_token(signing.dumps('profile'), 3600))
+        with mock.patch('django.core.signing.time.time', return_value=time.time() - 7200):
+            expired = profiling.make_token()
+        self.assertFalse(profiling.check_token(expired, 3600))
+
+    def test_profile_requested_with_a_token(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(PROFILING={'DIRECTORY': directory}):
+            middleware = ProfilingMiddleware(lambda request: HttpResponse())
+            response = middleware(self.factory.get('/comics/'))
+            self.assertFalse(response.has_header('X-Profile-File'))
+            response = middleware(
+                self.factory.get('/comics/', HTTP_X_PROFILE=profiling.make_token())
+            )
+            filename = response['X-Profile-File']
+            self.assertIn('-GET-comics-', filename)
+            self.assertEqual(os.listdir(directory), [filename])
+
+    def test_dump_keeps_the_newest_max_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = {**profiling.get_config(), 'DIRECTORY': directory, 'MAX_FILES': 2}
+            for name in ('20000101-000000-old.prof', '20000101-000001-old.prof'):
+                open(os.path.join(directory, name), 'w').close()
+            middleware = ProfilingMiddleware(lambda request: HttpResponse())
+            timings = profiling.RequestTimings()
+            timings.total = 0.01
+            filenames = [
+                middleware.dump(cProfile.Profile(), self.factory.get('/'), timings, config)
+                for _ in range(3)
+            ]
+            remaining = sorted(os.listdir(directory))
+            self.assertEqual(len(remaining), 2)
+            self.assertTrue(set(remaining) <= set(filenames))
+
+
+class MetricsRegistryTests(SimpleTestCase):
+    '''
+    Formato de exposición y combinación de los archivos de varios procesos
+    del registro de métricas (marvel/metrics.py).
+    '''
+
+    def setUp(self):
+        # NOTE: Un registro propio, así no se mezcla con REGISTRY.
+        self.registry = metrics.Registry()
+        self.requests = metrics.Counter(
+            'test_requests_total', 'Requests.', ['path'], registry=self.registry
+        )
+        self.in_flight = metrics.Gauge(
+            'test_in_flight', 'Requests en curso.', registry=self.registry
+        )
+        self.latency = metrics.Histogram(
+            'test_latency_seconds', 'Latencia.', registry=self.registry,
+            buckets=(0.1, 1.0),
+        )
+
+    def test_exposition_format(self):
+        self.latency.observe(0.05)
+        self.latency.observe(0.1)
+        self.latency.observe(0.5)
+        self.latency.observe(3)
+        self.requests.inc(path='/a"b\\c\nd')
+        with override_settings(METRICS={'DIRECTORY': None}):
+            lines = self.registry.exposition().splitlines()
+        self.assertEqual(lines, [
+            '# HELP test_in_flight Requests en curso.',
+            '# TYPE test_in_flight gauge',
+            '# HELP test_latency_seconds Latencia.',
+            '# TYPE test_latency_seconds histogram',
+            'test_latency_seconds_bucket{le="0.1"} 2',
+            'test_latency_seconds_bucket{le="1"} 3',
+            'test_latency_seconds_bucket{le="+Inf"} 4',
+            'test_latency_seconds_sum 3.65',
+            'test_latency_seconds_count 4',
+            '# HELP test_requests_total Requests.',
+            '# TYPE test_requests_total counter',
+            'test_requests_total{path="/a\\"b\\\\c\\nd"} 1',
+        ])
+
+    def test_gather_archives_the_files_of_dead_processes(self):
+        self.requests.inc(2, path='/')
+        self.in_flight.set(1)
+        self.latency.observe(0.5)
+        dead_pid = 999999999
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS={'DIRECTORY': directory}), \
+                mock.patch.object(
+                    metrics, 'pid_alive', side_effect=lambda pid: pid != dead_pid
+                ):
+            dead_file = os.path.join(directory, f'process-{dead_pid}-0000.json')
+            metrics.write_json(dead_file, {'pid': dead_pid, 'metrics': {
+                'test_requests_total': [[['/'], 3]],
+                'test_in_flight': [[[], 5]],
+                'test_latency_seconds': [[[], [1, 0, 0, 0.05]]],
+            }})
+            gathered = self.registry.gather()
+            self.assertEqual(gathered['test_requests_total'], {('/',): 5})
+            self.assertEqual(gathered['test_in_flight'], {(): 1})
+            self.assertEqual(gathered['test_latency_seconds'], {(): [1, 1, 0, 0.55]})
+
+            self.assertFalse(os.path.exists(dead_file))
+            archive = metrics.read_json(os.path.join(directory, metrics.ARCHIVE_FILE))
+            self.assertEqual(archive['metrics'], {
+                'test_requests_total': [[['/'], 3]],
+                'test_latency_seconds': [[[], [1, 0, 0, 0.05]]],
+            })
+            # Los contadores del proceso que terminó no vuelven para atrás.
+            self.assertEqual(self.registry.gather(), gathered)
@@ -5,6 +5,14 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+
+Las vistas `async` (por ejemplo e-commerce/get-comics/async/) sólo sacan
+provecho del event loop cuando el proyecto se sirve por ASGI, por ejemplo:
+
+    uvicorn marvel.asgi:application --host 0.0.0.0 --port 8000 --workers 4
+
+Con `runserver` (WSGI) igual funcionan, pero cada request crea su propio
+event loop y las precargas en segundo plano se cancelan al terminar.
 """
 
 import os
@@ -0,0 +1,231 @@
+import os
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    '''
+    Pool de conexiones acotado y thread-safe, independiente del driver.
+
+    - Nunca hay más de `max_size` conexiones abiertas (en uso + libres).
+      Si están todas en uso, `acquire()` espera hasta `timeout` segundos a
+      que se libere una y, si no, lanza PoolTimeout.
+    - Las conexiones libres se reutilizan en orden LIFO, así las que sobran
+      quedan sin uso y el servidor las puede cerrar.
+    - Antes de entregar una conexión libre se verifica con `check(conn,
+      full)`. `full` es True si estuvo libre más de `check_after`
+      segundos: en ese caso conviene hacer una consulta real (SELECT 1),
+      si no alcanza con una verificación local.
+    - Las conexiones con más de `max_lifetime` segundos se cierran en lugar
+      de volver al pool.
+    - Si el proceso hizo fork (por ejemplo gunicorn con --preload), las
+      conexiones heredadas se descartan sin usarlas.
+    '''
+
+    def __init__(self, max_size=10, timeout=10.0, check_after=30.0,
+                 max_lifetime=1800.0, check=None, close=None,
+                 clock=time.monotonic):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+        self.max_lifetime = max_lifetime
+        self.check = check or (lambda conn, full: True)
+        self.close = close or (lambda conn: conn.close())
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._in_use = {}
+        self._opening = 0
+        self._pid = os.getpid()
+        self.acquisitions = 0
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.timeouts = 0
+        self.created = 0
+        self.closed = 0
+        self.check_failures = 0
+
+    def _size(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # NOTE: No cerramos las conexiones heredadas, cerrarlas desde el
+            # hijo cortaría también las del proceso padre.
+            self._pid = os.getpid()
+            self._idle.clear()
+            self._in_use.clear()
+            self._opening = 0
+
+    def acquire(self, connect):
+        '''
+        Devuelve una conexión libre o, si no hay y todavía hay lugar, una
+        nueva creada con `connect()`.
+        '''
+        started = self.clock()
+        waited = False
+        while True:
+            with self._cond:
+                self._check_pid()
+                if self._idle:
+                    conn, created_at, idle_since = self._idle.pop()
+                    self._in_use[id(conn)] = created_at
+                elif self._size() < self.max_size:
+                    conn = None
+                    self._opening += 1
+                else:
+                    remaining = self.timeout - (self.clock() - started)
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(
+                            f'No database connection available after '
+                            f'{self.timeout} seconds ({self.max_size} in use).'
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+                    continue
+
+            if conn is None:
+                try:
+                    conn = connect()
+                finally:
+                    with self._cond:
+                        self._opening -= 1
+                        if conn is None:
+                            self._cond.notify()
+                with self._cond:
+                    self._in_use[id(conn)] = self.clock()
+                    self.created += 1
+                return self._acquired(conn, started, waited)
+
+            # NOTE: La verificación puede consultar la base de datos, por
+            # eso se hace fuera del lock.
+            now = self.clock()
+            if now - created_at < self.max_lifetime and self._check(
+                conn, now - idle_since >= self.check_after
+            ):
+                return self._acquired(conn, started, waited)
+            self._discard(conn)
+
+    def _check(self, conn, full):
+        try:
+            if self.check(conn, full):
+                return True
+        except Exception:
+            pass
+        with self._cond:
+            self.check_failures += 1
+        return False
+
+    def _acquired(self, conn, started, waited):
+        elapsed = self.clock() - started
+        with self._cond:
+            self.acquisitions += 1
+            if waited:
+                self.waits += 1
+                self.wait_time_total += elapsed
+                self.wait_time_max = max(self.wait_time_max, elapsed)
+        return conn
+
+    def release(self, conn, reusable=True):
+        '''
+        Devuelve `conn` al pool, o la cierra si `reusable` es False o ya
+        superó `max_lifetime`.
+        '''
+        with self._cond:
+            created_at = self._in_use.pop(id(conn), None)
+            if (
+                reusable and created_at is not None and
+                self.clock() - created_at < self.max_lifetime
+            ):
+                self._idle.append((conn, created_at, self.clock()))
+                self._cond.notify()
+                return
+            self._cond.notify()
+        self._close(conn)
+
+    def _discard(self, conn):
+        with self._cond:
+            self._in_use.pop(id(conn), None)
+            self._cond.notify()
+        self._close(conn)
+
+    def _close(self, conn):
+        try:
+            self.close(conn)
+        except Exception:
+            pass
+        with self._cond:
+            self.closed += 1
+
+    def close_idle(self):
+        '''
+        Cierra todas las conexiones libres.
+        '''
+        with self._cond:
+            idle = [conn for conn, _, _ in self._idle]
+            self._idle.clear()
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_size': self.max_size,
+                'size': self._size(),
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'acquisitions': self.acquisitions,
+                'waits': self.waits,
+                'wait_time_total': self.wait_time_total,
+                'wait_time_max': self.wait_time_max,
+                'timeouts': self.timeouts,
+                'created': self.created,
+                'closed': self.closed,
+                'check_failures': self.check_failures,
+            }
+
+
+# NOTE: Un pool por base de datos, compartido por todos los threads del
+# proceso. Lo usa el backend "marvel.db.postgresql_pool".
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, **options):
+    '''
+    Devuelve el pool registrado con `key`, creándolo con `options` la
+    primera vez.
+    '''
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(**options)
+        return pool
+
+
+def get_pool_stats():
+    '''
+    Devuelve las métricas de todos los pools del proceso, por alias de la
+    base de datos.
+    '''
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {key[0]: pool.stats() for key, pool in pools}
+
+
+def close_idle_connections(database_name):
+    '''
+    Cierra las conexiones libres de los pools de la base de datos
+    `database_name` (por ejemplo antes de borrarla).
+    '''
+    with _pools_lock:
+        pools = [pool for key, pool in _pools.items() if key[1] == database_name]
+    for pool in pools:
+        pool.close_idle()
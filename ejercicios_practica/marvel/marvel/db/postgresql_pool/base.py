@@ -0,0 +1,94 @@
+from django.db.backends.postgresql import base
+
+from psycopg2 import extensions
+
+from marvel.db.pool import get_pool
+from marvel.db.postgresql_pool.creation import DatabaseCreation
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    '''
+    Backend de PostgreSQL con un pool de conexiones por proceso.
+
+    Django abre una conexión por thread y, con CONN_MAX_AGE = 0, la cierra
+    al terminar cada request. Con este backend "cerrar" devuelve la conexión
+    al pool y el próximo request (de cualquier thread del proceso) la vuelve
+    a usar, sin pagar el connect y la autenticación de Postgres.
+
+    Se configura en DATABASES con la clave "POOL":
+        'POOL': {
+            'MAX_SIZE': 10,       # conexiones abiertas como máximo
+            'TIMEOUT': 10,        # segundos de espera por una conexión libre
+            'CHECK_AFTER': 30,    # segundos libre antes de verificar con SELECT 1
+            'MAX_LIFETIME': 1800, # segundos antes de reemplazar la conexión
+        }
+    Las métricas del pool se obtienen con marvel.db.pool.get_pool_stats().
+    '''
+    creation_class = DatabaseCreation
+
+    @property
+    def pool(self):
+        config = self.settings_dict.get('POOL', {})
+        key = (
+            self.alias, self.settings_dict['NAME'], self.settings_dict['HOST'],
+            self.settings_dict['PORT'], self.settings_dict['USER']
+        )
+        return get_pool(
+            key,
+            max_size=config.get('MAX_SIZE', 10),
+            timeout=config.get('TIMEOUT', 10),
+            check_after=config.get('CHECK_AFTER', 30),
+            max_lifetime=config.get('MAX_LIFETIME', 1800),
+            check=self._check_pooled_connection,
+        )
+
+    @staticmethod
+    def _check_pooled_connection(connection, full):
+        if connection.closed:
+            return False
+        if full:
+            # NOTE: Una conexión que estuvo mucho tiempo sin uso puede haber
+            # sido cortada por el servidor, un firewall o pgbouncer sin que
+            # psycopg2 se entere. Lo comprobamos antes de entregarla.
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+        return True
+
+    def get_new_connection(self, conn_params):
+        connection = self.pool.acquire(
+            lambda: super(DatabaseWrapper, self).get_new_connection(conn_params)
+        )
+        # Igual que en el backend original, self.isolation_level es el de
+        # OPTIONS o el de la conexión (una reutilizada ya lo tiene aplicado).
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get(
+            'isolation_level', connection.isolation_level
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        connection = self.connection
+        reusable = False
+        try:
+            # NOTE: No devolvemos al pool conexiones con una transacción
+            # abierta: el próximo que la use heredaría sus cambios o sus
+            # locks.
+            status = connection.info.transaction_status
+            if status in (
+                extensions.TRANSACTION_STATUS_INTRANS,
+                extensions.TRANSACTION_STATUS_INERROR,
+            ):
+                connection.rollback()
+                status = connection.info.transaction_status
+            reusable = (
+                not connection.closed and
+                status == extensions.TRANSACTION_STATUS_IDLE
+            )
+        except base.Database.Error:
+            reusable = False
+        finally:
+            self.pool.release(connection, reusable=reusable)
@@ -0,0 +1,20 @@
+from django.db.backends.postgresql import creation
+
+from marvel.db.pool import close_idle_connections
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    '''
+    Postgres no permite borrar ni usar de template una base de datos con
+    conexiones abiertas, y las conexiones que Django "cierra" quedan libres
+    en el pool. Antes de borrar o clonar la base de datos de los tests
+    cerramos las conexiones libres que tiene el pool a ella.
+    '''
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        close_idle_connections(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+    def _clone_test_db(self, suffix, verbosity, keepdb=False):
+        close_idle_connections(self.connection.settings_dict['NAME'])
+        super()._clone_test_db(suffix, verbosity, keepdb)
@@ -0,0 +1,532 @@
+import asyncio
+import atexit
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover (Windows)
+    fcntl = None
+
+from marvel.db.pool import get_pool_stats
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Buckets (en segundos) de los histogramas de latencia.
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+ARCHIVE_FILE = 'archive.json'
+LOCK_FILE = '.lock'
+
+
+def get_config():
+    return {
+        'DIRECTORY': None,
+        'FLUSH_INTERVAL': 1.0,
+        'TOKEN': None,
+        **getattr(settings, 'METRICS', {}),
+    }
+
+
+class Metric:
+    '''
+    Base de los tipos de métrica. Los valores se guardan por tupla de
+    valores de las etiquetas (`labelnames`).
+    '''
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def reset(self):
+        # NOTE: Se llama en el proceso hijo después de fork(): creamos un
+        # lock nuevo por si otro thread del padre tenía tomado el anterior.
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def dump(self):
+        '''
+        Valores actuales como lista de [etiquetas, valor] (para JSON).
+        '''
+        with self._lock:
+            return [
+                [list(key), value.copy() if isinstance(value, list) else value]
+                for key, value in self._values.items()
+            ]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        '''
+        Para copiar un contador que ya lleva otro objeto (p. ej. los
+        "hits" del cache de páginas) desde un callback del registro.
+        '''
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+    '''
+    Valor que sube y baja. Entre procesos se suman los valores de los
+    procesos vivos (los de los procesos que terminaron se descartan).
+    '''
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    '''
+    Cada valor es una lista con la cantidad de observaciones por bucket
+    (no acumulada), seguida de la suma de las observaciones.
+    '''
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None,
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = next(
+            index for index, bound in enumerate(self.buckets) if value <= bound
+        )
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+
+class Registry:
+    '''
+    Métricas de este proceso y, si METRICS['DIRECTORY'] está configurado,
+    las de todos los procesos que comparten ese directorio.
+
+    Cada proceso escribe sus valores en un archivo JSON propio del
+    directorio cada FLUSH_INTERVAL segundos (desde un thread en segundo
+    plano) y al terminar. El proceso que atiende "/metrics" lee todos los
+    archivos y los combina: suma contadores e histogramas, y suma los
+    gauges sólo de los procesos que siguen vivos. Los archivos de procesos
+    que terminaron se acumulan en "archive.json", así sus contadores no
+    vuelven para atrás.
+
+    NOTE: El directorio debe vaciarse al iniciar el servidor (igual que
+    PROMETHEUS_MULTIPROC_DIR de prometheus_client); si no, los contadores
+    siguen sumando desde la ejecución anterior.
+    '''
+
+    def __init__(self):
+        self._metrics = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._new_process()
+
+    def _new_process(self):
+        self.pid = os.getpid()
+        self.filename = f'process-{self.pid}-{uuid.uuid4().hex[:8]}.json'
+        self._flusher = None
+
+    def after_fork(self):
+        # NOTE: Un worker creado con fork() hereda los valores del proceso
+        # padre, que ya se cuentan en el archivo del padre.
+        self._lock = threading.Lock()
+        for metric in self._metrics.values():
+            metric.reset()
+        self._new_process()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Duplicated metric: {metric.name}')
+            self._metrics[metric.name] = metric
+
+    def register_callback(self, callback):
+        '''
+        `callback()` se llama antes de exportar las métricas; sirve para
+        copiar estadísticas que ya llevan otros objetos.
+        '''
+        self._callbacks.append(callback)
+        return callback
+
+    def collect(self):
+        '''
+        Valores de este proceso: {nombre: [[etiquetas, valor], ...]}.
+        '''
+        for callback in self._callbacks:
+            callback()
+        return {name: metric.dump() for name, metric in self._metrics.items()}
+
+    # Archivos compartidos entre procesos:
+
+    def start(self):
+        '''
+        Arranca (una vez por proceso) el thread que escribe el archivo de
+        este proceso, si hay un directorio configurado.
+        '''
+        if self._flusher is not None or not get_config()['DIRECTORY']:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._flush_loop, name='metrics-flusher',
+                    daemon=True
+                )
+                self._flusher.start()
+
+    def _flush_loop(self):
+        pid = self.pid
+        while pid == os.getpid():
+            time.sleep(get_config()['FLUSH_INTERVAL'])
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def flush(self):
+        directory = get_config()['DIRECTORY']
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        write_json(
+            os.path.join(directory, self.filename),
+            {'pid': self.pid, 'metrics': self.collect()},
+        )
+
+    def gather(self):
+        '''
+        Valores combinados de todos los procesos (o sólo de este, sin
+        directorio): {nombre: {etiquetas: valor}}.
+        '''
+        directory = get_config()['DIRECTORY']
+        if not directory:
+            return self.merge({}, self.collect())
+        self.flush()
+        with file_lock(os.path.join(directory, LOCK_FILE)):
+            archive_path = os.path.join(directory, ARCHIVE_FILE)
+            archive = read_json(archive_path) or {'metrics': {}}
+            archived = {}
+            self.merge(archived, archive['metrics'], gauges=False)
+            merged = self.merge({}, archive['metrics'], gauges=False)
+            dead = []
+            for entry in os.listdir(directory):
+                if not entry.startswith('process-'):
+                    continue
+                path = os.path.join(directory, entry)
+                data = read_json(path)
+                if data is None:
+                    continue
+                alive = pid_alive(data['pid'])
+                self.merge(merged, data['metrics'], gauges=alive)
+                if not alive and fcntl is not None:
+                    self.merge(archived, data['metrics'], gauges=False)
+                    dead.append(path)
+            if dead:
+                write_json(archive_path, {'metrics': {
+                    name: [[list(key), value] for key, value in values.items()]
+                    for name, values in archived.items()
+                }})
+                for path in dead:
+                    os.unlink(path)
+        return merged
+
+    def merge(self, merged, metrics, gauges=True):
+        for name, values in metrics.items():
+            metric = self._metrics.get(name)
+            if metric is None or (metric.type == 'gauge' and not gauges):
+                continue
+            target = merged.setdefault(name, {})
+            for key, value in values:
+                key = tuple(key)
+                current = target.get(key)
+                if current is None:
+                    target[key] = value.copy() if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target[key] = current + value
+        return merged
+
+    def exposition(self):
+        '''
+        Métricas en el formato de texto de Prometheus.
+        '''
+        gathered = self.gather()
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for key, value in sorted(gathered.get(name, {}).items()):
+                labels = list(zip(metric.labelnames, key))
+                if metric.type != 'histogram':
+                    lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets, value):
+                    cumulative += count
+                    le = '+Inf' if bound == math.inf else format_value(bound)
+                    lines.append(
+                        f'{name}_bucket{format_labels(labels + [("le", le)])} '
+                        f'{cumulative}'
+                    )
+                lines.append(f'{name}_sum{format_labels(labels)} {format_value(value[-1])}')
+                lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def read_json(path):
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    # Se escribe en un archivo temporal y se renombra, así nunca se lee un
+    # archivo a medio escribir.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class file_lock:
+    '''
+    Lock exclusivo entre procesos (no hace nada si no hay fcntl).
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# NOTE: Registro compartido por todo el proceso.
+REGISTRY = Registry()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=REGISTRY.after_fork)
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        REGISTRY.flush()
+    except Exception:
+        pass
+
+
+# Métricas de los requests (ver MetricsMiddleware):
+
+http_requests = Counter(
+    'http_requests_total', 'Requests atendidos.',
+    ('route', 'method', 'status')
+)
+http_request_duration = Histogram(
+    'http_request_duration_seconds', 'Duración de los requests.',
+    ('route', 'method')
+)
+http_requests_in_flight = Gauge(
+    'http_requests_in_flight', 'Requests en curso.'
+)
+db_queries = Histogram(
+    'http_request_db_queries', 'Consultas SQL por request.',
+    ('route',), buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100)
+)
+db_query_duration = Counter(
+    'http_request_db_query_duration_seconds_total',
+    'Tiempo total en consultas SQL de los requests.', ('route',)
+)
+
+# Pools de conexiones de marvel.db.postgresql_pool:
+
+db_pool_connections = Gauge(
+    'db_pool_connections', 'Conexiones abiertas del pool.',
+    ('alias', 'state')
+)
+db_pool_max_size = Gauge(
+    'db_pool_max_size', 'Tamaño máximo del pool.', ('alias',)
+)
+db_pool_acquisitions = Counter(
+    'db_pool_acquisitions_total', 'Conexiones pedidas al pool.', ('alias',)
+)
+db_pool_waits = Counter(
+    'db_pool_waits_total', 'Pedidos que esperaron una conexión libre.',
+    ('alias',)
+)
+db_pool_wait_time = Counter(
+    'db_pool_wait_seconds_total', 'Tiempo esperando conexiones.', ('alias',)
+)
+db_pool_timeouts = Counter(
+    'db_pool_timeouts_total', 'Pedidos sin conexión a tiempo.', ('alias',)
+)
+db_pool_created = Counter(
+    'db_pool_connections_created_total', 'Conexiones abiertas.', ('alias',)
+)
+db_pool_closed = Counter(
+    'db_pool_connections_closed_total', 'Conexiones cerradas.', ('alias',)
+)
+
+
+@REGISTRY.register_callback
+def collect_pool_stats():
+    for alias, stats in get_pool_stats().items():
+        db_pool_connections.set(stats['in_use'], alias=alias, state='in_use')
+        db_pool_connections.set(stats['idle'], alias=alias, state='idle')
+        db_pool_max_size.set(stats['max_size'], alias=alias)
+        db_pool_acquisitions.set_total(stats['acquisitions'], alias=alias)
+        db_pool_waits.set_total(stats['waits'], alias=alias)
+        db_pool_wait_time.set_total(stats['wait_time_total'], alias=alias)
+        db_pool_timeouts.set_total(stats['timeouts'], alias=alias)
+        db_pool_created.set_total(stats['created'], alias=alias)
+        db_pool_closed.set_total(stats['closed'], alias=alias)
+
+
+KNOWN_METHODS = frozenset(
+    ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+)
+
+
+class MetricsMiddleware:
+    '''
+    Cuenta los requests por ruta (el patrón de la URL, p. ej.
+    "e-commerce/comics/<int:pk>/get", no la URL pedida), método y código
+    de respuesta, y mide su duración. Las consultas SQL se toman de
+    `request.timings`, así que va después de ProfilingMiddleware.
+
+    Funciona con WSGI y con ASGI (sin pasar los requests async a un
+    thread); con ASGI la duración incluye el tiempo que la vista espera.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # NOTE: Igual que MiddlewareMixin de Django: así Django sabe
+            # que __call__ devuelve una corrutina.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        REGISTRY.start()
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            http_requests_in_flight.dec()
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        REGISTRY.start()
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            http_requests_in_flight.dec()
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, duration):
+        match = request.resolver_match
+        route = match.route if match is not None else '<unmatched>'
+        method = request.method if request.method in KNOWN_METHODS else 'other'
+        http_requests.inc(route=route, method=method, status=response.status_code)
+        http_request_duration.observe(duration, route=route, method=method)
+        timings = getattr(request, 'timings', None)
+        if timings is not None:
+            db_queries.observe(timings.db_queries, route=route)
+            db_query_duration.inc(timings.db_time, route=route)
+
+
+def metrics_view(request):
+    '''
+    Métricas de todos los procesos en el formato de Prometheus. Si
+    METRICS['TOKEN'] está configurado, exige "Authorization: Bearer
+    <token>" (opción "authorization" de la configuración de Prometheus).
+    '''
+    token = get_config()['TOKEN']
+    if token and not constant_time_compare(
+        request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(REGISTRY.exposition(), content_type=CONTENT_TYPE)
@@ -0,0 +1,278 @@
+import asyncio
+import contextlib
+import contextvars
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+# NOTE: "salt" propio, así un valor firmado para otra cosa con la misma
+# SECRET_KEY no sirve como token de profiling.
+TOKEN_SALT = 'marvel.profiling'
+TOKEN_HEADER = 'HTTP_X_PROFILE'
+
+DEFAULTS = {
+    'SERVER_TIMING': True,
+    'SAMPLE_RATE': 0.0,
+    'DIRECTORY': 'profiles',
+    'MAX_FILES': 200,
+    'TOKEN_MAX_AGE': 3600,
+}
+
+_current = contextvars.ContextVar('marvel_request_timings', default=None)
+# NOTE: Desde Python 3.12 cProfile usa sys.monitoring, que admite un solo
+# profiler activo por proceso; por eso perfilamos de a un request a la vez.
+_profile_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+def make_token():
+    '''
+    Valor del header "X-Profile" para pedir el perfil de un request.
+    Vence a los PROFILING['TOKEN_MAX_AGE'] segundos.
+    '''
+    return signing.dumps('profile', salt=TOKEN_SALT)
+
+
+def check_token(token, max_age):
+    try:
+        return signing.loads(token, salt=TOKEN_SALT, max_age=max_age) == 'profile'
+    except signing.BadSignature:
+        return False
+
+
+class RequestTimings:
+    '''
+    Tiempos de un request: total, consultas a la base de datos y los que
+    se agregan con `timed()` (p. ej. "serialize" y "render"). En segundos.
+    '''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.total = None
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.durations = {}
+        # NOTE: Con ASGI las consultas pueden venir de otros threads.
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.db_queries += 1
+                self.db_time += elapsed
+
+    def server_timing(self):
+        '''
+        Valor del header Server-Timing (duraciones en milisegundos).
+        '''
+        metrics = [
+            f'total;dur={self.total * 1000:.2f}',
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.db_queries} queries"',
+        ]
+        metrics.extend(
+            f'{name};dur={seconds * 1000:.2f}'
+            for name, seconds in self.durations.items()
+        )
+        return ', '.join(metrics)
+
+
+def _query_wrapper(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings.execute_wrapper(execute, sql, params, many, context)
+
+
+def install_query_wrapper(connection, **kwargs):
+    '''
+    Deja instalado en `connection` el wrapper que suma cada consulta a los
+    tiempos del request en curso (si hay uno).
+
+    NOTE: Se instala en cada conexión en lugar de hacerlo por request
+    porque con ASGI las consultas de una vista corren en otro thread, con
+    sus propias conexiones; el request se encuentra por la ContextVar, que
+    sync_to_async copia a ese thread. Va primero en la lista para no
+    interferir con los `connection.execute_wrapper()` temporales, que
+    sacan el último al terminar.
+    '''
+    if _query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _query_wrapper)
+
+
+connection_created.connect(install_query_wrapper)
+
+
+def current_timings():
+    '''
+    RequestTimings del request en curso, o None fuera de un request.
+    '''
+    return _current.get()
+
+
+@contextlib.contextmanager
+def timed(name):
+    '''
+    Suma el tiempo del bloque a la métrica `name` del request en curso.
+    Fuera de un request (comandos, shell) no hace nada.
+    '''
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+class ProfilingMiddleware:
+    '''
+    Mide cada request y agrega el header Server-Timing con el tiempo
+    total, el de las consultas SQL (y su cantidad), el de serializar y el
+    de renderizar la respuesta. Tiene que ir primero en MIDDLEWARE.
+
+    Además corre cProfile en una fracción de los requests
+    (PROFILING['SAMPLE_RATE']) o cuando el request trae el header
+    "X-Profile" con un token firmado (ver `make_token()` y el comando
+    "manage.py profiling_token"), y guarda el perfil (.prof, se lee con
+    pstats o snakeviz) en PROFILING['DIRECTORY'].
+
+    Funciona con WSGI y con ASGI: con ASGI no pasa los requests a un
+    thread (las vistas async siguen siendo async). NOTE: cProfile sólo ve
+    el thread donde se activa, y con ASGI ese thread es el del event loop,
+    que también ejecuta otros requests mientras el perfilado espera.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # NOTE: Igual que MiddlewareMixin de Django: así Django sabe
+            # que __call__ devuelve una corrutina.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        for connection in connections.all():
+            install_query_wrapper(connection)
+        config = get_config()
+        state = self.start(request, config)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.stop(state)
+        return self.finish(request, response, state, config)
+
+    async def __acall__(self, request):
+        config = get_config()
+        state = self.start(request, config)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.stop(state)
+        return self.finish(request, response, state, config)
+
+    def start(self, request, config):
+        '''
+        Empieza a medir (y si corresponde a perfilar) el request. Devuelve
+        el estado que reciben `stop()` y `finish()`.
+        '''
+        timings = request.timings = RequestTimings()
+        requested = bool(request.META.get(TOKEN_HEADER)) and check_token(
+            request.META[TOKEN_HEADER], config['TOKEN_MAX_AGE']
+        )
+        profile = None
+        if (
+            (requested or random.random() < config['SAMPLE_RATE']) and
+            _profile_lock.acquire(blocking=False)
+        ):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Hay otro profiler activo (p. ej. coverage).
+                _profile_lock.release()
+                profile = None
+        return timings, _current.set(timings), profile, requested
+
+    def stop(self, state):
+        timings, token, profile, _ = state
+        if profile is not None:
+            profile.disable()
+            _profile_lock.release()
+        _current.reset(token)
+        timings.total = time.perf_counter() - timings.start
+
+    def finish(self, request, response, state, config):
+        timings, _, profile, requested = state
+        if profile is not None:
+            filename = self.dump(profile, request, timings, config)
+            if requested and filename:
+                response['X-Profile-File'] = filename
+        if config['SERVER_TIMING']:
+            response['Server-Timing'] = ', '.join(filter(None, (
+                response.get('Server-Timing'), timings.server_timing()
+            )))
+        return response
+
+    def process_template_response(self, request, response):
+        # NOTE: Django renderiza las respuestas de DRF (y las
+        # TemplateResponse) justo después de este método.
+        timings = getattr(request, 'timings', None)
+        if timings is not None:
+            start = time.perf_counter()
+            response.add_post_render_callback(
+                lambda response: timings.add(
+                    'render', time.perf_counter() - start
+                )
+            )
+        return response
+
+    def dump(self, profile, request, timings, config):
+        '''
+        Guarda el perfil en el directorio configurado y borra los más
+        viejos si hay más de MAX_FILES. Devuelve el nombre del archivo.
+        '''
+        directory = config['DIRECTORY']
+        path = re.sub(r'[^A-Za-z0-9]+', '-', request.path).strip('-') or 'root'
+        filename = (
+            f'{time.strftime("%Y%m%d-%H%M%S")}-{request.method}-{path[:80]}-'
+            f'{timings.total * 1000:.0f}ms-{uuid.uuid4().hex[:8]}.prof'
+        )
+        try:
+            os.makedirs(directory, exist_ok=True)
+            profile.dump_stats(os.path.join(directory, filename))
+            profiles = sorted(
+                entry for entry in os.listdir(directory)
+                if entry.endswith('.prof')
+            )
+            for old in profiles[:max(0, len(profiles) - config['MAX_FILES'])]:
+                os.unlink(os.path.join(directory, old))
+        except OSError:
+            return None
+        return filename
@@ -73,19 +73,36 @@ INSTALLED_APPS = BASE_APPS + THIRD_APPS + LOCAL_APPS
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        # NOTE: Igual que TokenAuthentication pero sin consultar la tabla
+        # de tokens en cada request (ver TOKEN_AUTH_CACHE más abajo).
+        'e_commerce.api.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
 
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
-    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend']
+    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    # NOTE: Mismo JSON que los de DRF pero generado/leído con orjson
+    # (si no está instalado usan el módulo json de Python).
+    'DEFAULT_RENDERER_CLASSES': (
+        'e_commerce.api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'e_commerce.api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 
 
 MIDDLEWARE = [
+    # NOTE: Primero, para medir el request completo (ver PROFILING).
+    'marvel.profiling.ProfilingMiddleware',
+    # Métricas de Prometheus (ver METRICS), usa las de ProfilingMiddleware.
+    'marvel.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -133,18 +150,81 @@ WSGI_APPLICATION = 'marvel.wsgi.application'
     #   POSTGRES_USER: inove_user
     #   POSTGRES_PASSWORD: 123Marvel!
 
+# NOTE: La conexión se configura con variables de entorno; los valores por
+# defecto son los del docker-compose.yml.
+#
+# DB_ENGINE: por defecto "marvel.db.postgresql_pool" (marvel/db/), el
+#   backend de Postgres de Django con un pool de conexiones por proceso,
+#   compartido por todos sus threads. "django.db.backends.postgresql" es el
+#   backend sin pool.
+# DB_CONN_MAX_AGE: segundos que cada thread conserva su conexión entre
+#   requests. Con el pool conviene dejarlo en 0: al terminar cada request
+#   la conexión vuelve al pool y la puede usar cualquier thread.
+# DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_CHECK_AFTER, DB_POOL_MAX_LIFETIME:
+#   ver marvel/db/postgresql_pool/base.py. MAX_SIZE por la cantidad de
+#   procesos no debe superar el "max_connections" de Postgres.
+# DB_PGBOUNCER=1: cuando HOST es un pgbouncer en modo "transaction". En ese
+#   modo cada transacción puede ir a una conexión distinta del servidor, así
+#   que no se pueden usar cursores del lado del servidor (.iterator()) ni
+#   configuraciones de sesión; TIME_ZONE debe coincidir con la del servidor
+#   (o la de la base, "ALTER DATABASE ... SET timezone") para que Django no
+#   ejecute "SET TIME ZONE" en cada conexión.
 DATABASES = {
     'default': {
         # 'ENGINE': 'django.db.backends.postgresql_psycopg2' --> En desuso.
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'marvel_db',        # POSTGRES_DB
-        'USER' : 'inove_user',      # POSTGRES_USER
-        'PASSWORD' : '123Marvel!',  # POSTGRES_PASSWORD
-        'HOST':'db',                # Nombre del servicio
-        'PORT': '5432'              # Número del puerto
+        'ENGINE': os.environ.get('DB_ENGINE', 'marvel.db.postgresql_pool'),
+        'NAME': os.environ.get('DB_NAME', 'marvel_db'),             # POSTGRES_DB
+        'USER': os.environ.get('DB_USER', 'inove_user'),            # POSTGRES_USER
+        'PASSWORD': os.environ.get('DB_PASSWORD', '123Marvel!'),    # POSTGRES_PASSWORD
+        'HOST': os.environ.get('DB_HOST', 'db'),                    # Nombre del servicio
+        'PORT': os.environ.get('DB_PORT', '5432'),                  # Número del puerto
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '0')),
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_PGBOUNCER', '0') == '1',
+        'POOL': {
+            'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', '10')),
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+            'CHECK_AFTER': float(os.environ.get('DB_POOL_CHECK_AFTER', '30')),
+            'MAX_LIFETIME': float(os.environ.get('DB_POOL_MAX_LIFETIME', '1800')),
+        },
+    }
+}
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+# NOTE: Guarda la versión del catálogo de comics (e_commerce/catalog.py).
+# El cache en memoria sólo se comparte entre los threads de un proceso,
+# que alcanza para "runserver". Si se levantan varios procesos (gunicorn,
+# uvicorn con workers) hay que usar un cache compartido, por ejemplo:
+#   DJANGO_CACHE_BACKEND=django.core.cache.backends.memcached.PyMemcacheCache
+#   DJANGO_CACHE_LOCATION=memcached:11211
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'DJANGO_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'marvel'),
     }
 }
 
+# NOTE: Cache de tokens de CachedTokenAuthentication (e_commerce/api/authentication.py).
+# Segundos que un token validado se guarda en el cache compartido (TIMEOUT)
+# y en la memoria de cada proceso (LOCAL_TIMEOUT).
+TOKEN_AUTH_CACHE = {
+    'TIMEOUT': 60,
+    'LOCAL_TIMEOUT': 5,
+    'LOCAL_MAX_ENTRIES': 1024,
+}
+
+# NOTE: Pool de threads donde la vista "user/login/async/" verifica las
+# contraseñas (e_commerce/api/login_views.py). MAX_PENDING es la cantidad
+# máxima de logins en curso o esperando; por encima se responde 503.
+LOGIN_EXECUTOR = {
+    'MAX_WORKERS': 4,
+    'MAX_PENDING': 64,
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -198,5 +278,80 @@ AMARILLO = "\033[;33m"
 CIAN = "\033[;36m"
 VERDE = "\033[;32m"
 
+# Si está activo, la vista "get_comics" imprime por consola el HTML que
+# genera y lo guarda en "get_comics.html". Desactivado por defecto porque
+# obliga a armar toda la página en memoria y escribir a disco en cada
+# request.
+MARVEL_HTML_DEBUG = os.environ.get('MARVEL_HTML_DEBUG', '0') == '1'
+
 # NOTE: Para manejo de sesión.
 LOGIN_URL = '/admin/login'
+
+
+# NOTE: Configuración del cliente de la API de Marvel (e_commerce/api/marvel_client.py).
+# La URL base se puede sobrescribir por variable de entorno, por ejemplo para
+# apuntar a un servidor local de pruebas.
+MARVEL_API = {
+    'URL_BASE': os.environ.get(
+        'MARVEL_URL_BASE', 'http://gateway.marvel.com/v1/public/'
+    ),
+    'PUBLIC_KEY': os.environ.get(
+        'MARVEL_PUBLIC_KEY', '58ee40376f7c10e99f440f5e3abd2caa'
+    ),
+    'PRIVATE_KEY': os.environ.get(
+        'MARVEL_PRIVATE_KEY', '2c0373e00d85edb4560f68ddc2094014e8694f90'
+    ),
+    'TS': 1,
+    # Timeouts en segundos: (conexión, lectura).
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 10,
+    # Reintentos acotados con backoff exponencial (0.3s, 0.6s, 1.2s...).
+    'MAX_RETRIES': 3,
+    'BACKOFF_FACTOR': 0.3,
+    # Cantidad máxima de conexiones keep-alive por host en el pool.
+    'POOL_MAXSIZE': 20,
+    # Circuit breaker: tras N fallas seguidas se deja de llamar a la API
+    # durante RESET_TIMEOUT segundos.
+    'BREAKER_FAILURE_THRESHOLD': 5,
+    'BREAKER_RESET_TIMEOUT': 30,
+}
+
+# NOTE: Cache en memoria de las páginas de comics de Marvel, con clave
+# (offset, limit). Tiempos en segundos: durante TTL la página se sirve
+# directo del cache y durante STALE_TTL se sirve vencida mientras se
+# refresca en segundo plano.
+MARVEL_PAGE_CACHE = {
+    'MAX_ENTRIES': 256,
+    'TTL': 300,
+    'STALE_TTL': 3600,
+}
+
+
+# NOTE: Middleware de profiling (marvel/profiling.py). Agrega a cada
+# respuesta el header Server-Timing (tiempo total, de SQL, de serializar y
+# de renderizar) y corre cProfile en una fracción SAMPLE_RATE (0 a 1) de
+# los requests, o en los que traen el header "X-Profile" con un token de
+# "manage.py profiling_token". Los perfiles se guardan en DIRECTORY; se
+# conservan los últimos MAX_FILES.
+PROFILING = {
+    'SERVER_TIMING': os.environ.get('PROFILING_SERVER_TIMING', '1') == '1',
+    'SAMPLE_RATE': float(os.environ.get('PROFILING_SAMPLE_RATE', '0')),
+    'DIRECTORY': os.environ.get(
+        'PROFILING_DIRECTORY', os.path.join(BASE_DIR, 'profiles')
+    ),
+    'MAX_FILES': 200,
+    # Segundos de validez de los tokens de "X-Profile".
+    'TOKEN_MAX_AGE': 3600,
+}
+
+# NOTE: Métricas en formato Prometheus en "/metrics" (marvel/metrics.py).
+# Con varios procesos (gunicorn, uvicorn --workers) cada uno escribe sus
+# valores en DIRECTORY cada FLUSH_INTERVAL segundos y "/metrics" devuelve
+# la suma de todos. El directorio debe vaciarse al iniciar el servidor.
+# Sin DIRECTORY sólo se exportan las métricas del proceso que responde.
+# Si TOKEN está configurado, "/metrics" exige "Authorization: Bearer <TOKEN>".
+METRICS = {
+    'DIRECTORY': os.environ.get('METRICS_DIRECTORY') or None,
+    'FLUSH_INTERVAL': 1.0,
+    'TOKEN': os.environ.get('METRICS_TOKEN') or None,
+}
@@ -16,7 +16,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from marvel.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('e-commerce/',include('e_commerce.api.urls')),
+    # Métricas para Prometheus:
+    path('metrics', metrics_view),
 ]